@@ -0,0 +1,33 @@
+"""
+Add a table that tracks the latest stored timestamp per upstream data source.
+
+Revision ID: 4f2c81d9a0b7
+Revises: 6ab68552a4a6
+Create Date: 2026-10-17 09:12:40.512093
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "4f2c81d9a0b7"
+down_revision = "6ab68552a4a6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "ingestion_state",
+        sa.Column("source", sa.String(length=255), nullable=False),
+        sa.Column("key", sa.String(length=255), nullable=False),
+        sa.Column("last_timestamp", sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint("source", "key"),
+    )
+
+
+def downgrade():
+    op.drop_table("ingestion_state")
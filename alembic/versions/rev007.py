@@ -0,0 +1,125 @@
+"""
+Declare the tables that `update_db` writes to, with a primary key on each.
+
+These tables used to be dropped and recreated by `DataFrame.to_sql` on every
+update, so whatever is in them now is replaced. They are refilled by the next
+update; clearing `ingestion_state` makes that update fetch the full lookback.
+
+Revision ID: 9b3e1f6c2d84
+Revises: 4f2c81d9a0b7
+Create Date: 2026-10-17 13:40:02.118734
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9b3e1f6c2d84"
+down_revision = "4f2c81d9a0b7"
+branch_labels = None
+depends_on = None
+
+
+PROCESSED_DATA_FLOAT_COLUMNS = [
+    "pressure",
+    "par",
+    "rain",
+    "rh",
+    "dew_point",
+    "wind_speed",
+    "gust_speed",
+    "wind_direction",
+    "log_air_temp",
+    "log_stream_flow",
+    "log_gage_height",
+    "geomean_rh_0_to_72h",
+    "geomean_air_temp_0_to_72h",
+    "geomean_gage_height_0_to_12h",
+    "geomean_gage_height_0_to_24h",
+    "geomean_pressure_0_to_72h",
+    "geomean_dew_0_to_1h",
+    "geomean_par_0_to_72h",
+    "geomean_stream_flow_0h_to_12h",
+    "geomean_stream_flow_0h_to_24h",
+    "sum_rain_0h_to_12h",
+    "sum_rain_0h_to_24h",
+]
+
+HOBOLINK_FLOAT_COLUMNS = [
+    "battery",
+    "dew_point",
+    "gust_speed",
+    "par",
+    "pressure",
+    "rain",
+    "rh",
+    "temperature",
+    "wind_direction",
+    "wind_speed",
+]
+
+
+def _time_column(**kwargs) -> sa.Column:
+    return sa.Column("time", sa.DateTime(timezone=True), nullable=False, **kwargs)
+
+
+def upgrade():
+    for table_name in ["hobolink", "usgs_w", "usgs_b", "processed_data", "prediction"]:
+        op.execute(f"DROP TABLE IF EXISTS {table_name};")
+    op.execute("DELETE FROM ingestion_state;")
+
+    op.create_table(
+        "hobolink",
+        _time_column(),
+        *[sa.Column(i, sa.Float(), nullable=True) for i in HOBOLINK_FLOAT_COLUMNS],
+        sa.PrimaryKeyConstraint("time"),
+    )
+    op.create_table(
+        "usgs_w",
+        _time_column(),
+        sa.Column("stream_flow", sa.Float(), nullable=True),
+        sa.Column("gage_height", sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint("time"),
+    )
+    op.create_table(
+        "usgs_b",
+        _time_column(),
+        sa.Column("gage_height", sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint("time"),
+    )
+    op.create_table(
+        "processed_data",
+        _time_column(),
+        *[sa.Column(i, sa.Float(), nullable=True) for i in PROCESSED_DATA_FLOAT_COLUMNS],
+        sa.Column("_last_rain", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("days_since_last_rain", sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint("time"),
+    )
+    op.create_table(
+        "prediction",
+        sa.Column("reach_id", sa.Integer(), nullable=False),
+        _time_column(),
+        sa.Column("predicted_ecoli_cfu_100ml", sa.Numeric(), nullable=True),
+        sa.Column("safe", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["reach_id"], ["reach.id"]),
+        sa.PrimaryKeyConstraint("reach_id", "time"),
+    )
+
+
+def downgrade():
+    for table_name in ["hobolink", "usgs_w", "usgs_b", "processed_data", "prediction"]:
+        op.drop_table(table_name)
+    op.execute("DELETE FROM ingestion_state;")
+
+    op.create_table(
+        "prediction",
+        sa.Column("reach_id", sa.Integer(), nullable=False),
+        sa.Column("time", sa.DateTime(), nullable=False),
+        sa.Column("predicted_ecoli_cfu_100ml", sa.Numeric(), nullable=True),
+        sa.Column("safe", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["reach_id"], ["reach.id"]),
+        sa.PrimaryKeyConstraint("reach_id", "time"),
+    )
@@ -0,0 +1,40 @@
+"""
+Add a model_version column to the prediction table, so predictions from more
+than one model version can be stored side by side.
+
+Revision ID: c7d2a95e4b16
+Revises: 9b3e1f6c2d84
+Create Date: 2026-10-17 16:05:51.402317
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c7d2a95e4b16"
+down_revision = "9b3e1f6c2d84"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Everything stored so far came from the 2025 model.
+    op.add_column(
+        "prediction",
+        sa.Column("model_version", sa.String(length=16), nullable=False, server_default="v4"),
+    )
+    op.alter_column("prediction", "model_version", server_default=None)
+    op.add_column("prediction", sa.Column("probability", sa.Numeric(), nullable=True))
+    op.drop_constraint("prediction_pkey", "prediction", type_="primary")
+    op.create_primary_key("prediction_pkey", "prediction", ["model_version", "reach_id", "time"])
+
+
+def downgrade():
+    op.execute("DELETE FROM prediction WHERE model_version != 'v4';")
+    op.drop_constraint("prediction_pkey", "prediction", type_="primary")
+    op.create_primary_key("prediction_pkey", "prediction", ["reach_id", "time"])
+    op.drop_column("prediction", "probability")
+    op.drop_column("prediction", "model_version")
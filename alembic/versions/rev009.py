@@ -0,0 +1,37 @@
+"""
+Add a table that records how long each stage of a database update took.
+
+Revision ID: 5e8a0c3f71d2
+Revises: c7d2a95e4b16
+Create Date: 2026-10-17 16:05:31.442871
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "5e8a0c3f71d2"
+down_revision = "c7d2a95e4b16"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "pipeline_run",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("seconds", sa.Float(), nullable=False),
+        sa.Column("succeeded", sa.Boolean(), nullable=False),
+        sa.Column("stages", sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_pipeline_run_started_at"), "pipeline_run", ["started_at"])
+
+
+def downgrade():
+    op.drop_index(op.f("ix_pipeline_run_started_at"), table_name="pipeline_run")
+    op.drop_table("pipeline_run")
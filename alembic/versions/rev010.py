@@ -0,0 +1,34 @@
+"""
+Record the hash of each database update's inputs, and whether the update was
+skipped because they hadn't changed.
+
+Revision ID: a41d6b9e2c07
+Revises: 5e8a0c3f71d2
+Create Date: 2026-10-17 17:22:09.635120
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a41d6b9e2c07"
+down_revision = "5e8a0c3f71d2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "pipeline_run",
+        sa.Column("skipped", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+    op.alter_column("pipeline_run", "skipped", server_default=None)
+    op.add_column("pipeline_run", sa.Column("input_hash", sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column("pipeline_run", "input_hash")
+    op.drop_column("pipeline_run", "skipped")
@@ -0,0 +1,37 @@
+"""
+Add a table for predictions over past seasons, written by `flask backfill`.
+
+Revision ID: 2b9f4e7d0a63
+Revises: a41d6b9e2c07
+Create Date: 2026-10-17 18:47:55.093412
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "2b9f4e7d0a63"
+down_revision = "a41d6b9e2c07"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "prediction_backfill",
+        sa.Column("model_version", sa.String(length=16), nullable=False),
+        sa.Column("reach_id", sa.Integer(), nullable=False),
+        sa.Column("time", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("predicted_ecoli_cfu_100ml", sa.Numeric(), nullable=True),
+        sa.Column("probability", sa.Numeric(), nullable=True),
+        sa.Column("safe", sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(["reach_id"], ["reach.id"]),
+        sa.PrimaryKeyConstraint("model_version", "reach_id", "time"),
+    )
+
+
+def downgrade():
+    op.drop_table("prediction_backfill")
@@ -11,6 +11,7 @@ from app.admin.views.boathouse import BoathouseModelView
 from app.admin.views.boathouse import ManualOverridesModelView
 from app.admin.views.data import DatabaseView
 from app.admin.views.data import DownloadView
+from app.admin.views.data import PipelineRunView
 from app.admin.views.misc import AdminIndexView
 from app.admin.views.misc import LogoutView
 from app.admin.views.website_options import WebsiteOptionsModelView
@@ -51,4 +52,7 @@ def init_admin(app: Flask):
         admin.add_view(BoathouseModelView(db.session))
         admin.add_view(DatabaseView(name="Update Database", url="db/update", category="Manage DB"))
         admin.add_view(DownloadView(name="Download", url="db/download", category="Manage DB"))
+        admin.add_view(
+            PipelineRunView(name="Pipeline Runs", url="db/pipeline-runs", category="Manage DB")
+        )
         admin.add_view(LogoutView(name="Logout", url="logout"))
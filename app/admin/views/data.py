@@ -28,6 +28,12 @@ from app.data.celery import predict_v3_task
 from app.data.celery import predict_v4_task
 from app.data.celery import update_db_task
 from app.data.database import execute_sql
+from app.data.models.pipeline_data import PROCESSED_DATA_QUERY
+from app.data.models.pipeline_run import PipelineRun
+from app.data.processing.pipeline_timing import REGRESSION_FACTOR
+from app.data.processing.pipeline_timing import REGRESSION_RECENT_RUNS
+from app.data.processing.pipeline_timing import get_stage_timings
+from app.data.processing.pipeline_timing import summarize_stage_timings
 
 
 def send_csv_attachment_of_dataframe(
@@ -95,6 +101,7 @@ class DownloadView(BaseView):
         "usgs_b",
         "processed_data",
         "prediction",
+        "prediction_backfill",
         "boathouse",
         "override_history",
     ]
@@ -116,6 +123,8 @@ class DownloadView(BaseView):
         # The reason it's OK in this case is because users don't touch it.
         # However it is dangerous to do this in some other contexts.
         query = f"""SELECT * FROM {sql_table_name}"""
+        if sql_table_name == "processed_data":
+            query = PROCESSED_DATA_QUERY
         try:
             df = execute_sql(query)
         except ProgrammingError:
@@ -354,3 +363,26 @@ class DatabaseView(BaseView):
         task_id = request.args.get("task_id")
         task = celery_app.AsyncResult(task_id)
         return {"status": task.status}
+
+
+class PipelineRunView(BaseView):
+    """Shows how long each stage of the recent database updates took, and
+    which stages have gotten slower.
+    """
+
+    RECENT_RUNS_SHOWN = 48
+
+    @expose("/")
+    def index(self):
+        runs = PipelineRun.get_recent(limit=current_app.config["PIPELINE_RUN_HISTORY"])
+        df_summary = summarize_stage_timings(get_stage_timings(runs))
+        # NaN (e.g. stages that don't count rows) shows up as blank.
+        df_summary = df_summary.astype(object).where(df_summary.notna(), None)
+        return self.render(
+            "admin/pipeline_runs.html",
+            runs=runs[: self.RECENT_RUNS_SHOWN],
+            total_runs=len(runs),
+            summary=df_summary.to_dict(orient="records"),
+            recent_runs=REGRESSION_RECENT_RUNS,
+            regression_factor=REGRESSION_FACTOR,
+        )
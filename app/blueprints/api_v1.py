@@ -16,7 +16,9 @@ from app.data.globals import boathouses
 from app.data.globals import cache
 from app.data.globals import reaches
 from app.data.globals import website_options
+from app.data.models.pipeline_data import PROCESSED_DATA_QUERY
 from app.data.processing.core import DEFAULT_MODEL_VERSION
+from app.data.processing.core import ModelVersion
 
 
 bp = Blueprint("api", __name__, url_prefix="/api")
@@ -35,16 +37,25 @@ def predictive_model_api():
     selected_hours = min(selected_hours, current_app.config["API_MAX_HOURS"])
     selected_hours = max(selected_hours, 1)
 
+    # Model versions other than the default are only stored if they are in
+    # SHADOW_MODEL_VERSIONS; otherwise there are no predictions to return.
+    selected_model_version = request.args.get("model_version", default=DEFAULT_MODEL_VERSION.value)
+    if selected_model_version not in {i.value for i in ModelVersion}:
+        return jsonify(error=f"Unknown model_version: {selected_model_version!r}"), 400
+
     return jsonify(
         {
-            "model_version": DEFAULT_MODEL_VERSION,
+            "model_version": selected_model_version,
             "time_returned": datetime.now(UTC),
             "is_boating_season": website_options.boating_season,
             "model_outputs": [
                 {
                     "reach": r.id,
                     "predictions": [
-                        p.api_v1_to_dict() for p in r.predictions_last_x_hours(x=selected_hours)
+                        p.api_v1_to_dict()
+                        for p in r.predictions_last_x_hours(
+                            x=selected_hours, model_version=selected_model_version
+                        )
                     ],
                 }
                 for r in filter(lambda _: _.id in selected_reaches, reaches)
@@ -72,7 +83,7 @@ def model_input_data_api():
     hours = min(hours, current_app.config["API_MAX_HOURS"])
     hours = max(hours, 1)
 
-    df = execute_sql("""SELECT * FROM processed_data ORDER BY time;""")
+    df = execute_sql(PROCESSED_DATA_QUERY)
 
     model_input_data = df.tail(n=hours).to_dict(orient="records")
 
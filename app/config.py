@@ -8,6 +8,7 @@ this module, they won't refresh.
 
 import os
 import os.path as op
+import tempfile
 from base64 import b64encode
 from typing import Annotated
 from typing import Any
@@ -159,6 +160,43 @@ class Config(BaseSettings):
     HOBOLINK_BEARER_TOKEN: str | None = None
     HOBOLINK_EXCLUDE_SENSORS: Annotated[list[str], NoDecode] = Field(default_factory=lambda: [])
 
+    HOBOLINK_MAX_CONCURRENT_REQUESTS: int = 4
+    """HOBOlink requests are paginated by date range. This is the max number of
+    pages that are requested at the same time.
+    """
+
+    HOBOLINK_TIMEOUT_SECONDS: float = 60
+    """How long to wait for HOBOlink to send data before giving up on a request."""
+
+    USGS_TIMEOUT_SECONDS: float = 30
+    """How long to wait for USGS to send data before giving up on a request."""
+
+    UPSTREAM_MAX_RETRIES: int = 3
+    """How many times to retry a request to HOBOlink or USGS that failed with a
+    status code like 429 or 503. If the response has a `Retry-After` header, we
+    wait that long before trying again.
+    """
+
+    UPSTREAM_ASYNC_MAX_CONNECTIONS: int = 8
+    """Max number of connections the asyncio fetchers keep open at once, across
+    HOBOlink and USGS. See `app.data.processing.upstream_async`.
+    """
+
+    SOURCE_FETCH_TIMEOUT_SECONDS: float = 300
+    """USGS and HOBOlink are requested at the same time. This is how long to
+    wait for all of them to come back before the update fails.
+    """
+
+    UPSTREAM_CACHE_DIR: str | None = op.join(tempfile.gettempdir(), "flagging_upstream_cache")
+    """Where to cache raw HOBOlink and USGS responses for windows of time that
+    are fully in the past. Set this to an empty string to turn off the cache.
+    """
+
+    UPSTREAM_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    """Once the upstream cache is bigger than this, the least recently used
+    responses are deleted.
+    """
+
     TWITTER_AUTH: dict[str, Any] = {
         "api_key": os.getenv("TWITTER_API_KEY") or "",
         "api_key_secret": os.getenv("TWITTER_API_KEY_SECRET") or "",
@@ -192,6 +230,42 @@ class Config(BaseSettings):
 
     Heroku free tier has a 10,000 total row limit across all tables, so we want
     to be well within that limit to the extent we can assure it.
+
+    This is how much of the raw HOBOlink and USGS data is stored. It needs to
+    be at least as long as the longest rolling window of the model features.
+    """
+
+    INCREMENTAL_INGESTION: bool = True
+    """If True, the database update only requests data that is newer than what
+    is already stored (plus a small overlap), and appends it to the raw data
+    tables. The raw data tables still only keep the last `STORAGE_HOURS`; the
+    features of the older hours in the lookback window are carried over from
+    the processed data instead.
+    """
+
+    SHADOW_MODEL_VERSIONS: Annotated[list[str], NoDecode] = Field(default_factory=lambda: [])
+    """Semicolon-separated model versions (e.g. `v2;v3`) to run every hour alongside the default
+    model version. Their predictions are stored in the same table with their
+    own `model_version`, and can be requested from the API, but the website
+    only shows the default model version.
+    """
+
+    SOURCE_SNAPSHOT_TTL_SECONDS: int = 10 * 60
+    """USGS and HOBOlink data is fetched at most once per bucket of this many
+    seconds, and shared by every job and model version that needs it. Set this
+    to 0 to always fetch fresh data.
+    """
+
+    SKIP_UNCHANGED_UPDATES: bool = True
+    """If True, a database update that gets exactly the same USGS and HOBOlink
+    data as the last successful update (e.g. at night, or when a source has
+    stalled) stops there, without processing or writing anything or clearing
+    the cache.
+    """
+
+    PIPELINE_RUN_HISTORY: int = 24 * 30
+    """How many database updates to keep the stage timings of, in the
+    `pipeline_run` table. The "Pipeline Runs" admin page summarizes them.
     """
 
     USE_CELERY: bool = True
@@ -218,6 +292,7 @@ class Config(BaseSettings):
         "MAIL_ERROR_ALERTS_TO",
         "MAIL_DATABASE_EXPORTS_TO",
         "HOBOLINK_EXCLUDE_SENSORS",
+        "SHADOW_MODEL_VERSIONS",
         mode="before",
     )
     @classmethod
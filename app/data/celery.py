@@ -141,15 +141,20 @@ def predict_v4_task(*args, **kwargs) -> RecordsType:
 
 
 @celery_app.task
-def update_db_task(tweet_status: bool = False) -> None:
+def update_db_task(tweet_status: bool = False) -> dict[str, dict[str, int]]:
     from app.data.globals import website_options
     from app.data.processing.core import update_db
 
-    update_db()
+    stats = update_db()
+    if not stats:
+        logger.info("The source data hasn't changed since the last update. Nothing was written.")
+    for table_name, i in stats.items():
+        logger.info(f"Wrote {i.rows} rows ({i.bytes:,} bytes) to {table_name}.")
     if tweet_status and website_options.boating_season:
         from app.twitter import tweet_current_status
 
         tweet_current_status()
+    return {table_name: i._asdict() for table_name, i in stats.items()}
 
 
 @celery_app.task
@@ -10,12 +10,16 @@ is passed in via `db.init_app(app)`, and the `db` object looks for the config
 variable `SQLALCHEMY_DATABASE_URI`.
 """
 
+import io
 import os
+from typing import NamedTuple
 from typing import Optional
 
 import pandas as pd
 from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Connection
+from sqlalchemy import Table
 from sqlalchemy import text
 from sqlalchemy.exc import ResourceClosedError
 
@@ -60,3 +64,56 @@ def execute_sql_from_file(file_name: str) -> Optional[pd.DataFrame]:
     with current_app.open_resource(path) as f:
         s = f.read().decode("utf8")
         return execute_sql(s)
+
+
+class WriteStats(NamedTuple):
+    rows: int
+    bytes: int
+
+
+def copy_upsert(conn: Connection, df: pd.DataFrame, table: Table) -> WriteStats:
+    """Write a Pandas DataFrame to a table with Postgres `COPY`. Rows whose
+    primary key is already in the table are updated instead of inserted.
+
+    Only the table's columns are written; any other columns in `df` are
+    ignored, and columns missing from `df` are written as NULL. If `df` has
+    more than one row with the same key, the last one wins.
+
+    This runs in the connection's transaction and does not commit.
+
+    Args:
+        conn: (Connection) Connection to write with.
+        df: (pd.DataFrame) The rows to write.
+        table: (Table) The table to write to. It must have a primary key.
+
+    Returns:
+        How many rows were written, and the size of the data sent to Postgres.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    columns = [c.name for c in table.columns]
+    key = [c.name for c in table.primary_key.columns]
+    df = df.reindex(columns=columns).drop_duplicates(subset=key, keep="last")
+
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    data = buffer.getvalue().encode("utf8")
+
+    table_name = quote(table.name)
+    staging_name = quote(f"_copy_{table.name}")
+    column_list = ", ".join(quote(c) for c in columns)
+    updates = ", ".join(f"{quote(c)} = EXCLUDED.{quote(c)}" for c in columns if c not in key)
+    on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+    conn.execute(text(f"CREATE TEMP TABLE {staging_name} (LIKE {table_name});"))
+    with conn.connection.cursor() as cursor:
+        with cursor.copy(f"COPY {staging_name} ({column_list}) FROM STDIN (FORMAT csv)") as copy:
+            copy.write(data)
+    conn.execute(
+        text(
+            f"INSERT INTO {table_name} ({column_list})"
+            f" SELECT {column_list} FROM {staging_name}"
+            f" ON CONFLICT ({', '.join(quote(c) for c in key)}) {on_conflict};"
+        )
+    )
+    conn.execute(text(f"DROP TABLE {staging_name};"))
+    return WriteStats(rows=len(df), bytes=len(data))
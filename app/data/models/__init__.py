@@ -3,6 +3,13 @@
 # These imports are placed here to ensure that the SQLAlchemy models are always
 # registered to the db object's metadata.
 from .boathouse import Boathouse
+from .ingestion_state import IngestionState
+from .pipeline_data import hobolink
+from .pipeline_data import prediction_backfill
+from .pipeline_data import processed_data
+from .pipeline_data import usgs_b
+from .pipeline_data import usgs_w
+from .pipeline_run import PipelineRun
 from .prediction import Prediction
 from .reach import Reach
 from .website_options import WebsiteOptions
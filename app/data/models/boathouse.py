@@ -9,6 +9,7 @@ from sqlalchemy.sql.operators import ColumnOperators
 
 from app.data.database import db
 from app.data.models.prediction import Prediction
+from app.data.processing.predictive_models import DEFAULT_MODEL_VERSION
 
 
 # Todo: should update db.String(255) to db.Text.
@@ -27,10 +28,14 @@ class Boathouse(db.Model):
 
     latest_prediction: Prediction = db.relationship(
         "Prediction",
-        # Join on the latest prediction per reach.
+        # Join on the latest prediction per reach, from the model version that
+        # the website serves.
         primaryjoin="and_("
         "Prediction.reach_id == foreign(Boathouse.reach_id),"
-        " Prediction.time == select(func.max(Prediction.time)).scalar_subquery()"  # noqa: E501
+        f" Prediction.model_version == '{DEFAULT_MODEL_VERSION.value}',"
+        " Prediction.time == select(func.max(Prediction.time))"
+        f".where(Prediction.model_version == '{DEFAULT_MODEL_VERSION.value}')"
+        ".scalar_subquery()"
         ")",
         lazy="subquery",
         viewonly=True,
@@ -40,7 +45,10 @@ class Boathouse(db.Model):
 
     all_predictions: List[Prediction] = db.relationship(
         "Prediction",
-        primaryjoin="Prediction.reach_id == foreign(Boathouse.reach_id)",
+        primaryjoin="and_("
+        "Prediction.reach_id == foreign(Boathouse.reach_id),"
+        f" Prediction.model_version == '{DEFAULT_MODEL_VERSION.value}'"
+        ")",
         lazy="subquery",
         viewonly=True,
         uselist=True,
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Optional
+
+from app.data.database import db
+
+
+class IngestionState(db.Model):
+    """Keeps track of the most recent timestamp we have stored from each
+    upstream data source, so that the hourly update only needs to request data
+    that is newer than that.
+    """
+
+    __tablename__ = "ingestion_state"
+    source: str = db.Column(db.String(255), primary_key=True, nullable=False)
+    key: str = db.Column(db.String(255), primary_key=True, nullable=False)
+    last_timestamp: datetime = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    @classmethod
+    def get_last_timestamp(cls, source: str, key: Optional[str]) -> Optional[datetime]:
+        state = db.session.get(cls, (source, key or ""))
+        if state is None:
+            return None
+        return state.last_timestamp
+
+    @classmethod
+    def set_last_timestamp(
+        cls, source: str, key: Optional[str], last_timestamp: datetime, commit: bool = True
+    ) -> None:
+        db.session.merge(cls(source=source, key=key or "", last_timestamp=last_timestamp))
+        if commit:
+            db.session.commit()
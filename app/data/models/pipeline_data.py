@@ -0,0 +1,99 @@
+"""
+Tables that `update_db` loads the raw and processed data into.
+
+These are plain tables rather than models, since they are only ever written in
+bulk with `copy_upsert` and read back into Pandas. Each table's primary key is
+the natural key of its rows, which is what the writes upsert on.
+
+The columns are those of the default model version's data. Changing them needs
+a migration.
+"""
+
+from app.data.database import db
+
+
+def _float_columns(*names: str) -> list[db.Column]:
+    return [db.Column(name, db.Float) for name in names]
+
+
+hobolink = db.Table(
+    "hobolink",
+    db.Column("time", db.DateTime(timezone=True), primary_key=True),
+    *_float_columns(
+        "battery",
+        "dew_point",
+        "gust_speed",
+        "par",
+        "pressure",
+        "rain",
+        "rh",
+        "temperature",
+        "wind_direction",
+        "wind_speed",
+    ),
+)
+
+usgs_w = db.Table(
+    "usgs_w",
+    db.Column("time", db.DateTime(timezone=True), primary_key=True),
+    *_float_columns("stream_flow", "gage_height"),
+)
+
+usgs_b = db.Table(
+    "usgs_b",
+    db.Column("time", db.DateTime(timezone=True), primary_key=True),
+    *_float_columns("gage_height"),
+)
+
+processed_data = db.Table(
+    "processed_data",
+    db.Column("time", db.DateTime(timezone=True), primary_key=True),
+    *_float_columns(
+        "pressure",
+        "par",
+        "rain",
+        "rh",
+        "dew_point",
+        "wind_speed",
+        "gust_speed",
+        "wind_direction",
+        "log_air_temp",
+        "log_stream_flow",
+        "log_gage_height",
+        "geomean_rh_0_to_72h",
+        "geomean_air_temp_0_to_72h",
+        "geomean_gage_height_0_to_12h",
+        "geomean_gage_height_0_to_24h",
+        "geomean_pressure_0_to_72h",
+        "geomean_dew_0_to_1h",
+        "geomean_par_0_to_72h",
+        "geomean_stream_flow_0h_to_12h",
+        "geomean_stream_flow_0h_to_24h",
+        "sum_rain_0h_to_12h",
+        "sum_rain_0h_to_24h",
+    ),
+    db.Column("_last_rain", db.DateTime(timezone=True)),
+    *_float_columns("days_since_last_rain"),
+)
+
+PROCESSED_DATA_QUERY = """
+SELECT ROW_NUMBER() OVER (ORDER BY time) - 1 AS index, *
+FROM processed_data
+ORDER BY time;
+"""
+"""Reads the processed data the way the API and the downloads return it. The
+table used to be written with `to_sql`, which stored each hour's position in
+the data as an `index` column. The rows are upserted now, so that position
+isn't stored, but it is still the first column of what is returned."""
+
+prediction_backfill = db.Table(
+    "prediction_backfill",
+    db.Column("model_version", db.String(16), primary_key=True),
+    db.Column("reach_id", db.Integer, db.ForeignKey("reach.id"), primary_key=True),
+    db.Column("time", db.DateTime(timezone=True), primary_key=True),
+    db.Column("predicted_ecoli_cfu_100ml", db.Numeric),
+    db.Column("probability", db.Numeric),
+    db.Column("safe", db.Boolean),
+)
+"""Predictions for past seasons, from `flask backfill`. These are kept apart
+from the `prediction` table, which only holds the hours the website needs."""
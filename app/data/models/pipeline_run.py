@@ -0,0 +1,40 @@
+from datetime import datetime
+from typing import Any
+from typing import Optional
+
+from app.data.database import db
+
+
+class PipelineRun(db.Model):
+    """How long each stage of a database update took, and how much data it
+    handled. See `app.data.processing.pipeline_timing`.
+    """
+
+    __tablename__ = "pipeline_run"
+    id: int = db.Column(db.Integer, primary_key=True)
+    started_at: datetime = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    seconds: float = db.Column(db.Float, nullable=False)
+    succeeded: bool = db.Column(db.Boolean, nullable=False)
+    skipped: bool = db.Column(db.Boolean, nullable=False, default=False)
+    """True if the inputs were the same as the last run's, so nothing was
+    processed or written."""
+    input_hash: Optional[str] = db.Column(db.String(64), nullable=True)
+    """Hash of the source data and the model versions that were run on it."""
+    stages: list[dict[str, Any]] = db.Column(db.JSON, nullable=False)
+    """One `{"stage", "seconds", "rows", "bytes"}` dict per stage, in the order
+    the stages finished."""
+
+    @classmethod
+    def get_recent(cls, limit: int) -> list["PipelineRun"]:
+        return db.session.query(cls).order_by(cls.started_at.desc()).limit(limit).all()
+
+    @classmethod
+    def get_last_input_hash(cls) -> Optional[str]:
+        """The input hash of the most recent run that succeeded."""
+        return (
+            db.session.query(cls.input_hash)
+            .filter(cls.succeeded)
+            .order_by(cls.started_at.desc())
+            .limit(1)
+            .scalar()
+        )
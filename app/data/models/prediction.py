@@ -9,14 +9,17 @@ from sqlalchemy import func
 from sqlalchemy import select
 
 from app.data.database import db
+from app.data.processing.predictive_models import DEFAULT_MODEL_VERSION
 
 
 class Prediction(db.Model):
     __tablename__ = "prediction"
+    model_version = db.Column(db.String(16), primary_key=True, nullable=False)
     reach_id = db.Column(db.Integer, db.ForeignKey("reach.id"), primary_key=True, nullable=False)
-    time = db.Column(db.DateTime, primary_key=True, nullable=False)
+    time = db.Column(db.DateTime(timezone=True), primary_key=True, nullable=False)
     predicted_ecoli_cfu_100ml = db.Column(db.Numeric)
-    # probability = db.Column(db.Numeric)
+    # Older model versions predict a probability instead of a concentration.
+    probability = db.Column(db.Numeric)
     safe = db.Column(db.Boolean)
 
     reach = db.relationship("Reach", back_populates="predictions")
@@ -35,29 +38,54 @@ class Prediction(db.Model):
 
     @classmethod
     def _latest_ts_scalar_subquery(cls):
-        return select(func.max(Prediction.time)).scalar_subquery()
+        return (
+            select(func.max(Prediction.time))
+            .where(Prediction.model_version == DEFAULT_MODEL_VERSION.value)
+            .scalar_subquery()
+        )
 
     @classmethod
     def get_latest(cls, reach: int) -> "Prediction":
         return (
             db.session.query(cls)
-            .filter(and_(cls.time == cls._latest_ts_scalar_subquery(), cls.reach == reach))
+            .filter(
+                and_(
+                    cls.model_version == DEFAULT_MODEL_VERSION.value,
+                    cls.time == cls._latest_ts_scalar_subquery(),
+                    cls.reach == reach,
+                )
+            )
             .first()
         )
 
     @classmethod
     def get_all_latest(cls) -> List["Prediction"]:
-        return db.session.query(cls).filter(cls.time == cls._latest_ts_scalar_subquery()).all()
+        return (
+            db.session.query(cls)
+            .filter(
+                cls.model_version == DEFAULT_MODEL_VERSION.value,
+                cls.time == cls._latest_ts_scalar_subquery(),
+            )
+            .all()
+        )
 
     # def api_v1_to_dict(self) -> Dict[str, Any]:
     #     return {"prediction": float(self.probability), "safe": self.safe, "time": self.time}
     def api_v1_to_dict(self) -> Dict[str, Any]:
+        if self.predicted_ecoli_cfu_100ml is None:
+            prediction = self.probability
+        else:
+            prediction = self.predicted_ecoli_cfu_100ml
         return {
-            "prediction": float(self.predicted_ecoli_cfu_100ml),
+            "prediction": float(prediction),
             "safe": self.safe,
             "time": self.time,
         }
 
 
-def get_latest_prediction_time() -> datetime:
-    return db.session.query(func.max(Prediction.time)).scalar()
+def get_latest_prediction_time(model_version: str = DEFAULT_MODEL_VERSION.value) -> datetime:
+    return (
+        db.session.query(func.max(Prediction.time))
+        .filter(Prediction.model_version == model_version)
+        .scalar()
+    )
@@ -2,6 +2,7 @@ from typing import List
 from typing import Optional
 
 from app.data.database import db
+from app.data.processing.predictive_models import DEFAULT_MODEL_VERSION
 
 
 class Reach(db.Model):
@@ -13,21 +14,31 @@ class Reach(db.Model):
         "Boathouse", order_by="asc(Boathouse.name)", back_populates="reach"
     )
     predictions: List["Prediction"] = db.relationship(  # noqa: F821
-        "Prediction", order_by="asc(Prediction.time)", uselist=True, back_populates="reach"
+        "Prediction",
+        # Only the predictions of the model version that the website serves.
+        primaryjoin="and_("
+        "Reach.id == Prediction.reach_id,"
+        f" Prediction.model_version == '{DEFAULT_MODEL_VERSION.value}'"
+        ")",
+        order_by="asc(Prediction.time)",
+        uselist=True,
+        back_populates="reach",
     )
 
     @classmethod
     def get_all(cls) -> List["Reach"]:
         return db.session.query(cls).order_by(cls.id).all()
 
-    def predictions_last_x_hours(self, x: Optional[int] = None) -> List["Prediction"]:  # noqa: F821
-        if x is None:
+    def predictions_last_x_hours(
+        self, x: Optional[int] = None, model_version: str = DEFAULT_MODEL_VERSION.value
+    ) -> List["Prediction"]:  # noqa: F821
+        if x is None and model_version == DEFAULT_MODEL_VERSION.value:
             return self.predictions
         from app.data.models.prediction import Prediction
 
         return (
             db.session.query(Prediction)
-            .filter(Prediction.reach_id == self.id)
+            .filter(Prediction.reach_id == self.id, Prediction.model_version == model_version)
             .order_by(Prediction.time.desc())
             .limit(x)
             .all()
@@ -0,0 +1,209 @@
+"""
+Computes predictions over a past range of time, e.g. a whole boating season,
+and stores them in the `prediction_backfill` table. This is what
+`flask backfill` runs.
+
+The range is split into chunks. The data for each chunk is fetched in this
+process, starting `BACKFILL_OVERLAP` before the chunk so that the features are
+complete for the chunk's first hour, including the days since it last rained.
+The features and predictions are computed in a pool of worker processes, while
+the next chunks are fetched, and each chunk's predictions are written as soon
+as they are ready.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+from datetime import datetime
+from datetime import timedelta
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+import pandas as pd
+
+from app.data.database import copy_upsert
+from app.data.database import db
+from app.data.models.pipeline_data import prediction_backfill
+from app.data.processing.hobolink import get_live_hobolink_data
+from app.data.processing.predictive_models import ModelVersion
+from app.data.processing.predictive_models.features import DaysSince
+from app.data.processing.predictive_models.features import FeatureSpec
+from app.data.processing.usgs import USGS_DEFAULT_DAYS_AGO
+from app.data.processing.usgs import get_live_usgs_data_for_sites
+
+
+def _get_lookback(spec: FeatureSpec) -> timedelta:
+    """How far back the features of `spec` look. The days since a column was
+    last above its threshold look back `max_days`, or if they aren't capped,
+    as far back as `update_db` fetches data, since that's where it caps them.
+    """
+    lookback = timedelta(hours=spec.window_hours)
+    for feature in spec.features:
+        if isinstance(feature, DaysSince):
+            days = feature.max_days if feature.max_days is not None else USGS_DEFAULT_DAYS_AGO
+            lookback = max(lookback, timedelta(days=days))
+    return lookback
+
+
+BACKFILL_OVERLAP = max(_get_lookback(i.get_module().FEATURES) for i in ModelVersion)
+"""How much data before each chunk is used to compute its features. This
+covers the longest rolling window of every model version (v2's 168 hours), and
+the cap on v4's days since the last rain (60 days). That way each hour gets the
+same features as it would in a single run over the whole range.
+
+Past windows of data are cached (see `app.data.processing.upstream_cache`), so
+the overlap of each chunk with the ones before it is mostly read from disk.
+"""
+
+
+class BackfillChunk(NamedTuple):
+    start: datetime
+    end: datetime
+
+    @property
+    def fetch_start(self) -> datetime:
+        return self.start - BACKFILL_OVERLAP
+
+    @property
+    def hours(self) -> float:
+        return (self.end - self.start) / timedelta(hours=1)
+
+
+class BackfillProgress(NamedTuple):
+    chunk: BackfillChunk
+    chunks_done: int
+    chunks_total: int
+    rows: int
+    """Predictions written for this chunk."""
+    hours_per_second: float
+    """Hours of data backfilled per second so far, across every chunk."""
+
+
+def get_backfill_chunks(start: datetime, end: datetime, chunk_days: int) -> list[BackfillChunk]:
+    """Split `start` to `end` into chunks of `chunk_days` days. The last chunk
+    can be shorter.
+    """
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end)
+        chunks.append(BackfillChunk(start=chunk_start, end=chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def _get_chunk_source_data(chunk: BackfillChunk) -> tuple[pd.DataFrame, ...]:
+    """The HOBOlink, Waltham and Muddy River data from the start of the chunk's
+    overlap to the end of the chunk.
+    """
+    df_hobolink = get_live_hobolink_data(start_date=chunk.fetch_start, end_date=chunk.end)
+    usgs = get_live_usgs_data_for_sites(
+        site_nos=["01104500", "01104683"], start_time=chunk.fetch_start, end_time=chunk.end
+    )
+    out = []
+    for df in [df_hobolink, usgs["01104500"], usgs["01104683"]]:
+        df = df.loc[(df["time"] >= chunk.fetch_start) & (df["time"] < chunk.end)]
+        out.append(df.reset_index(drop=True))
+    return tuple(out)
+
+
+def _predict_chunk(
+    model_version: ModelVersion,
+    chunk: BackfillChunk,
+    df_hobolink: pd.DataFrame,
+    df_usgs_w: pd.DataFrame,
+    df_usgs_b: pd.DataFrame,
+) -> pd.DataFrame:
+    """Runs in a worker process, so it can't use the app or the database."""
+    mod = model_version.get_module()
+    df = mod.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    df_predictions = mod.all_models(df)
+    df_predictions = df_predictions.loc[
+        (df_predictions["time"] >= chunk.start) & (df_predictions["time"] < chunk.end)
+    ]
+    return df_predictions.assign(model_version=model_version.value)
+
+
+def _write_chunk(df_predictions: pd.DataFrame) -> int:
+    with db.session() as session:
+        stats = copy_upsert(session.connection(), df_predictions, prediction_backfill)
+        session.commit()
+    return stats.rows
+
+
+def backfill(
+    start: datetime,
+    end: datetime,
+    model_version: ModelVersion,
+    chunk_days: int = 7,
+    max_workers: Optional[int] = None,
+    on_progress: Optional[Callable[[BackfillProgress], None]] = None,
+) -> int:
+    """Compute `model_version`'s predictions from `start` to `end`, and upsert
+    them into the `prediction_backfill` table. Running it again for the same
+    range replaces what was written the first time.
+
+    Args:
+        start: Start of the range (inclusive).
+        end: End of the range (exclusive).
+        model_version: The model version to run.
+        chunk_days: How many days of predictions each worker computes at once.
+        max_workers: How many worker processes to use. Defaults to the number
+                     of CPUs.
+        on_progress: Called after each chunk is written.
+
+    Returns:
+        The number of predictions written.
+    """
+    chunks = get_backfill_chunks(start, end, chunk_days=chunk_days)
+    max_workers = max_workers or multiprocessing.cpu_count()
+    started_at = time.perf_counter()
+    chunks_done = 0
+    hours_done = 0.0
+    rows_total = 0
+
+    # Worker processes are spawned rather than forked, so they don't inherit
+    # the app's database connections.
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        pending: dict[Future, BackfillChunk] = {}
+
+        def _write_completed(block: bool) -> None:
+            nonlocal chunks_done, hours_done, rows_total
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                rows = _write_chunk(future.result())
+                chunks_done += 1
+                hours_done += chunk.hours
+                rows_total += rows
+                if on_progress is not None:
+                    on_progress(
+                        BackfillProgress(
+                            chunk=chunk,
+                            chunks_done=chunks_done,
+                            chunks_total=len(chunks),
+                            rows=rows,
+                            hours_per_second=hours_done / (time.perf_counter() - started_at),
+                        )
+                    )
+
+        for chunk in chunks:
+            # The data is fetched here while the workers compute, but only a
+            # few chunks ahead, so that the whole range is never in memory.
+            while len(pending) >= 2 * max_workers:
+                _write_completed(block=True)
+            future = pool.submit(
+                _predict_chunk, model_version, chunk, *_get_chunk_source_data(chunk)
+            )
+            pending[future] = chunk
+            _write_completed(block=False)
+        while pending:
+            _write_completed(block=True)
+
+    return rows_total
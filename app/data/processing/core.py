@@ -4,76 +4,411 @@ about adding a little repetition and not worrying about async processing-- both
 in service of simplifying the code for ease of maintenance.
 """
 
+import contextvars
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from datetime import datetime
-from enum import Enum
+from datetime import timedelta
 from functools import partial
+from typing import Any
+from typing import Callable
+from typing import NamedTuple
 from typing import Optional
-from typing import Protocol
 
 import pandas as pd
 import pytz
 from flask import current_app
-
+from sqlalchemy import DateTime
+from sqlalchemy import and_
+from sqlalchemy import inspect
+from sqlalchemy import or_
+from sqlalchemy import true
+from sqlalchemy.orm import Session
+
+from app.data.database import WriteStats
+from app.data.database import copy_upsert
 from app.data.database import db
 from app.data.database import execute_sql
 from app.data.globals import cache
+from app.data.models.ingestion_state import IngestionState
+from app.data.models.pipeline_run import PipelineRun
 from app.data.models.prediction import Prediction
+from app.data.models.prediction import get_latest_prediction_time
+from app.data.processing.hobolink import HOBOLINK_INGESTION_OVERLAP
 from app.data.processing.hobolink import HOBOLINK_ROWS_PER_HOUR
 from app.data.processing.hobolink import get_live_hobolink_data
+from app.data.processing.pipeline_timing import PipelineTimer
+from app.data.processing.pipeline_timing import record_pipeline_run
+from app.data.processing.pipeline_timing import timed_stage
+from app.data.processing.predictive_models import DEFAULT_MODEL_VERSION
+from app.data.processing.predictive_models import ModelModule
+from app.data.processing.predictive_models import ModelVersion
+from app.data.processing.predictive_models import features
 from app.data.processing.usgs import USGS_DEFAULT_DAYS_AGO
+from app.data.processing.usgs import USGS_INGESTION_OVERLAP
 from app.data.processing.usgs import USGS_ROWS_PER_HOUR_MUDDY_RIVER
 from app.data.processing.usgs import USGS_ROWS_PER_HOUR_WALTHAM
-from app.data.processing.usgs import get_live_usgs_data
+from app.data.processing.usgs import get_live_usgs_data_for_sites
 from app.mail import ExportEmail
 from app.mail import mail
 from app.mail import mail_on_fail
 
 
-def _write_to_db(df: pd.DataFrame, table_name: str, rows: Optional[int] = None) -> None:
-    """Takes a Pandas DataFrame, and writes it to the database."""
+def _write_to_db(
+    df: pd.DataFrame,
+    table_name: str,
+    rows: Optional[int] = None,
+    since: Optional[datetime] = None,
+    session: Optional[Session] = None,
+    oldest: Optional[datetime] = None,
+    filter_by: Optional[dict[str, Any]] = None,
+) -> WriteStats:
+    """Takes a Pandas DataFrame, and writes it to the database.
+
+    Rows are upserted on the table's primary key, and stored rows outside of
+    the time range of `df` are deleted, so afterwards the table holds the same
+    rows as `df`.
+
+    If `since` is set, only the rows at or after `since` are written, and they
+    replace whatever was stored for that same time range; the older rows in
+    `df` are assumed to be stored already.
+
+    If `oldest` is set, it is used as the start of the time range instead of
+    the start of `df`. That way `df` can hold only the new rows. Rows of `df`
+    before `oldest` aren't written.
+
+    If `filter_by` is set, only the stored rows with these column values are
+    replaced, e.g. `{"model_version": "v4"}`.
+
+    If `session` is set, the write is part of that session's transaction and
+    isn't committed. Otherwise it is committed right away.
+    """
+    if session is None:
+        with db.session() as session:
+            stats = _write_to_db(
+                df,
+                table_name,
+                rows=rows,
+                since=since,
+                session=session,
+                oldest=oldest,
+                filter_by=filter_by,
+            )
+            session.commit()
+        return stats
+
+    table = db.metadata.tables[table_name]
     if rows is not None:
         df = df.tail(rows)
-    df.to_sql(table_name, con=db.engine, index=False, if_exists="replace")
-
-
-class ModelModule(Protocol):
-    MODEL_YEAR: str
-
-    def process_data(
-        self, df_hobolink: pd.DataFrame, df_usgs_w: pd.DataFrame, df_usgs_b: pd.DataFrame
-    ) -> pd.DataFrame: ...
 
-    def all_models(self, df: pd.DataFrame, *args, **kwargs) -> pd.DataFrame: ...
+    if oldest is None and not df.empty:
+        oldest = df["time"].min().to_pydatetime()
+    if oldest is None:
+        stale = true()
+    elif since is not None:
+        stale = or_(table.c.time < oldest, table.c.time >= since)
+    else:
+        stale = or_(table.c.time < oldest, table.c.time > df["time"].max().to_pydatetime())
+    for column_name, value in (filter_by or {}).items():
+        stale = and_(stale, table.c[column_name] == value)
+    with timed_stage(f"write:{table_name}") as timing:
+        session.execute(table.delete().where(stale))
+        if since is not None:
+            df = df.loc[df["time"] >= since]
+        if oldest is not None:
+            df = df.loc[df["time"] >= oldest]
+        stats = copy_upsert(session.connection(), df, table)
+        timing.rows, timing.bytes = stats
+    return stats
+
+
+def _read_from_db(table_name: str) -> Optional[pd.DataFrame]:
+    """Reads a table written by `_write_to_db` back into a Pandas DataFrame.
+    Returns None if the table hasn't been written yet.
+    """
+    if not inspect(db.engine).has_table(table_name):
+        return None
+    df = execute_sql(f"SELECT * FROM {table_name} ORDER BY time;")
+    for column in db.metadata.tables[table_name].columns:
+        if isinstance(column.type, DateTime):
+            df[column.name] = pd.to_datetime(df[column.name], utc=True)
+    return df
+
+
+class SourceData(NamedTuple):
+    """The data from every upstream source."""
+
+    df_usgs_w: pd.DataFrame
+    df_usgs_b: pd.DataFrame
+    df_hobolink: pd.DataFrame
+    usgs_since: Optional[datetime] = None
+    """Timestamp from which new USGS data was requested, or None if all the
+    data was requested."""
+    hobolink_since: Optional[datetime] = None
+    """Timestamp from which new HOBOlink data was requested, or None if all
+    the data was requested."""
+
+
+def _hash_inputs(source_data: SourceData, model_versions: list[ModelVersion]) -> str:
+    """Hash of the source data and the model versions run on it. If two
+    updates have the same hash, they write exactly the same data.
+    """
+    h = hashlib.sha256()
+    h.update(",".join(i.value for i in model_versions).encode())
+    for df in [source_data.df_usgs_w, source_data.df_usgs_b, source_data.df_hobolink]:
+        h.update(",".join(df.columns).encode())
+        h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _get_source_data(
+    days_ago: int = USGS_DEFAULT_DAYS_AGO, incremental: bool = False
+) -> SourceData:
+    """Get the last `days_ago` days of data from USGS (Waltham and Muddy River
+    in one request) and HOBOlink.
+
+    The sources are requested at the same time, so this takes as long as the
+    slowest source rather than all of them added up. If they haven't all come
+    back within `SOURCE_FETCH_TIMEOUT_SECONDS`, a `TimeoutError` is raised.
+
+    If `incremental` is True, only the data that isn't already stored in the
+    database is requested, and it is merged with what is stored.
+    """
+    # The database is only touched from this thread. The other threads only
+    # make requests.
+    with timed_stage("read_stored"):
+        usgs_stored = _get_stored_usgs_data() if incremental else None
+        hobolink_stored = _get_stored_hobolink_data() if incremental else None
+    usgs_since = usgs_stored[-1] if usgs_stored else None
+    hobolink_since = hobolink_stored[-1] if hobolink_stored else None
+
+    results = _run_concurrently(
+        {
+            "usgs": partial(
+                _timed,
+                "fetch_usgs",
+                get_live_usgs_data_for_sites,
+                days_ago=days_ago,
+                site_nos=["01104500", "01104683"],
+                start_time=usgs_since,
+            ),
+            "hobolink": partial(
+                _timed,
+                "fetch_hobolink",
+                get_live_hobolink_data,
+                days_ago=days_ago,
+                start_date=hobolink_since,
+            ),
+        },
+        timeout=current_app.config["SOURCE_FETCH_TIMEOUT_SECONDS"],
+    )
 
+    df_usgs_w = results["usgs"]["01104500"]
+    df_usgs_b = results["usgs"]["01104683"]
+    if usgs_stored is not None:
+        df_stored_w, df_stored_b, _ = usgs_stored
+        df_usgs_w = _merge_with_stored(df_stored_w, df_usgs_w, since=usgs_since, days_ago=days_ago)
+        df_usgs_b = _merge_with_stored(df_stored_b, df_usgs_b, since=usgs_since, days_ago=days_ago)
+
+    df_hobolink = results["hobolink"]
+    if hobolink_stored is not None:
+        df_stored, _ = hobolink_stored
+        # Sensors that the `hobolink` table has no column for aren't stored, so
+        # they only have data from `hobolink_since` onwards.
+        df_hobolink = _merge_with_stored(
+            df_stored, df_hobolink, since=hobolink_since, days_ago=days_ago
+        )
+
+    return SourceData(
+        df_usgs_w=df_usgs_w,
+        df_usgs_b=df_usgs_b,
+        df_hobolink=df_hobolink,
+        usgs_since=usgs_since,
+        hobolink_since=hobolink_since,
+    )
 
-class ModelVersion(str, Enum):
-    v1 = "v1"
-    v2 = "v2"
-    v3 = "v3"
-    v4 = "v4"
 
-    def get_module(self) -> ModelModule:
-        if self == self.__class__.v1:
-            from app.data.processing.predictive_models import v1
+def _timed(stage: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    with timed_stage(stage):
+        return func(*args, **kwargs)
 
-            return v1
-        elif self == self.__class__.v2:
-            from app.data.processing.predictive_models import v2
 
-            return v2
-        elif self == self.__class__.v3:
-            from app.data.processing.predictive_models import v3
+def _run_concurrently(funcs: dict[str, Callable[[], Any]], timeout: float) -> dict[str, Any]:
+    """Call each function in its own thread, with an app context, and return
+    their results. Raises `TimeoutError` if they don't all finish in time.
+    """
+    app = current_app._get_current_object()
 
-            return v3
-        elif self == self.__class__.v4:
-            from app.data.processing.predictive_models import v4
+    def _run(func: Callable[[], Any]) -> Any:
+        with app.app_context():
+            return func()
 
-            return v4
+    executor = ThreadPoolExecutor(max_workers=len(funcs))
+    try:
+        # Each thread runs in a copy of this thread's context, so that e.g.
+        # the stages it times are added to the current pipeline run.
+        futures = {
+            name: executor.submit(contextvars.copy_context().run, _run, func)
+            for name, func in funcs.items()
+        }
+        _, not_done = wait(futures.values(), timeout=timeout)
+        if not_done:
+            names = [name for name, future in futures.items() if future in not_done]
+            raise TimeoutError(f"Timed out after {timeout} seconds waiting for {names}.")
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        # Don't wait for threads that timed out. They can't be stopped, but
+        # their requests have timeouts of their own.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_stored_hobolink_data() -> Optional[tuple[pd.DataFrame, datetime]]:
+    """The stored HOBOlink data, and the timestamp to request new data from.
+    None if nothing is stored yet.
+    """
+    loggers = current_app.config["HOBOLINK_LOGGERS"]
+    last_timestamp = IngestionState.get_last_timestamp("hobolink", loggers)
+    df_stored = _read_from_db("hobolink") if last_timestamp is not None else None
+    if df_stored is None or df_stored.empty:
+        return None
+    return df_stored, last_timestamp - HOBOLINK_INGESTION_OVERLAP
+
+
+def _get_stored_usgs_data() -> Optional[tuple[pd.DataFrame, pd.DataFrame, datetime]]:
+    """The stored Waltham and Muddy River data, and the timestamp to request
+    new data from. None if nothing is stored yet.
+    """
+    last_timestamps = [
+        IngestionState.get_last_timestamp("usgs", "01104500"),
+        IngestionState.get_last_timestamp("usgs", "01104683"),
+    ]
+    if None in last_timestamps:
+        return None
+    df_stored_w = _read_from_db("usgs_w")
+    df_stored_b = _read_from_db("usgs_b")
+    if df_stored_w is None or df_stored_w.empty or df_stored_b is None or df_stored_b.empty:
+        return None
+    # Both sites come back in the same request, so start from whichever is
+    # further behind.
+    return df_stored_w, df_stored_b, min(last_timestamps) - USGS_INGESTION_OVERLAP
+
+
+def _merge_with_stored(
+    df_stored: pd.DataFrame, df_new: pd.DataFrame, since: datetime, days_ago: int
+) -> pd.DataFrame:
+    """Replace everything in `df_stored` from `since` onwards with `df_new`, and
+    drop whatever is more than `days_ago` days older than the newest row.
+    """
+    df_new = df_new.loc[df_new["time"] >= since]
+    df = pd.concat([df_stored.loc[df_stored["time"] < since], df_new], ignore_index=True)
+    df = df.loc[df["time"] >= df["time"].max() - timedelta(days=days_ago)]
+    return df.reset_index(drop=True)
+
+
+_snapshots: dict[str, tuple[float, SourceData]] = {}
+_snapshots_lock = threading.Lock()
+
+
+def _get_snapshot_key(days_ago: int, now: float) -> tuple[str, float]:
+    """Cache key for the snapshot of the current time bucket, and when that
+    bucket ends.
+    """
+    ttl = current_app.config["SOURCE_SNAPSHOT_TTL_SECONDS"]
+    bucket = int(now // ttl)
+    return f"source_snapshot/{days_ago}/{bucket}", (bucket + 1) * ttl
+
+
+def _store_source_snapshot(key: str, expires_at: float, snapshot: SourceData) -> None:
+    now = time.time()
+    for k, (k_expires_at, _) in list(_snapshots.items()):
+        if k_expires_at <= now:
+            del _snapshots[k]
+    _snapshots[key] = (expires_at, snapshot)
+    # A timeout of 0 means "never expire" to the cache, so wait at least 1s.
+    cache.set(key, snapshot, timeout=max(int(expires_at - now), 1))
+
+
+def get_source_snapshot(days_ago: int = USGS_DEFAULT_DAYS_AGO) -> SourceData:
+    """USGS and HOBOlink data for the last `days_ago` days, fetched at most once
+    per `SOURCE_SNAPSHOT_TTL_SECONDS` bucket and shared by every job and model
+    version.
+
+    Snapshots are memoized in this process, and in the cache so that the web
+    and Celery processes share them too. The DataFrames are shared, so don't
+    modify them in place.
+    """
+    if current_app.config["SOURCE_SNAPSHOT_TTL_SECONDS"] <= 0:
+        return _get_source_data(days_ago=days_ago)
+
+    key, expires_at = _get_snapshot_key(days_ago, time.time())
+    # Holding the lock while fetching means concurrent jobs wait for one fetch,
+    # instead of all of them hitting the APIs at once.
+    with _snapshots_lock:
+        memoized = _snapshots.get(key)
+        if memoized is not None:
+            return memoized[1]
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = _get_source_data(days_ago=days_ago)
+            _store_source_snapshot(key, expires_at, snapshot)
         else:
-            raise ValueError(f"Unclear what happened; {self} not supported")
-
-
-DEFAULT_MODEL_VERSION = ModelVersion.v4
+            _snapshots[key] = (expires_at, snapshot)
+        return snapshot
+
+
+def _replace_source_snapshot(snapshot: SourceData, days_ago: int = USGS_DEFAULT_DAYS_AGO) -> None:
+    """Make freshly fetched data the snapshot for the current time bucket."""
+    if current_app.config["SOURCE_SNAPSHOT_TTL_SECONDS"] <= 0:
+        return
+    key, expires_at = _get_snapshot_key(days_ago, time.time())
+    with _snapshots_lock:
+        _store_source_snapshot(key, expires_at, snapshot)
+
+
+def _process_source_data(
+    mod: ModelModule, source_data: SourceData, days_ago: int = USGS_DEFAULT_DAYS_AGO
+) -> tuple[pd.DataFrame, Optional[datetime]]:
+    """Runs the model's `process_data` on the source data.
+
+    If only some of the source data was newly fetched and the model can process
+    data incrementally, the features are only computed from the first new hour
+    onwards, and the rows before that are read from the `processed_data` table.
+    Those go back the last `days_ago` days, even though the raw data tables
+    only keep the last `STORAGE_HOURS`.
+
+    Returns:
+        The processed data, and the time from which rows were computed (None if
+        every row was computed).
+    """
+    df_usgs_w, df_usgs_b, df_hobolink, usgs_since, hobolink_since = source_data
+    process_data_incremental = getattr(mod, "process_data_incremental", None)
+    df_stored = None
+    if process_data_incremental and usgs_since is not None and hobolink_since is not None:
+        df_stored = _read_from_db("processed_data")
+    if df_stored is None or df_stored.empty:
+        with timed_stage("process_data") as timing:
+            df = mod.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+            timing.rows = len(df)
+        return df, None
+
+    since = pd.Timestamp(min(usgs_since, hobolink_since)).floor("h")
+    start = (df_hobolink["time"].max() - timedelta(days=days_ago)).floor("h")
+    with timed_stage("process_data") as timing:
+        df_new = process_data_incremental(
+            df_hobolink=df_hobolink,
+            df_usgs_w=df_usgs_w,
+            df_usgs_b=df_usgs_b,
+            df_processed=df_stored,
+            since=since,
+            start=start,
+        )
+        timing.rows = len(df_new)
+    df_stored = df_stored.loc[(df_stored["time"] >= start) & (df_stored["time"] < since)]
+    df = pd.concat([df_stored, df_new], ignore_index=True)
+    return df, since.to_pydatetime()
 
 
 @mail_on_fail
@@ -82,9 +417,7 @@ def _combine_job(
     model_version: ModelVersion = DEFAULT_MODEL_VERSION,
 ) -> pd.DataFrame:
     mod = model_version.get_module()
-    df_usgs_w = get_live_usgs_data(days_ago=days_ago, site_no="01104500")
-    df_usgs_b = get_live_usgs_data(days_ago=days_ago, site_no="01104683")
-    df_hobolink = get_live_hobolink_data(days_ago=days_ago)
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = get_source_snapshot(days_ago=days_ago)
     df_combined = mod.process_data(
         df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
     )
@@ -103,9 +436,7 @@ def _predict_job(
     model_version: ModelVersion = DEFAULT_MODEL_VERSION,
 ) -> pd.DataFrame:
     mod = model_version.get_module()
-    df_usgs_w = get_live_usgs_data(days_ago=days_ago, site_no="01104500")
-    df_usgs_b = get_live_usgs_data(days_ago=days_ago, site_no="01104683")
-    df_hobolink = get_live_hobolink_data(days_ago=days_ago)
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = get_source_snapshot(days_ago=days_ago)
     df_combined = mod.process_data(
         df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
     )
@@ -119,37 +450,235 @@ predict_v3_job = partial(_predict_job, model_version=ModelVersion.v3)
 predict_v4_job = partial(_predict_job, model_version=ModelVersion.v4)
 
 
+def _get_model_versions() -> list[ModelVersion]:
+    """The default model version, followed by the `SHADOW_MODEL_VERSIONS`."""
+    model_versions = [DEFAULT_MODEL_VERSION]
+    for i in current_app.config["SHADOW_MODEL_VERSIONS"]:
+        if ModelVersion(i) not in model_versions:
+            model_versions.append(ModelVersion(i))
+    return model_versions
+
+
+def _get_full_source_data(
+    source_data: SourceData, days_ago: int = USGS_DEFAULT_DAYS_AGO
+) -> SourceData:
+    """Source data that goes back the last `days_ago` days.
+
+    Data that was merged with the stored data only goes back `STORAGE_HOURS`,
+    so the hours before that are taken from the source snapshot.
+    """
+    if source_data.usgs_since is None and source_data.hobolink_since is None:
+        return source_data
+
+    snapshot = get_source_snapshot(days_ago)
+
+    def _fill(
+        df_snapshot: pd.DataFrame, df: pd.DataFrame, since: Optional[datetime]
+    ) -> pd.DataFrame:
+        if since is None or df.empty:
+            return df
+        return _merge_with_stored(df_snapshot, df, since=df["time"].min(), days_ago=days_ago)
+
+    return SourceData(
+        df_usgs_w=_fill(snapshot.df_usgs_w, source_data.df_usgs_w, source_data.usgs_since),
+        df_usgs_b=_fill(snapshot.df_usgs_b, source_data.df_usgs_b, source_data.usgs_since),
+        df_hobolink=_fill(
+            snapshot.df_hobolink, source_data.df_hobolink, source_data.hobolink_since
+        ),
+        usgs_since=None,
+        hobolink_since=None,
+    )
+
+
+def _predict_model_versions(
+    source_data: SourceData, df_combined: pd.DataFrame, processed_since: Optional[datetime]
+) -> dict[ModelVersion, tuple[pd.DataFrame, Optional[datetime], datetime]]:
+    """Run every model version in `_get_model_versions` on the same source data.
+
+    If the default model version's data was processed incrementally, only the
+    hours from `processed_since` onwards are predicted, except for model
+    versions that don't have any predictions stored yet.
+
+    The shadow model versions are processed from the source data in full. In
+    incremental mode, the source data only goes back `STORAGE_HOURS`, so the
+    hours before that are filled in from the source snapshot (see
+    `_get_full_source_data`). That way their features get the whole lookback
+    period, as they would in a full update.
+
+    Returns:
+        For each model version, its predictions, the time from which they were
+        predicted (None if every hour was), and the start of its data. These
+        are the `df`, `since` and `oldest` arguments of `_write_to_db`.
+    """
+    model_versions = _get_model_versions()
+    processed = {DEFAULT_MODEL_VERSION: df_combined}
+    shadow_versions = model_versions[1:]
+    if shadow_versions:
+        df_usgs_w, df_usgs_b, df_hobolink, *_ = _get_full_source_data(source_data)
+        # The features of every shadow model version are computed in one pass.
+        with timed_stage("process_data:shadow") as timing:
+            dfs = features.process_data(
+                [i.get_module().FEATURES for i in shadow_versions],
+                df_hobolink=df_hobolink,
+                df_usgs_w=df_usgs_w,
+                df_usgs_b=df_usgs_b,
+            )
+            timing.rows = sum(len(df) for df in dfs)
+        processed.update(zip(shadow_versions, dfs))
+
+    out = {}
+    for model_version in model_versions:
+        mod = model_version.get_module()
+        # The shadow model versions' stages are suffixed with their version.
+        suffix = "" if model_version == DEFAULT_MODEL_VERSION else f":{model_version.value}"
+        df = processed[model_version]
+        since = processed_since
+        if since is not None and get_latest_prediction_time(model_version.value) is None:
+            since = None
+        oldest = df["time"].min().to_pydatetime()
+        if since is not None:
+            df = df.loc[df["time"] >= since].copy()
+        with timed_stage(f"all_models{suffix}") as timing:
+            df_predictions = mod.all_models(df)
+            timing.rows = len(df_predictions)
+        out[model_version] = (df_predictions, since, oldest)
+    return out
+
+
 @mail_on_fail
-def update_db() -> None:
+def update_db() -> dict[str, WriteStats]:
+    """Fetch the latest data, run the default model (and any shadow model
+    versions), and write all of it to the database.
+
+    How long each stage takes is recorded in the `pipeline_run` table.
+
+    If `SKIP_UNCHANGED_UPDATES` is on and the source data is the same as it
+    was for the last update, nothing is processed or written, and the cache
+    isn't cleared.
+
+    Returns:
+        The rows and bytes written to each table. Empty if nothing changed.
+    """
+    with record_pipeline_run() as run:
+        return _update_db(run)
+
+
+def _update_db(run: PipelineTimer) -> dict[str, WriteStats]:
     mod = DEFAULT_MODEL_VERSION.get_module()
-    df_usgs_w = get_live_usgs_data(site_no="01104500")
-    df_usgs_b = get_live_usgs_data(site_no="01104683")
-    df_hobolink = get_live_hobolink_data()
-    df_combined = mod.process_data(
-        df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
-    )
-    df_predictions = mod.all_models(df_combined)
+    source_data = _get_source_data(incremental=current_app.config["INCREMENTAL_INGESTION"])
+    df_usgs_w, df_usgs_b, df_hobolink, usgs_since, hobolink_since = source_data
+
+    with timed_stage("hash_inputs"):
+        run.input_hash = _hash_inputs(source_data, _get_model_versions())
+    if (
+        current_app.config["SKIP_UNCHANGED_UPDATES"]
+        and run.input_hash == PipelineRun.get_last_input_hash()
+        # In case the tables were emptied since, e.g. by a migration.
+        and get_latest_prediction_time() is not None
+    ):
+        run.skipped = True
+        return {}
+
+    df_combined, processed_since = _process_source_data(mod, source_data)
+    predictions = _predict_model_versions(source_data, df_combined, processed_since)
 
     hours = current_app.config["STORAGE_HOURS"]
+    stats = {}
     try:
-        _write_to_db(df_usgs_w, "usgs_w", rows=hours * USGS_ROWS_PER_HOUR_WALTHAM)
-        _write_to_db(df_usgs_b, "usgs_b", rows=hours * USGS_ROWS_PER_HOUR_MUDDY_RIVER)
-        _write_to_db(df_hobolink, "hobolink", rows=hours * HOBOLINK_ROWS_PER_HOUR)
-        _write_to_db(df_combined, "processed_data")
-        _write_to_db(df_predictions, Prediction.__tablename__)
+        # Every table is written in one transaction, so the website sees either
+        # all of the old data or all of the new data, never a mix of the two or
+        # a half-written table. Postgres doesn't make reads wait for writes, so
+        # until this commits, the website just keeps reading the old data.
+        with db.session() as session:
+            if current_app.config["INCREMENTAL_INGESTION"]:
+                # Only the last `STORAGE_HOURS` of raw data are kept. The next
+                # update gets the older hours' features from `processed_data`.
+                stats["usgs_w"] = _write_to_db(
+                    df_usgs_w,
+                    "usgs_w",
+                    since=usgs_since,
+                    session=session,
+                    oldest=_get_storage_start(df_usgs_w, hours),
+                )
+                stats["usgs_b"] = _write_to_db(
+                    df_usgs_b,
+                    "usgs_b",
+                    since=usgs_since,
+                    session=session,
+                    oldest=_get_storage_start(df_usgs_b, hours),
+                )
+                stats["hobolink"] = _write_to_db(
+                    df_hobolink,
+                    "hobolink",
+                    since=hobolink_since,
+                    session=session,
+                    oldest=_get_storage_start(df_hobolink, hours),
+                )
+                for source, key, df in [
+                    ("usgs", "01104500", df_usgs_w),
+                    ("usgs", "01104683", df_usgs_b),
+                    ("hobolink", current_app.config["HOBOLINK_LOGGERS"], df_hobolink),
+                ]:
+                    if not df.empty:
+                        IngestionState.set_last_timestamp(
+                            source, key, df["time"].max(), commit=False
+                        )
+            else:
+                stats["usgs_w"] = _write_to_db(
+                    df_usgs_w, "usgs_w", rows=hours * USGS_ROWS_PER_HOUR_WALTHAM, session=session
+                )
+                stats["usgs_b"] = _write_to_db(
+                    df_usgs_b,
+                    "usgs_b",
+                    rows=hours * USGS_ROWS_PER_HOUR_MUDDY_RIVER,
+                    session=session,
+                )
+                stats["hobolink"] = _write_to_db(
+                    df_hobolink, "hobolink", rows=hours * HOBOLINK_ROWS_PER_HOUR, session=session
+                )
+            stats["processed_data"] = _write_to_db(
+                df_combined, "processed_data", since=processed_since, session=session
+            )
+            stats[Prediction.__tablename__] = WriteStats(rows=0, bytes=0)
+            for model_version, (df_predictions, since, oldest) in predictions.items():
+                version_stats = _write_to_db(
+                    df_predictions.assign(model_version=model_version.value),
+                    Prediction.__tablename__,
+                    since=since,
+                    session=session,
+                    oldest=oldest,
+                    filter_by={"model_version": model_version.value},
+                )
+                stats[Prediction.__tablename__] = WriteStats(
+                    *map(sum, zip(stats[Prediction.__tablename__], version_stats))
+                )
+            with timed_stage("commit"):
+                session.commit()
     finally:
         # Clear the cache every time we are dumping to the database.
         # the try -> finally makes sure this always runs, even if an error
         # occurs somewhere when updating.
-        cache.clear()
+        with timed_stage("cache_clear"):
+            cache.clear()
+    # The data we just fetched is the freshest there is, so the other jobs can
+    # use it instead of fetching it again. That is, unless it was merged with
+    # the stored data, which doesn't go back the whole lookback period.
+    if usgs_since is None and hobolink_since is None:
+        _replace_source_snapshot(source_data)
+    return stats
+
+
+def _get_storage_start(df: pd.DataFrame, hours: int) -> Optional[datetime]:
+    """Start of the last `hours` hours of `df`."""
+    if df.empty:
+        return None
+    return (df["time"].max() - timedelta(hours=hours)).to_pydatetime()
 
 
 @mail_on_fail
 def send_database_exports() -> None:
     mod = DEFAULT_MODEL_VERSION.get_module()
-    df_usgs_w = get_live_usgs_data(days_ago=90, site_no="01104500")
-    df_usgs_b = get_live_usgs_data(days_ago=90, site_no="01104683")
-    df_hobolink = get_live_hobolink_data(days_ago=90)
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = get_source_snapshot(days_ago=90)
     df_combined = mod.process_data(
         df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
     )
@@ -1,30 +1,60 @@
+import codecs
+import json
 import os
+import re
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import UTC
 from datetime import datetime
 from datetime import timedelta
 from typing import Any
+from typing import Iterable
+from typing import Iterator
 from urllib.parse import urljoin
 
+import numpy as np
 import pandas as pd
-import requests
 from flask import abort
 from flask import current_app
+from tenacity import Retrying
 from tenacity import retry
 from tenacity import stop_after_attempt
-from tenacity import wait_fixed
+from tenacity import wait_exponential
 
+from app.data.processing.pipeline_timing import timed_stage
+from app.data.processing.upstream_cache import CHUNK_SIZE
+from app.data.processing.upstream_cache import UpstreamCache
+from app.data.processing.upstream_cache import get_upstream_cache
+from app.data.processing.upstream_cache import is_closed_window
+from app.data.processing.upstream_cache import iter_response_body
+from app.data.processing.upstream_client import UpstreamClient
+from app.data.processing.upstream_client import get_upstream_client
 from app.mail import mail_on_fail
 
 
 BASE_URL = "https://api.licor.cloud"
 HOBOLINK_ROWS_PER_HOUR = 12
 HOBOLINK_STATIC_FILE_NAME = ""
+HOBOLINK_INGESTION_OVERLAP = timedelta(hours=1)
+
+# HOBOLink API returns max of 100,000 results at a time.
+# Additionally, there is no pagination, and it doesn't tell us when a response
+# has been cut off. Therefore we must paginate ourselves.
+HOBOLINK_MAX_RESULTS = 100_000
+HOBOLINK_TARGET_FRACTION = 0.5
+HOBOLINK_DEFAULT_WINDOW_SIZE = timedelta(days=10)
+# Every size is double the previous one, so the grids of all of the sizes line
+# up with each other (see `_get_request_windows`). 7.5 hours to 80 days.
+HOBOLINK_WINDOW_SIZES = [HOBOLINK_DEFAULT_WINDOW_SIZE * 2**k for k in range(-5, 4)]
+
+# Readings per second seen in previous responses, by loggers.
+_readings_per_second: dict[str, float] = {}
 
 
 "/v1/data"
 
 
-@retry(reraise=True, wait=wait_fixed(1), stop=stop_after_attempt(3))
 @mail_on_fail
 def get_live_hobolink_data(
     start_date: datetime | None = None,
@@ -48,74 +78,442 @@ def get_live_hobolink_data(
         end_date = datetime.now(tz=UTC)
     if start_date is None:
         start_date = end_date - timedelta(days=days_ago)
-    data = request_to_hobolink(start_date=start_date, end_date=end_date, loggers=loggers)
-    df = parse_hobolink_data(data, exclude_sensors=exclude_sensors)
+    # Each window is already retried on its own. If one still fails, try again
+    # for just the windows that haven't come back yet.
+    checkpoint = {}
+    for attempt in Retrying(
+        reraise=True, wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(2)
+    ):
+        with attempt:
+            data = request_to_hobolink(
+                start_date=start_date, end_date=end_date, loggers=loggers, checkpoint=checkpoint
+            )
+    with timed_stage("parse_hobolink") as timing:
+        df = parse_hobolink_data(data, exclude_sensors=exclude_sensors)
+        df = df.loc[df["time"] >= start_date].reset_index(drop=True)
+        timing.rows = len(df)
     return df
 
 
 def request_to_hobolink(
-    start_date: datetime, end_date: datetime, loggers: str = None, token: str | None = None
-) -> list[dict[str, Any]]:
-    """ """
+    start_date: datetime,
+    end_date: datetime,
+    loggers: str = None,
+    token: str | None = None,
+    checkpoint: dict[tuple[datetime, datetime], "HobolinkReadings"] | None = None,
+) -> "HobolinkReadings":
+    """Get the HOBOlink readings between two timestamps.
+
+    The date range is split into windows (see `_get_request_windows`), and the
+    windows are requested concurrently over the pooled keep-alive session of
+    the shared upstream client (see `app.data.processing.upstream_client`). The
+    number of requests in flight at once is capped by the config variable
+    `HOBOLINK_MAX_CONCURRENT_REQUESTS`. Each window is retried on its own, so a
+    flaky window doesn't cause the other windows to be downloaded again.
+
+    The window size is picked from how many readings per second the previous
+    responses had, so that windows stay well under the 100,000 result limit of
+    the API (see `_choose_window_size`). A window that hits the limit anyway is
+    split in half and requested again.
+
+    Windows that are fully in the past are read from the upstream cache if
+    possible (see `app.data.processing.upstream_cache`).
+
+    Args:
+        start_date: (datetime) Start of the date range.
+        end_date: (datetime) End of the date range.
+        loggers: (str) HOBOlink loggers to pull data from.
+        token: (str) Bearer token for the LI-COR API.
+        checkpoint: (dict) Windows that were already downloaded. Windows are
+                    added to this as they complete, so if this function fails
+                    partway through, calling it again with the same dict only
+                    requests the windows that are missing.
+
+    Returns:
+        The readings, in the same order as the windows were requested. Since
+        closed windows are aligned to a fixed grid, this can include readings
+        from before `start_date`.
+    """
     if loggers is None:
         loggers = current_app.config["HOBOLINK_LOGGERS"]
     if token is None:
         token = current_app.config["HOBOLINK_BEARER_TOKEN"]
+    if checkpoint is None:
+        checkpoint = {}
+    max_workers = current_app.config["HOBOLINK_MAX_CONCURRENT_REQUESTS"]
+    cache = get_upstream_cache()
+
+    window_size = _choose_window_size(loggers, end_date - start_date)
+    windows = _get_request_windows(
+        start_date=start_date, end_date=end_date, pagination_delta=window_size
+    )
+
+    client = get_upstream_client("hobolink")
+    headers = _get_request_headers(token)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            window: executor.submit(
+                _request_window_splitting, client, headers, *window, window_size, loggers, cache
+            )
+            for window in windows
+            if window not in checkpoint
+        }
+        # Save every window that succeeded before raising any errors.
+        for window, future in futures.items():
+            if future.exception() is None:
+                checkpoint[window] = future.result()
+        for future in futures.values():
+            future.result()
+
+    _record_readings_per_second(loggers, {w: checkpoint[w] for w in windows}, window_size)
+
+    # Collect in window order, not completion order, so the readings come back
+    # sorted by time.
+    data = HobolinkReadings()
+    for window in windows:
+        data.merge(checkpoint[window])
+
+    return data
+
 
-    # HOBOLink API returns max of 100,000 results at a time.
-    # Additionally, there is no pagination.
-    # Therefore we must paginate ourselves.
-    #
+def _choose_window_size(loggers: str, span: timedelta) -> timedelta:
+    """The largest window size that should come back with no more than
+    `HOBOLINK_TARGET_FRACTION` of the max number of results, based on the
+    previous responses for these loggers.
+
+    The size is also capped at `span`, the length of the requested date range.
+    A closed first window starts on the grid, which can be up to a whole window
+    before the start of the range, so a window much larger than the range would
+    mostly download data that wasn't asked for.
+    """
+    rate = _readings_per_second.get(loggers)
+    if rate is None:
+        size = HOBOLINK_DEFAULT_WINDOW_SIZE
+    else:
+        target = HOBOLINK_MAX_RESULTS * HOBOLINK_TARGET_FRACTION
+        fits = [i for i in HOBOLINK_WINDOW_SIZES if rate * i.total_seconds() <= target]
+        size = fits[-1] if fits else HOBOLINK_WINDOW_SIZES[0]
+    fits = [i for i in HOBOLINK_WINDOW_SIZES if i <= min(size, span)]
+    return fits[-1] if fits else HOBOLINK_WINDOW_SIZES[0]
+
+
+def _record_readings_per_second(
+    loggers: str,
+    readings: dict[tuple[datetime, datetime], "HobolinkReadings"],
+    window_size: timedelta,
+) -> None:
+    # Windows that were cut off at the end date usually reach into the future
+    # and have fewer readings than they would otherwise, so they are skipped.
+    full_windows = [
+        len(data) for (start, end), data in readings.items() if end - start >= window_size / 2
+    ]
+    if full_windows:
+        _readings_per_second[loggers] = max(full_windows) / window_size.total_seconds()
+
+
+def _get_request_windows(
+    start_date: datetime,
+    end_date: datetime,
+    pagination_delta: timedelta = HOBOLINK_DEFAULT_WINDOW_SIZE,
+) -> list[tuple[datetime, datetime]]:
+    """Split a date range into the windows we request from HOBOlink.
+
+    Closed windows are aligned to a fixed grid (rather than starting at
+    `start_date`) so that the same past windows get requested every time, which
+    is what lets us cache them. A window that is still open isn't cached, so it
+    starts at `start_date`; otherwise an update that only needs the last hour
+    or two would download everything since the start of the grid window.
+    """
     # Note that API timestamps also pull full closed interval of data,
     # so we need to be careful to not accidentally pull duplicates by timestamp.
-    pagination_delta = timedelta(days=10)
+    # Every window ends one second before the next window starts.
     epsilon_delta = timedelta(seconds=1)
-    data: list[dict[str, Any]] = []
+    grid_origin = datetime.fromtimestamp(0, tz=UTC)
 
-    start_date_for_req = start_date
-    end_date_for_req = min(start_date + pagination_delta, end_date)
-    half_interval = False
+    if start_date.tzinfo is None:
+        start_date = start_date.replace(tzinfo=UTC)
+    if end_date.tzinfo is None:
+        end_date = end_date.replace(tzinfo=UTC)
 
-    while True:
-        res = requests.get(
-            urljoin(BASE_URL, "/v1/data"),
-            params={
-                "start_date_time": start_date_for_req.strftime("%Y-%m-%d %H:%M:%S"),
-                "end_date_time": end_date_for_req.strftime("%Y-%m-%d %H:%M:%S"),
-                "loggers": loggers,
-            },
-            headers={"Authorization": f"Bearer {token}", "accept": "application/json"},
+    windows = []
+    window_start = grid_origin + (start_date - grid_origin) // pagination_delta * pagination_delta
+    while window_start <= end_date:
+        windows.append(
+            (window_start, min(window_start + pagination_delta - epsilon_delta, end_date))
         )
-        if res.status_code >= 400:
-            error_msg = (
-                f"API request to the HOBOlink endpoint failed with status code {res.status_code}:"
-                + res.text
+        window_start += pagination_delta
+
+    if windows and not is_closed_window(windows[0][1]):
+        windows[0] = (start_date, windows[0][1])
+
+    return windows
+
+
+def _request_window_splitting(
+    client: UpstreamClient,
+    headers: dict[str, str],
+    start_date: datetime,
+    end_date: datetime,
+    window_size: timedelta,
+    loggers: str,
+    cache: UpstreamCache | None = None,
+) -> "HobolinkReadings":
+    """Request a window, and if the response hits the max number of results,
+    split the window in half and request each half (and so on).
+    """
+    readings = _request_window(client, headers, start_date, end_date, loggers, cache)
+    if len(readings) < HOBOLINK_MAX_RESULTS:
+        return readings
+
+    # The response was cut off, so don't keep it around.
+    if cache is not None:
+        cache.discard("hobolink", loggers or "", start_date, end_date)
+
+    half = window_size / 2
+    if half < HOBOLINK_WINDOW_SIZES[0]:
+        abort(
+            500,
+            f"HOBOlink returned the max of {HOBOLINK_MAX_RESULTS} results for {start_date} to"
+            f" {end_date}, and the window is too small to split any further.",
+        )
+
+    readings = HobolinkReadings()
+    for window in _get_request_windows(start_date, end_date, pagination_delta=half):
+        readings.merge(_request_window_splitting(client, headers, *window, half, loggers, cache))
+    return readings
+
+
+@retry(reraise=True, wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(3))
+def _request_window(
+    client: UpstreamClient,
+    headers: dict[str, str],
+    start_date: datetime,
+    end_date: datetime,
+    loggers: str,
+    cache: UpstreamCache | None = None,
+) -> "HobolinkReadings":
+    @contextmanager
+    def _fetch() -> Iterator[Iterable[bytes]]:
+        with client.stream(
+            urljoin(BASE_URL, "/v1/data"),
+            params=_get_request_params(start_date, end_date, loggers),
+            headers=headers,
+        ) as res:
+            if res.status_code >= 400:
+                error_msg = (
+                    "API request to the HOBOlink endpoint failed with status code"
+                    f" {res.status_code}:" + res.text
+                )
+                abort(500, error_msg)
+            yield res.iter_content(chunk_size=CHUNK_SIZE)
+
+    body = iter_response_body(cache, "hobolink", loggers or "", start_date, end_date, _fetch)
+    readings = HobolinkReadings()
+    readings.extend(iter_json_array(body, key="data"))
+    return readings
+
+
+def _get_request_headers(token: str) -> dict[str, str]:
+    return {"Authorization": f"Bearer {token}", "accept": "application/json"}
+
+
+def _get_request_params(start_date: datetime, end_date: datetime, loggers: str) -> dict[str, str]:
+    return {
+        "start_date_time": start_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_date_time": end_date.strftime("%Y-%m-%d %H:%M:%S"),
+        "loggers": loggers,
+    }
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator[Any]:
+    """Incrementally decode the items of a JSON array out of a response body.
+
+    The body is expected to be a JSON object containing an array of objects
+    under `key`. Items are yielded as soon as they have been fully read, so
+    the whole body and the whole decoded array never have to be in memory at
+    the same time. Once the array is done, the rest of the body is read and
+    thrown away, so that the body is always consumed in full.
+
+    Args:
+        chunks: (Iterable[bytes]) Pieces of the response body.
+        key: (str) Key of the array in the top-level JSON object.
+
+    Returns:
+        Iterator of the decoded array items.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    array_start = re.compile(r'"' + re.escape(key) + r'"\s*:\s*\[')
+    chunks = iter(chunks)
+    buffer = ""
+    pos = None
+
+    def read_more() -> bool:
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        # Drop everything that has already been decoded.
+        if pos is not None:
+            buffer, pos = buffer[pos:], 0
+        buffer += text_decoder.decode(chunk)
+        return True
+
+    # Find the start of the array.
+    while pos is None:
+        match = array_start.search(buffer)
+        if match:
+            pos = match.end()
+        elif not read_more():
+            raise ValueError(f"Could not find {key!r} in the JSON response.")
+
+    # Then read one item at a time until the end of the array.
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buffer):
+            if not read_more():
+                raise ValueError("JSON response ended in the middle of an array.")
+            continue
+        if buffer[pos] == "]":
+            for _ in chunks:
+                pass
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The item was cut off by the end of the chunk.
+            if not read_more():
+                raise
+            continue
+        pos = end
+        yield item
+
+
+class HobolinkReadings:
+    """Columnar accumulator for HOBOlink readings.
+
+    The HOBOlink API returns one JSON object per sensor reading. Rather than
+    keeping a list of those objects around, readings are appended straight
+    into typed arrays. Timestamps, sensor serial numbers and measurement types
+    repeat a lot, so they are interned and stored as integer codes.
+    """
+
+    def __init__(self):
+        self.timestamps: dict[str, int] = {}
+        self.sensors: dict[str, int] = {}
+        self.measurement_types: dict[str, int] = {}
+        self.time_codes = array("q")
+        self.sensor_codes = array("q")
+        self.measurement_type_codes = array("q")
+        self.values = array("d")
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def append(self, reading: dict[str, Any]) -> None:
+        self.extend((reading,))
+
+    def extend(self, readings: Iterable[dict[str, Any]]) -> None:
+        # This loop runs once per reading, so the lookups are hoisted out of it.
+        timestamps = self.timestamps
+        sensors = self.sensors
+        measurement_types = self.measurement_types
+        add_time = self.time_codes.append
+        add_sensor = self.sensor_codes.append
+        add_measurement_type = self.measurement_type_codes.append
+        add_value = self.values.append
+        nan = np.nan
+
+        for reading in readings:
+            timestamp = reading["timestamp"]
+            code = timestamps.get(timestamp)
+            if code is None:
+                code = timestamps[timestamp] = len(timestamps)
+            add_time(code)
+
+            sensor_sn = reading["sensor_sn"]
+            code = sensors.get(sensor_sn)
+            if code is None:
+                code = sensors[sensor_sn] = len(sensors)
+            add_sensor(code)
+
+            measurement_type = reading["sensor_measurement_type"]
+            code = measurement_types.get(measurement_type)
+            if code is None:
+                code = measurement_types[measurement_type] = len(measurement_types)
+            add_measurement_type(code)
+
+            value = reading["value"]
+            add_value(nan if value is None else value)
+
+    def merge(self, other: "HobolinkReadings") -> None:
+        """Append all the readings from another `HobolinkReadings`."""
+        for attr, codes, own_codes in [
+            ("timestamps", other.time_codes, self.time_codes),
+            ("sensors", other.sensor_codes, self.sensor_codes),
+            ("measurement_types", other.measurement_type_codes, self.measurement_type_codes),
+        ]:
+            lookup = getattr(self, attr)
+            remap = np.array(
+                [lookup.setdefault(i, len(lookup)) for i in getattr(other, attr)], dtype=np.int64
             )
-            abort(500, error_msg)
+            own_codes.frombytes(remap[np.frombuffer(codes, dtype=np.int64)].tobytes())
+        self.values.extend(other.values)
 
-        data.extend(res.json()["data"])
+    def to_dataframe(self, exclude_sensors: list[str]) -> pd.DataFrame:
+        """Build a DataFrame with one row per timestamp and one column per
+        measurement type, by scattering the values into a preallocated matrix.
+        """
+        sensor_codes = np.frombuffer(self.sensor_codes, dtype=np.int64)
+        excluded_sensors = np.isin(list(self.sensors), exclude_sensors)
+        keep = ~excluded_sensors[sensor_codes]
 
-        if end_date_for_req == end_date:
-            break
+        # Parse each distinct timestamp once, then map codes onto sorted rows.
+        # HOBOlink timestamps are in UTC; saying so keeps the column tz-aware
+        # even when there are no readings.
+        parsed_times = pd.to_datetime(pd.Series(list(self.timestamps), dtype=object), utc=True)
+        time_rows, times = pd.factorize(parsed_times, sort=True)
+        rows = time_rows[np.frombuffer(self.time_codes, dtype=np.int64)[keep]]
 
-        end_date_for_req += pagination_delta
-        start_date_for_req += pagination_delta
-        if not half_interval:
-            start_date_for_req += epsilon_delta
-            half_interval = True
+        # Same deal for the column names.
+        names = pd.Series(list(self.measurement_types), dtype=object)
+        names = names.str.lower().str.replace(" ", "_")
+        name_cols, columns = pd.factorize(names, sort=True)
+        cols = name_cols[np.frombuffer(self.measurement_type_codes, dtype=np.int64)[keep]]
 
-    return data
+        # Only keep the rows and columns that have at least one reading.
+        used_rows = np.unique(rows)
+        used_cols = np.unique(cols)
+        rows = np.searchsorted(used_rows, rows)
+        cols = np.searchsorted(used_cols, cols)
+
+        flat = rows * len(used_cols) + cols
+        if len(flat) and np.bincount(flat).max() > 1:
+            raise ValueError("Index contains duplicate entries, cannot reshape")
+
+        matrix = np.full((len(used_rows), len(used_cols)), np.nan)
+        matrix[rows, cols] = np.frombuffer(self.values, dtype=np.float64)[keep]
+
+        df = pd.DataFrame(
+            matrix,
+            columns=pd.Index(columns[used_cols], name="sensor_measurement_type"),
+        )
+        df.insert(0, "time", times[used_rows])
+        return df
 
 
 def parse_hobolink_data(
-    data: list[dict[str, Any]], exclude_sensors: list[str] | None = None
+    data: list[dict[str, Any]] | HobolinkReadings, exclude_sensors: list[str] | None = None
 ) -> pd.DataFrame:
     """
     Clean the response from the HOBOlink API.
 
     Args:
-        res: (str) A string of the text received from the post request to the
-             HOBOlink API from a successful request.
+        data: Readings from `request_to_hobolink`, either as a list of dicts
+              or already accumulated into a `HobolinkReadings`.
+        exclude_sensors: (list[str]) Serial numbers of sensors to drop.
     Returns:
         Pandas DataFrame containing the HOBOlink data.
     """
@@ -123,12 +521,9 @@ def parse_hobolink_data(
         # This sensor is for internal temp of device.
         exclude_sensors = current_app.config["HOBOLINK_EXCLUDE_SENSORS"]
 
-    df = pd.DataFrame(data)
-    df = df.loc[~df["sensor_sn"].isin(exclude_sensors), :]
-    df["time"] = pd.to_datetime(df["timestamp"])
-    df["sensor_measurement_type"] = df["sensor_measurement_type"].str.lower().str.replace(" ", "_")
+    if not isinstance(data, HobolinkReadings):
+        readings = HobolinkReadings()
+        readings.extend(data)
+        data = readings
 
-    df = df.pivot(index="time", columns="sensor_measurement_type", values="value")
-    df = df.reset_index()
-
-    return df
+    return data.to_dataframe(exclude_sensors=exclude_sensors)
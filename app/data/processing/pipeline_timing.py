@@ -0,0 +1,184 @@
+"""
+Records how long each stage of a database update takes, and how many rows and
+bytes it handles, in the `pipeline_run` table.
+
+Stages are timed with `timed_stage`, which does nothing outside of a
+`record_pipeline_run` block. That way the fetching and parsing functions can be
+timed where they are, without passing a timer through every call.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict
+from dataclasses import dataclass
+from datetime import UTC
+from datetime import datetime
+from typing import Iterator
+from typing import Optional
+
+import pandas as pd
+from flask import current_app
+
+from app.data.database import db
+from app.data.models.pipeline_run import PipelineRun
+
+
+REGRESSION_RECENT_RUNS = 5
+"""How many of the latest runs are compared against the runs before them."""
+
+REGRESSION_FACTOR = 1.5
+"""A stage has regressed if its median time over the latest runs is this many
+times its median time over the runs before them."""
+
+REGRESSION_MIN_SECONDS = 0.5
+"""Stages that take less than this are too noisy to flag as regressions."""
+
+
+@dataclass
+class StageTiming:
+    stage: str
+    seconds: float = 0.0
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+
+
+class PipelineTimer:
+    """Collects the stage timings of one pipeline run. Stages with the same
+    name are added together, e.g. when the data is parsed in several windows.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(UTC)
+        self.stages: dict[str, StageTiming] = {}
+        self.input_hash: Optional[str] = None
+        self.skipped = False
+        self._lock = threading.Lock()
+
+    def add(self, timing: StageTiming) -> None:
+        # Stages can be timed from the threads that fetch the data.
+        with self._lock:
+            total = self.stages.setdefault(timing.stage, StageTiming(timing.stage))
+            total.seconds += timing.seconds
+            if timing.rows is not None:
+                total.rows = (total.rows or 0) + timing.rows
+            if timing.bytes is not None:
+                total.bytes = (total.bytes or 0) + timing.bytes
+
+
+_current_timer: ContextVar[Optional[PipelineTimer]] = ContextVar("pipeline_timer", default=None)
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[StageTiming]:
+    """Time the block as `stage` of the current pipeline run. Set `rows` and
+    `bytes` on the yielded `StageTiming` to record those too.
+    """
+    timing = StageTiming(stage)
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.seconds = time.perf_counter() - start
+        timer = _current_timer.get()
+        if timer is not None:
+            timer.add(timing)
+
+
+@contextmanager
+def record_pipeline_run() -> Iterator[PipelineTimer]:
+    """Time every `timed_stage` in the block, and store them as a
+    `PipelineRun` once the block is done, whether or not it succeeded.
+    """
+    timer = PipelineTimer()
+    token = _current_timer.set(timer)
+    start = time.perf_counter()
+    succeeded = False
+    try:
+        yield timer
+        succeeded = True
+    finally:
+        _current_timer.reset(token)
+        _save_pipeline_run(timer, seconds=time.perf_counter() - start, succeeded=succeeded)
+
+
+def _save_pipeline_run(timer: PipelineTimer, seconds: float, succeeded: bool) -> None:
+    # Failing to record the timings should never fail the update, or hide the
+    # error that the update failed with.
+    try:
+        db.session.add(
+            PipelineRun(
+                started_at=timer.started_at,
+                seconds=seconds,
+                succeeded=succeeded,
+                skipped=timer.skipped,
+                input_hash=timer.input_hash,
+                stages=[asdict(i) for i in timer.stages.values()],
+            )
+        )
+        # Only keep the most recent runs, so the table doesn't grow forever.
+        keep = db.session.query(PipelineRun.id).order_by(PipelineRun.started_at.desc())
+        keep = keep.limit(current_app.config["PIPELINE_RUN_HISTORY"])
+        db.session.query(PipelineRun).filter(PipelineRun.id.not_in(keep.scalar_subquery())).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Could not record the pipeline run.")
+
+
+def get_stage_timings(runs: list[PipelineRun]) -> pd.DataFrame:
+    """One row per stage of each run, newest runs first. Only successful runs
+    are included, since a failed run's stages stop partway through.
+    """
+    records = [
+        {"run_id": run.id, "started_at": run.started_at, **stage}
+        for run in runs
+        if run.succeeded
+        for stage in run.stages
+    ]
+    columns = ["run_id", "started_at", "stage", "seconds", "rows", "bytes"]
+    df = pd.DataFrame.from_records(records, columns=columns)
+    return df.sort_values("started_at", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def summarize_stage_timings(df: pd.DataFrame) -> pd.DataFrame:
+    """The p50 and p95 seconds of each stage from `get_stage_timings`, and
+    whether the stage has gotten slower over the latest runs.
+    """
+    out = []
+    for stage, df_stage in df.groupby("stage", sort=False):
+        seconds = df_stage["seconds"]
+        recent = seconds.iloc[:REGRESSION_RECENT_RUNS]
+        before = seconds.iloc[REGRESSION_RECENT_RUNS:]
+        regressed = (
+            len(before) >= REGRESSION_RECENT_RUNS
+            and recent.median() >= REGRESSION_MIN_SECONDS
+            and recent.median() > REGRESSION_FACTOR * before.median()
+        )
+        out.append(
+            {
+                "stage": stage,
+                "runs": len(df_stage),
+                "latest_seconds": seconds.iloc[0],
+                "p50_seconds": seconds.quantile(0.5),
+                "p95_seconds": seconds.quantile(0.95),
+                "latest_rows": df_stage["rows"].iloc[0],
+                "latest_bytes": df_stage["bytes"].iloc[0],
+                "regressed": regressed,
+            }
+        )
+    columns = [
+        "stage",
+        "runs",
+        "latest_seconds",
+        "p50_seconds",
+        "p95_seconds",
+        "latest_rows",
+        "latest_bytes",
+        "regressed",
+    ]
+    df_summary = pd.DataFrame.from_records(out, columns=columns)
+    return df_summary.astype({"latest_rows": "Int64", "latest_bytes": "Int64"})
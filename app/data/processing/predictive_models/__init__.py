@@ -0,0 +1,54 @@
+"""
+The predictive models. Each model version is a module with a `process_data`
+function that turns the raw data into features, and an `all_models` function
+that makes predictions from those features. The features are declared as the
+module's `FEATURES`, see `features.py`.
+"""
+
+from enum import Enum
+from typing import Protocol
+
+import pandas as pd
+
+from app.data.processing.predictive_models.features import FeatureSpec
+
+
+class ModelModule(Protocol):
+    MODEL_YEAR: str
+    FEATURES: FeatureSpec
+
+    def process_data(
+        self, df_hobolink: pd.DataFrame, df_usgs_w: pd.DataFrame, df_usgs_b: pd.DataFrame
+    ) -> pd.DataFrame: ...
+
+    def all_models(self, df: pd.DataFrame, *args, **kwargs) -> pd.DataFrame: ...
+
+
+class ModelVersion(str, Enum):
+    v1 = "v1"
+    v2 = "v2"
+    v3 = "v3"
+    v4 = "v4"
+
+    def get_module(self) -> ModelModule:
+        if self == self.__class__.v1:
+            from app.data.processing.predictive_models import v1
+
+            return v1
+        elif self == self.__class__.v2:
+            from app.data.processing.predictive_models import v2
+
+            return v2
+        elif self == self.__class__.v3:
+            from app.data.processing.predictive_models import v3
+
+            return v3
+        elif self == self.__class__.v4:
+            from app.data.processing.predictive_models import v4
+
+            return v4
+        else:
+            raise ValueError(f"Unclear what happened; {self} not supported")
+
+
+DEFAULT_MODEL_VERSION = ModelVersion.v4
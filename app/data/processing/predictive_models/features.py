@@ -0,0 +1,333 @@
+"""
+The features of each model version are declared as a `FeatureSpec`: which
+columns of the HOBOlink and USGS data it uses, how they are transformed and
+collapsed into hourly rows, and which rolling windows are taken over those.
+
+`process_data` computes any number of specs in one pass over the data. Anything
+that several specs have in common, e.g. the hourly rain or its rolling 12 hour
+sum, is only computed once, so running more model versions on the same data
+doesn't mean processing it all over again for each of them.
+"""
+
+from typing import Literal
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from app.data.processing.predictive_models.rolling import RollingSums
+
+
+Source = Literal["hobolink", "usgs_w", "usgs_b"]
+
+
+class Hourly(NamedTuple):
+    """A column of the hourly data, collapsed from a column of the source data."""
+
+    name: str
+    source: Source
+    column: str
+    agg: Literal["mean", "sum"] = "mean"
+    transform: Optional[Literal["log", "fill_dew_point"]] = None
+    """Applied to the source data before it is collapsed. "log" takes the log
+    of the column with a floor of 1, and "fill_dew_point" fills the missing
+    dew points from the temperature and relative humidity."""
+
+
+class Window(NamedTuple):
+    """A rolling statistic over the last `hours` hours of a column."""
+
+    name: str
+    column: str
+    hours: int
+    stat: Literal["mean", "sum", "geomean", "exp_mean"]
+    """"geomean" is the geometric mean of the column. "exp_mean" is the same
+    thing for a column that is already a log, e.g. from `Hourly.transform`."""
+
+
+class WindowSum(NamedTuple):
+    """The sum of a column from `start_hours` to `end_hours` hours ago."""
+
+    name: str
+    column: str
+    start_hours: int
+    end_hours: int
+
+
+class DaysSince(NamedTuple):
+    """The number of days since a column was last above a threshold."""
+
+    name: str
+    column: str
+    threshold: float
+    last: str
+    """Name of the column with the time it was last above the threshold."""
+    inclusive: bool = True
+    """Whether being equal to the threshold counts."""
+    flag: Optional[str] = None
+    """Name of the column with whether it is above the threshold, if any."""
+    max_days: Optional[float] = None
+
+
+Feature = Union[Window, WindowSum, DaysSince]
+
+
+class FeatureSpec(NamedTuple):
+    hourly: tuple[Hourly, ...]
+    features: tuple[Feature, ...]
+    required: tuple[str, ...]
+    """Hourly columns that the last hour can't be missing. Otherwise the last
+    hour is dropped, since one of the sources hasn't caught up yet."""
+
+    @property
+    def window_hours(self) -> int:
+        """Longest rolling window of the features, in hours."""
+        hours = [1]
+        for feature in self.features:
+            if isinstance(feature, Window):
+                hours.append(feature.hours)
+            elif isinstance(feature, WindowSum):
+                hours.append(feature.end_hours)
+        return max(hours)
+
+
+def _log(df: pd.DataFrame, column: str) -> pd.Series:
+    # Put a floor on all of these variables, to be safe.
+    return np.log(np.maximum(df[column], 1))
+
+
+def _fill_dew_point(df: pd.DataFrame, column: str) -> pd.Series:
+    # Fill missing data for dew point using the Magnus formula.
+    # Hobolink device is having issues with this field.
+    c = 243.04
+    b = 17.625
+    temp_celsius = (df["temperature"] - 32) * 5 / 9
+    gamma = np.log(df["rh"] / 100) + (b * temp_celsius) / (c + temp_celsius)
+    dew_point_est = (c * gamma / (b - gamma)) * 9 / 5 + 32
+    return df[column].fillna(dew_point_est)
+
+
+TRANSFORMS = {"log": _log, "fill_dew_point": _fill_dew_point}
+
+
+def _hourly_key(hourly: Hourly) -> str:
+    key = f"{hourly.source}.{hourly.column}"
+    if hourly.transform is not None:
+        key += f"|{hourly.transform}"
+    return f"{key}|{hourly.agg}"
+
+
+def _flag_key(feature: DaysSince, column: str) -> str:
+    op = ">=" if feature.inclusive else ">"
+    return f"{column} {op} {feature.threshold}"
+
+
+def _rolling_series(key: str, stat: str) -> str:
+    """The key of the series that a rolling `stat` of `key` is taken over."""
+    return f"log({key})" if stat == "geomean" else key
+
+
+def _keys(spec: FeatureSpec) -> dict[str, str]:
+    """Maps each column name of the spec to the key that it is computed under,
+    which is the same for every spec that computes the same thing.
+    """
+    keys = {i.name: _hourly_key(i) for i in spec.hourly}
+    for feature in spec.features:
+        column = keys[feature.column]
+        if isinstance(feature, Window):
+            keys[feature.name] = f"{feature.stat}({column}, {feature.hours}h)"
+        elif isinstance(feature, WindowSum):
+            keys[feature.name] = f"sum({column}, {feature.start_hours}h to {feature.end_hours}h)"
+        elif isinstance(feature, DaysSince):
+            flag = _flag_key(feature, column)
+            if feature.flag is not None:
+                keys[feature.flag] = flag
+            keys[feature.last] = f"last({flag})"
+            keys[feature.name] = f"days_since({flag}, max={feature.max_days})"
+    return keys
+
+
+def aggregate_hourly(
+    specs: Sequence[FeatureSpec],
+    df_hobolink: pd.DataFrame,
+    df_usgs_w: pd.DataFrame,
+    df_usgs_b: pd.DataFrame,
+) -> pd.DataFrame:
+    """Collapses the Hobolink and USGS data to hourly rows and joins them.
+
+    The columns are every `Hourly` column of `specs`, under the keys that
+    `add_features` expects.
+    """
+    sources = {"hobolink": df_hobolink, "usgs_w": df_usgs_w, "usgs_b": df_usgs_b}
+    hourly_columns = {_hourly_key(i): i for spec in specs for i in spec.hourly}
+
+    df = None
+    for source, df_source in sources.items():
+        columns = [i for i in hourly_columns.items() if i[1].source == source]
+        if not columns and source != "hobolink":
+            continue
+
+        # Cast to datetime type.
+        # When this comes from Celery, it might be a string.
+        # Then convert all timestamps to hourly in preparation for aggregation.
+        df_transformed = pd.DataFrame({"time": pd.to_datetime(df_source["time"]).dt.floor("h")})
+        aggs = {}
+        for key, hourly in columns:
+            column = hourly.column
+            if hourly.transform is not None:
+                column = f"{hourly.column}|{hourly.transform}"
+                if column not in df_transformed:
+                    func = TRANSFORMS[hourly.transform]
+                    df_transformed[column] = func(df_source, hourly.column)
+            elif column not in df_transformed:
+                df_transformed[column] = df_source[column]
+            aggs[key] = (column, hourly.agg)
+
+        # Take the mean measurements of everything except rain; rain is the sum
+        # within an hour. (HOBOlink devices record all rain seen in 10 minutes).
+        df_source = df_transformed.groupby("time").agg(**aggs).reset_index()
+
+        # This is an outer join to include all the data (we collect more Hobolink
+        # data than USGS data). With that said, for the most recent value, we need
+        # to make sure one of the sources didn't update before the other one did.
+        if df is None:
+            df = df_source
+        else:
+            df = df.merge(right=df_source, how="left", on="time")
+
+    df = df.sort_values("time")
+    df = df.reset_index()
+    return df
+
+
+def hourly_columns(spec: FeatureSpec, df: pd.DataFrame) -> pd.DataFrame:
+    """Turns the hourly columns of `spec`'s output back into the keys that
+    `add_features` expects, e.g. to add more hours to already processed data.
+    """
+    keys = _keys(spec)
+    df = df[["time", *[i.name for i in spec.hourly]]]
+    return df.rename(columns={i.name: keys[i.name] for i in spec.hourly})
+
+
+def add_features(
+    specs: Sequence[FeatureSpec],
+    df: pd.DataFrame,
+    last_rain: Optional[pd.Timestamp] = None,
+) -> list[pd.DataFrame]:
+    """Computes the features of each of `specs` from the hourly data of
+    `aggregate_hourly`.
+
+    Args:
+        specs: The feature specs.
+        df: Hourly data.
+        last_rain: For `DaysSince` features, when the column was last above the
+                   threshold before the first row of `df`. Defaults to the
+                   first row's time.
+
+    Returns:
+        The output of each spec, in the same order as `specs`.
+    """
+    if last_rain is None:
+        last_rain = df["time"].min()
+
+    columns: dict[str, pd.Series] = {key: df[key] for key in df.columns}
+
+    # Every window over the same series is taken from one `RollingSums`, so it
+    # needs to know the longest of them up front.
+    max_windows: dict[str, int] = {}
+    for spec in specs:
+        keys = _keys(spec)
+        for feature in spec.features:
+            if isinstance(feature, Window):
+                series, hours = _rolling_series(keys[feature.column], feature.stat), feature.hours
+            elif isinstance(feature, WindowSum):
+                series, hours = keys[feature.column], feature.end_hours
+            else:
+                continue
+            max_windows[series] = max(max_windows.get(series, 1), hours)
+    rolling_sums: dict[str, RollingSums] = {}
+
+    def _rolling(key: str, hours: int, stat: str) -> pd.Series:
+        out_key = f"{stat}({key}, {hours}h)"
+        if out_key not in columns:
+            series = _rolling_series(key, stat)
+            if series not in columns:
+                columns[series] = np.log(columns[key])
+            if series not in rolling_sums:
+                rolling_sums[series] = RollingSums(columns[series], max_windows[series])
+            if stat == "sum":
+                values = rolling_sums[series].sum(hours)
+            else:
+                values = rolling_sums[series].mean(hours)
+            if stat in ("geomean", "exp_mean"):
+                values = np.exp(values)
+            columns[out_key] = pd.Series(values, index=df.index)
+        return columns[out_key]
+
+    out = []
+    for spec in specs:
+        keys = _keys(spec)
+        for feature in spec.features:
+            key = keys[feature.name]
+            if key in columns:
+                continue
+            column = keys[feature.column]
+            if isinstance(feature, Window):
+                _rolling(column, feature.hours, feature.stat)
+            elif isinstance(feature, WindowSum):
+                columns[key] = _rolling(column, feature.end_hours, "sum") - _rolling(
+                    column, feature.start_hours, "sum"
+                )
+            elif isinstance(feature, DaysSince):
+                flag = _flag_key(feature, column)
+                if flag not in columns:
+                    if feature.inclusive:
+                        columns[flag] = columns[column] >= feature.threshold
+                    else:
+                        columns[flag] = columns[column] > feature.threshold
+                last = keys[feature.last]
+                if last not in columns:
+                    columns[last] = columns["time"].where(columns[flag]).ffill().fillna(last_rain)
+                days = (columns["time"] - columns[last]).dt.total_seconds() / 60 / 60 / 24
+                if feature.max_days is not None:
+                    days = np.minimum(days, feature.max_days)
+                columns[key] = days
+
+        names = ["index"] if "index" in df.columns else []
+        names += ["time", *[i.name for i in spec.hourly]]
+        for feature in spec.features:
+            if isinstance(feature, DaysSince):
+                if feature.flag is not None:
+                    names.append(feature.flag)
+                names.append(feature.last)
+            names.append(feature.name)
+        keys.update({"index": "index", "time": "time"})
+        df_spec = pd.DataFrame({name: columns[keys[name]] for name in names})
+
+        # Drop last row if any of the sources is missing.
+        # We drop instead of `ffill()` because we want the model to output
+        # consistently each hour. The rolling features only look backwards, so
+        # this can be done after they are computed.
+        if not df_spec.empty and df_spec.iloc[-1, :][list(spec.required)].isna().any():
+            df_spec = df_spec.drop(df_spec.index[-1])
+        out.append(df_spec)
+    return out
+
+
+def process_data(
+    specs: Sequence[FeatureSpec],
+    df_hobolink: pd.DataFrame,
+    df_usgs_w: pd.DataFrame,
+    df_usgs_b: pd.DataFrame,
+) -> list[pd.DataFrame]:
+    """Computes the features of each of `specs` in one pass over the Hobolink
+    and USGS data.
+
+    Returns:
+        The output of each spec, in the same order as `specs`.
+    """
+    df = aggregate_hourly(specs, df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    return add_features(specs, df)
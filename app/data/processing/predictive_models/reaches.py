@@ -0,0 +1,101 @@
+"""
+The reach models of each model version are declared as `ReachModels`: for each
+reach, the coefficients of a linear model over the features from
+`process_data`, the link function that turns it into the prediction, and the
+threshold for the water being safe.
+
+`ReachModels.predict` puts the coefficients of every reach into one matrix, so
+all of the reaches are scored for every hour with a single matrix multiply.
+"""
+
+from typing import Literal
+from typing import NamedTuple
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+Link = Literal["logistic", "exp"]
+
+
+def sigmoid(ser: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-ser))
+
+
+LINKS = {
+    # The logistic models predict the probability of the water being unsafe,
+    # and the water is safe up to and including the threshold.
+    "logistic": ("probability", sigmoid, np.less_equal),
+    # The log-linear models predict the E. coli count, and the water is safe
+    # below the threshold.
+    "exp": ("predicted_ecoli_cfu_100ml", np.exp, np.less),
+}
+
+
+class Reach(NamedTuple):
+    reach_id: int
+    intercept: float
+    coefficients: dict[str, float]
+    """Coefficient of each feature from `process_data`."""
+    link: Link
+    threshold: float
+
+
+class ReachModels:
+    """The models of every reach of one model version."""
+
+    def __init__(self, *reaches: Reach):
+        links = {i.link for i in reaches}
+        if len(links) != 1:
+            raise ValueError("The reaches of a model version must share a link function.")
+        self.reaches = reaches
+        self.reach_ids = np.array([i.reach_id for i in reaches], dtype=np.int64)
+        self.features = list(dict.fromkeys(k for i in reaches for k in i.coefficients))
+        self.output, self._link, self._is_safe = LINKS[links.pop()]
+
+        # One column per reach, and one row per feature.
+        self._coefficients = np.array(
+            [[i.coefficients.get(k, 0.0) for i in reaches] for k in self.features],
+            dtype=np.float64,
+        ).reshape(len(self.features), len(reaches))
+        self._uses = self._coefficients != 0
+        self._intercepts = np.array([i.intercept for i in reaches], dtype=np.float64)
+        self._thresholds = np.array([i.threshold for i in reaches], dtype=np.float64)
+
+    def predict(self, df: pd.DataFrame, rows: Optional[int] = None) -> pd.DataFrame:
+        """Scores every reach for every hour of `df`.
+
+        Args:
+            df: Input data from `process_data()`
+            rows: (int) Number of rows to return, from the end of `df`.
+
+        Returns:
+            One row per reach and hour, sorted by reach and then time, without
+            the hours that a reach's features are missing for.
+        """
+        if rows is not None:
+            df = df.tail(n=rows)
+
+        x = np.ascontiguousarray(df[self.features].to_numpy(dtype=np.float64))
+        # A missing feature only makes the predictions of the reaches that use
+        # it missing, not every reach's.
+        missing = np.isnan(x)
+        z = np.where(missing, 0.0, x) @ self._coefficients + self._intercepts
+        z[missing @ self._uses] = np.nan
+        predictions = self._link(z)
+        safe = self._is_safe(predictions, self._thresholds)
+
+        # Rows go reach by reach, and by time within each reach.
+        order = df["time"].reset_index(drop=True).sort_values(kind="stable").index.to_numpy()
+        time = df["time"].take(np.tile(order, len(self.reaches)))
+        out = pd.DataFrame(
+            {
+                "reach_id": np.repeat(self.reach_ids, len(order)),
+                "time": time.array,
+                self.output: predictions[order].T.ravel(),
+                "safe": safe[order].T.ravel(),
+            },
+            index=time.index,
+        )
+        return out.loc[out[self.output].notna(), :]
@@ -0,0 +1,94 @@
+"""
+Rolling sums and means over several windows of the same series.
+
+`RollingSums` takes one cumulative sum of a series, and of how many of its
+values are valid, once. The sum or mean over any window up to `max_window` is
+then the difference of two entries of those, so e.g. the 12, 24 and 72 hour
+windows of a column don't each take their own pass over it. Missing values,
+which include infinities, are handled the same way as pandas `rolling()`.
+
+The cumulative sum restarts every `BLOCK_ROWS` rows (or `max_window`, if that
+is longer), so its entries stay on the scale of a few windows' sums. Otherwise,
+over a few years of hourly data, the difference of two large entries would lose
+the precision of a small window sum, and a window without any rain wouldn't
+come out as exactly 0.
+"""
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+BLOCK_ROWS = 256
+"""How often the cumulative sum restarts. This doesn't depend on `max_window`
+unless it has to, so that the same series gives the same results whichever
+windows are taken of it."""
+
+
+class RollingSums:
+    """Rolling sums and means of `values`, over windows of up to `max_window`
+    rows.
+    """
+
+    def __init__(self, values: np.ndarray | pd.Series, max_window: int):
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values)
+        n = len(values)
+        block = max(max_window, BLOCK_ROWS)
+        blocks = -(-n // block)
+
+        padded = np.zeros(blocks * block)
+        np.copyto(padded[:n], values, where=valid)
+
+        self.max_window = max_window
+        self._n = n
+        # One row per block, with the sums from the start of the block.
+        self._prefix = np.cumsum(padded.reshape(blocks, block), axis=1)
+        self._counts = np.cumsum(valid, dtype=np.int32)
+
+    def _check_window(self, window: int, min_periods: Optional[int]) -> int:
+        if not 1 <= window <= self.max_window:
+            raise ValueError(f"window must be between 1 and {self.max_window}, not {window}.")
+        if min_periods is None:
+            return window
+        if not 0 <= min_periods <= window:
+            raise ValueError(f"min_periods must be between 0 and {window}, not {min_periods}.")
+        return min_periods
+
+    def count(self, window: int) -> np.ndarray:
+        """Number of valid values in the window ending at each row."""
+        self._check_window(window, None)
+        out = self._counts.copy()
+        out[window:] -= self._counts[:-window]
+        return out
+
+    def _sum(self, window: int) -> np.ndarray:
+        prefix = self._prefix
+        out = np.empty_like(prefix)
+        if not self._n:
+            return out.ravel()
+        # A window starts either in the block that it ends in, or in the block
+        # before it, since the blocks are at least as long as the window.
+        out[:, window:] = prefix[:, window:] - prefix[:, :-window]
+        out[0, :window] = prefix[0, :window]
+        out[1:, :window] = prefix[1:, :window] + (
+            prefix[:-1, -1:] - prefix[:-1, prefix.shape[1] - window :]
+        )
+        return out.ravel()[: self._n]
+
+    def sum(self, window: int, min_periods: Optional[int] = None) -> np.ndarray:
+        """Same as `pd.Series.rolling(window, min_periods).sum()`."""
+        min_periods = self._check_window(window, min_periods)
+        out = self._sum(window)
+        np.putmask(out, self.count(window) < min_periods, np.nan)
+        return out
+
+    def mean(self, window: int, min_periods: Optional[int] = None) -> np.ndarray:
+        """Same as `pd.Series.rolling(window, min_periods).mean()`."""
+        min_periods = self._check_window(window, min_periods)
+        count = self.count(window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = self._sum(window) / count
+        np.putmask(out, count < max(min_periods, 1), np.nan)
+        return out
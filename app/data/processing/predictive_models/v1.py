@@ -12,9 +12,17 @@ https://www.metrics24.de/WebRoot/Store5/Shops/62187045/5D79/1FE4/31E4/0996/0440/
 https://www.mass.gov/files/documents/2016/08/tz/36wqara.pdf
 """
 
-import numpy as np
 import pandas as pd
 
+from app.data.processing.predictive_models import features
+from app.data.processing.predictive_models.features import DaysSince
+from app.data.processing.predictive_models.features import FeatureSpec
+from app.data.processing.predictive_models.features import Hourly
+from app.data.processing.predictive_models.features import Window
+from app.data.processing.predictive_models.features import WindowSum
+from app.data.processing.predictive_models.reaches import Reach
+from app.data.processing.predictive_models.reaches import ReachModels
+
 
 MODEL_YEAR = "2020"
 
@@ -22,8 +30,41 @@ SIGNIFICANT_RAIN = 0.2
 SAFETY_THRESHOLD = 0.65
 
 
-def sigmoid(ser: np.ndarray) -> np.ndarray:
-    return 1 / (1 + np.exp(-ser))
+# Take the mean measurements of everything except rain; rain is the sum
+# within an hour. (HOBOlink devices record all rain seen in 10 minutes).
+FEATURES = FeatureSpec(
+    hourly=(
+        Hourly("pressure", "hobolink", "pressure"),
+        Hourly("par", "hobolink", "par"),
+        Hourly("rain", "hobolink", "rain", agg="sum"),
+        Hourly("rh", "hobolink", "rh"),
+        Hourly("dew_point", "hobolink", "dew_point"),
+        Hourly("wind_speed", "hobolink", "wind_speed"),
+        Hourly("gust_speed", "hobolink", "gust_speed"),
+        Hourly("wind_direction", "hobolink", "wind_direction"),
+        Hourly("temperature", "hobolink", "temperature"),
+        Hourly("stream_flow", "usgs_w", "stream_flow"),
+        Hourly("gage_height", "usgs_w", "gage_height"),
+    ),
+    features=(
+        Window("par_1d_mean", "par", 24, "mean"),
+        Window("stream_flow_1d_mean", "stream_flow", 24, "mean"),
+        Window("rain_0_to_24h_sum", "rain", 24, "sum"),
+        Window("rain_0_to_48h_sum", "rain", 48, "sum"),
+        WindowSum("rain_24_to_48h_sum", "rain", 24, 48),
+        # Lastly, they measure the "time since last significant rain." Significant
+        # rain is defined as a cumulative sum of 0.2 in over a 24 hour time period.
+        DaysSince(
+            "days_since_sig_rain",
+            "rain_0_to_24h_sum",
+            threshold=SIGNIFICANT_RAIN,
+            last="last_sig_rain",
+            flag="sig_rain",
+        ),
+    ),
+    # Drop last row if either Hobolink or USGS is missing.
+    required=("stream_flow", "rain"),
+)
 
 
 def process_data(
@@ -33,232 +74,89 @@ def process_data(
 
     Args:
         df_hobolink: Hobolink data
-        df_usgs: USGS NWIS data
+        df_usgs_w: USGS NWIS Waltham data
+        df_usgs_b: USGS NWIS Brookline data
 
     Returns:
         Cleaned dataframe.
     """
-    df_hobolink = df_hobolink.copy()
-    df_usgs_w = df_usgs_w.copy()
-
-    # Cast to datetime type.
-    # When this comes from Celery, it might be a string.
-    df_hobolink["time"] = pd.to_datetime(df_hobolink["time"])
-    df_usgs_w["time"] = pd.to_datetime(df_usgs_w["time"])
-
-    # Convert all timestamps to hourly in preparation for aggregation.
-    df_usgs_w["time"] = df_usgs_w["time"].dt.floor("h")
-    df_hobolink["time"] = df_hobolink["time"].dt.floor("h")
-
-    # Now collapse the data.
-    # Take the mean measurements of everything except rain; rain is the sum
-    # within an hour. (HOBOlink devices record all rain seen in 10 minutes).
-    df_usgs_w = df_usgs_w.groupby("time").mean().reset_index()
-    df_hobolink = (
-        df_hobolink.groupby("time")
-        .agg(
-            {
-                "pressure": "mean",
-                "par": "mean",
-                "rain": "sum",
-                "rh": "mean",
-                "dew_point": "mean",
-                "wind_speed": "mean",
-                "gust_speed": "mean",
-                "wind_direction": "mean",
-                # 'water_temp': np.mean,
-                "temperature": "mean",
-            }
-        )
-        .reset_index()
+    (df,) = features.process_data(
+        [FEATURES], df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
     )
-
-    # This is an outer join to include all the data (we collect more Hobolink
-    # data than USGS data). With that said, for the most recent value, we need
-    # to make sure one of the sources didn't update before the other one did.
-    # Note that usually Hobolink updates first.
-    df = df_hobolink.merge(right=df_usgs_w, how="left", on="time")
-    df = df.sort_values("time")
-    df = df.reset_index()
-
-    # Drop last row if either Hobolink or USGS is missing.
-    # We drop instead of `ffill()` because we want the model to output
-    # consistently each hour.
-    if df.iloc[-1, :][["stream_flow", "rain"]].isna().any():
-        df = df.drop(df.index[-1])
-
-    # The code from here on consists of feature transformations.
-
-    # Calculate rolling means
-    df["par_1d_mean"] = df["par"].rolling(24).mean()
-    df["stream_flow_1d_mean"] = df["stream_flow"].rolling(24).mean()
-
-    # Calculate rolling sums
-    df["rain_0_to_24h_sum"] = df["rain"].rolling(24).sum()
-    df["rain_0_to_48h_sum"] = df["rain"].rolling(48).sum()
-    df["rain_24_to_48h_sum"] = df["rain_0_to_48h_sum"] - df["rain_0_to_24h_sum"]
-
-    # Lastly, they measure the "time since last significant rain." Significant
-    # rain is defined as a cumulative sum of 0.2 in over a 24 hour time period.
-    df["sig_rain"] = df["rain_0_to_24h_sum"] >= SIGNIFICANT_RAIN
-    df["last_sig_rain"] = df["time"].where(df["sig_rain"]).ffill().fillna(df["time"].min())
-    df["days_since_sig_rain"] = (df["time"] - df["last_sig_rain"]).dt.total_seconds() / 60 / 60 / 24
-
     return df
 
 
-def reach_2_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """Model params:
-    a- rainfall sum 0-24 hrs
-    d- Days since last rain
-    f- PAR avg 24 hr
-
-    Logistic model: 0.3531*a - 0.0362*d - 0.000312*f + 0.6233
-
-    Args:
-        df: Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        0.6233
-        + 0.3531 * df["rain_0_to_24h_sum"]
-        - 0.0362 * df["days_since_sig_rain"]
-        - 0.000312 * df["par_1d_mean"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 2
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_3_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    a- rainfall sum 0-24 hrs
-    b- rainfall sum 24-48 hr
-    d- Days since last rain
-
-    Logistic model: 0.267*a + 0.1681*b - 0.02855*d + 0.5157
-
-    Args:
-        df: (pd.DataFrame) Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        0.5157
-        + 0.267 * df["rain_0_to_24h_sum"]
-        + 0.1681 * df["rain_24_to_48h_sum"]
-        - 0.02855 * df["days_since_sig_rain"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 3
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_4_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    a- rainfall sum 0-24 hrs
-    b- rainfall sum 24-48 hr
-    d- Days since last rain
-    f- PAR avg 24 hr
-    Logistic model: 0.30276*a + 0.1611*b - 0.02267*d - 0.000427*f + 0.5791
-
-    Args:
-        df: (pd.DataFrame) Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        0.5791
-        + 0.30276 * df["rain_0_to_24h_sum"]
-        + 0.1611 * df["rain_24_to_48h_sum"]
-        - 0.02267 * df["days_since_sig_rain"]
-        - 0.000427 * df["par_1d_mean"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 4
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_5_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    c- rainfall sum 0-48 hr
-    d- Days since last rain
-    e- Flow avg 0-24 hr
-    Logistic model: 0.1091*c - 0.01355*d + 0.000342*e + 0.3333
-
-    Args:
-        df: (pd.DataFrame) Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        0.3333
-        + 0.1091 * df["rain_0_to_48h_sum"]
-        - 0.01355 * df["days_since_sig_rain"]
-        + 0.000342 * df["stream_flow_1d_mean"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 5
-
-    return df[["reach_id", "time", "probability", "safe"]]
+REACH_MODELS = ReachModels(
+    # Model params:
+    # a- rainfall sum 0-24 hrs
+    # d- Days since last rain
+    # f- PAR avg 24 hr
+    #
+    # Logistic model: 0.3531*a - 0.0362*d - 0.000312*f + 0.6233
+    Reach(
+        reach_id=2,
+        intercept=0.6233,
+        coefficients={
+            "rain_0_to_24h_sum": 0.3531,
+            "days_since_sig_rain": -0.0362,
+            "par_1d_mean": -0.000312,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # a- rainfall sum 0-24 hrs
+    # b- rainfall sum 24-48 hr
+    # d- Days since last rain
+    #
+    # Logistic model: 0.267*a + 0.1681*b - 0.02855*d + 0.5157
+    Reach(
+        reach_id=3,
+        intercept=0.5157,
+        coefficients={
+            "rain_0_to_24h_sum": 0.267,
+            "rain_24_to_48h_sum": 0.1681,
+            "days_since_sig_rain": -0.02855,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # a- rainfall sum 0-24 hrs
+    # b- rainfall sum 24-48 hr
+    # d- Days since last rain
+    # f- PAR avg 24 hr
+    # Logistic model: 0.30276*a + 0.1611*b - 0.02267*d - 0.000427*f + 0.5791
+    Reach(
+        reach_id=4,
+        intercept=0.5791,
+        coefficients={
+            "rain_0_to_24h_sum": 0.30276,
+            "rain_24_to_48h_sum": 0.1611,
+            "days_since_sig_rain": -0.02267,
+            "par_1d_mean": -0.000427,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # c- rainfall sum 0-48 hr
+    # d- Days since last rain
+    # e- Flow avg 0-24 hr
+    # Logistic model: 0.1091*c - 0.01355*d + 0.000342*e + 0.3333
+    Reach(
+        reach_id=5,
+        intercept=0.3333,
+        coefficients={
+            "rain_0_to_48h_sum": 0.1091,
+            "days_since_sig_rain": -0.01355,
+            "stream_flow_1d_mean": 0.000342,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+)
 
 
 def all_models(df: pd.DataFrame, *args, **kwargs):
     # Cast to datetime type.
     # When this comes from Celery, it might be a string.
     df["time"] = pd.to_datetime(df["time"])
-
-    out = pd.concat(
-        [
-            reach_2_model(df, *args, **kwargs),
-            reach_3_model(df, *args, **kwargs),
-            reach_4_model(df, *args, **kwargs),
-            reach_5_model(df, *args, **kwargs),
-        ],
-        axis=0,
-    )
-    out = out.sort_values(["reach_id", "time"])
-
-    # TODO:
-    #  I'm a little worried that I had to add the below to make a test pass.
-    #  I thought this part of the code was pretty settled by now, but guess
-    #  not. I need to look into what's going on.
-
-    out = out.loc[out["probability"].notna(), :]
-    return out
+    return REACH_MODELS.predict(df, *args, **kwargs)
@@ -1,7 +1,14 @@
 # flake8: noqa: E501
-import numpy as np
 import pandas as pd
 
+from app.data.processing.predictive_models import features
+from app.data.processing.predictive_models.features import DaysSince
+from app.data.processing.predictive_models.features import FeatureSpec
+from app.data.processing.predictive_models.features import Hourly
+from app.data.processing.predictive_models.features import Window
+from app.data.processing.predictive_models.reaches import Reach
+from app.data.processing.predictive_models.reaches import ReachModels
+
 
 MODEL_YEAR = "2024"
 
@@ -9,8 +16,39 @@ SIGNIFICANT_RAIN = 0.1
 SAFETY_THRESHOLD = 0.65
 
 
-def sigmoid(ser: np.ndarray) -> np.ndarray:
-    return 1 / (1 + np.exp(-ser))
+# Take the mean measurements of everything except rain; rain is the sum
+# within an hour. (HOBOlink devices record all rain seen in 10 minutes).
+FEATURES = FeatureSpec(
+    hourly=(
+        Hourly("pressure", "hobolink", "pressure"),
+        Hourly("par", "hobolink", "par"),
+        Hourly("rain", "hobolink", "rain", agg="sum"),
+        Hourly("rh", "hobolink", "rh"),
+        Hourly("dew_point", "hobolink", "dew_point"),
+        Hourly("wind_speed", "hobolink", "wind_speed"),
+        Hourly("gust_speed", "hobolink", "gust_speed"),
+        Hourly("wind_direction", "hobolink", "wind_direction"),
+        Hourly("temperature", "hobolink", "temperature"),
+        Hourly("stream_flow", "usgs_w", "stream_flow"),
+        Hourly("gage_height", "usgs_w", "gage_height"),
+    ),
+    features=(
+        Window("stream_flow_1d_mean", "stream_flow", 24, "mean"),
+        Window("pressure_2d_mean", "pressure", 48, "mean"),
+        Window("rain_0_to_12h_sum", "rain", 12, "sum"),
+        # Lastly, they measure the "time since last significant rain." Significant
+        # rain is defined as a cumulative sum of 0.1 in a 12-hour time period.
+        DaysSince(
+            "days_since_sig_rain",
+            "rain_0_to_12h_sum",
+            threshold=SIGNIFICANT_RAIN,
+            last="last_sig_rain",
+            flag="sig_rain",
+        ),
+    ),
+    # Drop last row if either Hobolink or USGS is missing.
+    required=("stream_flow", "rain"),
+)
 
 
 def process_data(
@@ -20,238 +58,96 @@ def process_data(
 
     Args:
         df_hobolink: Hobolink data
-        df_usgs: USGS NWIS data
+        df_usgs_w: USGS NWIS Waltham data
+        df_usgs_b: USGS NWIS Brookline data
 
     Returns:
         Cleaned dataframe.
     """
-    df_hobolink = df_hobolink.copy()
-    df_usgs_w = df_usgs_w.copy()
-
-    # Cast to datetime type.
-    # When this comes from Celery, it might be a string.
-    df_hobolink["time"] = pd.to_datetime(df_hobolink["time"])
-    df_usgs_w["time"] = pd.to_datetime(df_usgs_w["time"])
-
-    # Convert all timestamps to hourly in preparation for aggregation.
-    df_usgs_w["time"] = df_usgs_w["time"].dt.floor("h")
-    df_hobolink["time"] = df_hobolink["time"].dt.floor("h")
-
-    # Now collapse the data.
-    # Take the mean measurements of everything except rain; rain is the sum
-    # within an hour. (HOBOlink devices record all rain seen in 10 minutes).
-    df_usgs_w = df_usgs_w.groupby("time").mean().reset_index()
-    df_hobolink = (
-        df_hobolink.groupby("time")
-        .agg(
-            {
-                "pressure": "mean",
-                "par": "mean",
-                "rain": "sum",
-                "rh": "mean",
-                "dew_point": "mean",
-                "wind_speed": "mean",
-                "gust_speed": "mean",
-                "wind_direction": "mean",
-                # 'water_temp': np.mean,
-                "temperature": "mean",
-            }
-        )
-        .reset_index()
+    (df,) = features.process_data(
+        [FEATURES], df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b
     )
-
-    # This is an outer join to include all the data (we collect more Hobolink
-    # data than USGS data). With that said, for the most recent value, we need
-    # to make sure one of the sources didn't update before the other one did.
-    # Note that usually Hobolink updates first.
-    df = df_hobolink.merge(right=df_usgs_w, how="left", on="time")
-    df = df.sort_values("time")
-    df = df.reset_index()
-
-    # Drop last row if either Hobolink or USGS is missing.
-    # We drop instead of `ffill()` because we want the model to output
-    # consistently each hour.
-    if df.iloc[-1, :][["stream_flow", "rain"]].isna().any():
-        df = df.drop(df.index[-1])
-
-    # The code from here on consists of feature transformations.
-
-    # Calculate rolling means
-    df["stream_flow_1d_mean"] = df["stream_flow"].rolling(24).mean()
-    df["pressure_2d_mean"] = df["pressure"].rolling(48).mean()
-
-    # Calculate rolling sums
-    df["rain_0_to_12h_sum"] = df["rain"].rolling(12).sum()
-
-    # Lastly, they measure the "time since last significant rain." Significant
-    # rain is defined as a cumulative sum of 0.1 in a 12-hour time period.
-    df["sig_rain"] = df["rain_0_to_12h_sum"] >= SIGNIFICANT_RAIN
-    df["last_sig_rain"] = df["time"].where(df["sig_rain"]).ffill().fillna(df["time"].min())
-    df["days_since_sig_rain"] = (df["time"] - df["last_sig_rain"]).dt.total_seconds() / 60 / 60 / 24
-
     return df
 
 
-def reach_2_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    1NBS:
-    𝑎 = 1.444 ∗ 10^2
-    𝑤 = −1.586 ∗ 10^−4
-    𝑥 = 4.785
-    𝑦 = −6.973
-    𝑧 = 1.137
-
-    Args:
-        df: Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        14.44
-        - 0.0001586 * df["stream_flow_1d_mean"]
-        + 4.785 * df["pressure_2d_mean"]
-        - 6.973 * df["rain_0_to_12h_sum"]
-        + 1.137 * df["days_since_sig_rain"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 2
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_3_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    2LARZ:
-    𝑎 = −19.119085
-    𝑤 = −0.001841
-    𝑥 = 0.658676
-    𝑦 = −2.766888
-    𝑧 = 0.642593
-
-    Args:
-        df: Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        -19.119085
-        - 0.001841 * df["stream_flow_1d_mean"]
-        + 0.658676 * df["pressure_2d_mean"]
-        - 2.766888 * df["rain_0_to_12h_sum"]
-        + 0.642593 * df["days_since_sig_rain"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 3
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_4_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    3BU:
-    𝑎 = −23.96789
-    𝑤 = 0.00248
-    𝑥 = 0.83702
-    𝑦 = −5.34479
-    𝑧 = −0.02940
-
-    Args:
-        df: (pd.DataFrame) Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        -23.96789
-        + 0.00248 * df["stream_flow_1d_mean"]
-        + 0.83702 * df["pressure_2d_mean"]
-        - 5.34479 * df["rain_0_to_12h_sum"]
-        - 0.02940 * df["days_since_sig_rain"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 4
-
-    return df[["reach_id", "time", "probability", "safe"]]
-
-
-def reach_5_model(df: pd.DataFrame, rows: int = None) -> pd.DataFrame:
-    """
-    4LONG:
-    𝑎 = −395.24225
-    𝑤 = −0.03635
-    𝑥 = 13.67660
-    𝑦 = −19.65122
-    𝑧 = 11.64241
-
-    Args:
-        df: (pd.DataFrame) Input data from `process_data()`
-        rows: (int) Number of rows to return.
-
-    Returns:
-        Outputs for model as a dataframe.
-    """
-    if rows is None:
-        df = df.copy()
-    else:
-        df = df.tail(n=rows).copy()
-
-    df["probability"] = sigmoid(
-        -395.24225
-        - 0.03635 * df["stream_flow_1d_mean"]
-        + 13.67660 * df["pressure_2d_mean"]
-        - 19.65122 * df["rain_0_to_12h_sum"]
-        + 11.64241 * df["days_since_sig_rain"]
-    )
-
-    df["safe"] = df["probability"] <= SAFETY_THRESHOLD
-    df["reach_id"] = 5
-
-    return df[["reach_id", "time", "probability", "safe"]]
+REACH_MODELS = ReachModels(
+    # 1NBS:
+    # 𝑎 = 1.444 ∗ 10^2
+    # 𝑤 = −1.586 ∗ 10^−4
+    # 𝑥 = 4.785
+    # 𝑦 = −6.973
+    # 𝑧 = 1.137
+    Reach(
+        reach_id=2,
+        intercept=14.44,
+        coefficients={
+            "stream_flow_1d_mean": -0.0001586,
+            "pressure_2d_mean": 4.785,
+            "rain_0_to_12h_sum": -6.973,
+            "days_since_sig_rain": 1.137,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # 2LARZ:
+    # 𝑎 = −19.119085
+    # 𝑤 = −0.001841
+    # 𝑥 = 0.658676
+    # 𝑦 = −2.766888
+    # 𝑧 = 0.642593
+    Reach(
+        reach_id=3,
+        intercept=-19.119085,
+        coefficients={
+            "stream_flow_1d_mean": -0.001841,
+            "pressure_2d_mean": 0.658676,
+            "rain_0_to_12h_sum": -2.766888,
+            "days_since_sig_rain": 0.642593,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # 3BU:
+    # 𝑎 = −23.96789
+    # 𝑤 = 0.00248
+    # 𝑥 = 0.83702
+    # 𝑦 = −5.34479
+    # 𝑧 = −0.02940
+    Reach(
+        reach_id=4,
+        intercept=-23.96789,
+        coefficients={
+            "stream_flow_1d_mean": 0.00248,
+            "pressure_2d_mean": 0.83702,
+            "rain_0_to_12h_sum": -5.34479,
+            "days_since_sig_rain": -0.02940,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+    # 4LONG:
+    # 𝑎 = −395.24225
+    # 𝑤 = −0.03635
+    # 𝑥 = 13.67660
+    # 𝑦 = −19.65122
+    # 𝑧 = 11.64241
+    Reach(
+        reach_id=5,
+        intercept=-395.24225,
+        coefficients={
+            "stream_flow_1d_mean": -0.03635,
+            "pressure_2d_mean": 13.67660,
+            "rain_0_to_12h_sum": -19.65122,
+            "days_since_sig_rain": 11.64241,
+        },
+        link="logistic",
+        threshold=SAFETY_THRESHOLD,
+    ),
+)
 
 
 def all_models(df: pd.DataFrame, *args, **kwargs):
     # Cast to datetime type.
     # When this comes from Celery, it might be a string.
     df["time"] = pd.to_datetime(df["time"])
-
-    out = pd.concat(
-        [
-            reach_2_model(df, *args, **kwargs),
-            reach_3_model(df, *args, **kwargs),
-            reach_4_model(df, *args, **kwargs),
-            reach_5_model(df, *args, **kwargs),
-        ],
-        axis=0,
-    )
-    out = out.sort_values(["reach_id", "time"])
-
-    # TODO:
-    #  I'm a little worried that I had to add the below to make a test pass.
-    #  I thought this part of the code was pretty settled by now, but guess
-    #  not. I need to look into what's going on.
-
-    out = out.loc[out["probability"].notna(), :]
-    return out
+    return REACH_MODELS.predict(df, *args, **kwargs)
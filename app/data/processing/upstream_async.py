@@ -0,0 +1,489 @@
+"""
+asyncio versions of the HOBOlink and USGS fetchers.
+
+These make the same requests and return the same DataFrames as
+`get_live_hobolink_data` and `get_live_usgs_data_for_sites`, but every request
+is made from one event loop over a shared `httpx.AsyncClient` instead of from
+a thread per request. The client has one limit on the number of open
+connections, shared by all sources.
+
+Requests are run inside an `asyncio.TaskGroup`, so if one of them fails the
+others are cancelled, and cancelling the caller cancels all of them.
+
+Example:
+
+    async with AsyncUpstreamClient.from_config() as client:
+        df_usgs, df_hobolink = await get_live_data_async(client=client)
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Iterable
+from typing import Sequence
+from urllib.parse import urljoin
+
+import httpx
+import pandas as pd
+from flask import abort
+from flask import current_app
+from tenacity import retry
+from tenacity import stop_after_attempt
+from tenacity import wait_exponential
+
+from app.data.processing import hobolink
+from app.data.processing import usgs
+from app.data.processing.hobolink import HobolinkReadings
+from app.data.processing.hobolink import get_live_hobolink_data
+from app.data.processing.hobolink import iter_json_array
+from app.data.processing.hobolink import parse_hobolink_data
+from app.data.processing.upstream_cache import UpstreamCache
+from app.data.processing.upstream_cache import get_upstream_cache
+from app.data.processing.upstream_cache import is_closed_window
+from app.data.processing.upstream_client import UPSTREAM_CONNECT_TIMEOUT
+from app.data.processing.upstream_client import UPSTREAM_MAX_RETRY_AFTER
+from app.data.processing.upstream_client import UPSTREAM_RETRY_STATUS_CODES
+from app.data.processing.upstream_client import get_source_metrics
+from app.data.processing.usgs import USGS_DEFAULT_DAYS_AGO
+from app.data.processing.usgs import USGS_SITES
+from app.data.processing.usgs import get_live_usgs_data_for_sites
+from app.data.processing.usgs import parse_usgs_data_for_sites
+
+
+class AsyncUpstreamClient:
+    """Shared `httpx.AsyncClient` for all of the upstream APIs.
+
+    Args:
+        max_connections: (int) Max number of connections open at once, across
+                         all sources.
+        timeouts: (dict[str, float]) Read timeout in seconds for each source.
+        max_retries: (int) Number of times to retry responses with a status
+                     code in `UPSTREAM_RETRY_STATUS_CODES`.
+        transport: (httpx.AsyncBaseTransport) Transport to send the requests
+                   with. Only useful for testing.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        timeouts: dict[str, float],
+        max_retries: int,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self.timeouts = timeouts
+        self.max_retries = max_retries
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections, max_keepalive_connections=max_connections
+            ),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_config(cls) -> "AsyncUpstreamClient":
+        config = current_app.config
+        return cls(
+            max_connections=config["UPSTREAM_ASYNC_MAX_CONNECTIONS"],
+            timeouts={
+                "hobolink": config["HOBOLINK_TIMEOUT_SECONDS"],
+                "usgs": config["USGS_TIMEOUT_SECONDS"],
+            },
+            max_retries=config["UPSTREAM_MAX_RETRIES"],
+        )
+
+    async def __aenter__(self) -> "AsyncUpstreamClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def get(
+        self,
+        source: str,
+        url: str,
+        params: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> bytes:
+        """Make a GET request and return the response body. Responses with a
+        status code that is worth retrying are retried with backoff, waiting
+        as long as the `Retry-After` header says to if there is one.
+        """
+        metrics = get_source_metrics(source)
+        timeout = httpx.Timeout(self.timeouts[source], connect=UPSTREAM_CONNECT_TIMEOUT)
+
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            res = None
+            try:
+                res = await self.client.get(url, params=params, headers=headers, timeout=timeout)
+            finally:
+                metrics.record(
+                    latency=time.perf_counter() - start,
+                    nbytes=res.num_bytes_downloaded if res is not None else 0,
+                    status_code=res.status_code if res is not None else None,
+                )
+            if res.status_code not in UPSTREAM_RETRY_STATUS_CODES or attempt == self.max_retries:
+                break
+            await asyncio.sleep(_get_retry_after(res, attempt))
+
+        if res.status_code >= 400:
+            abort(
+                500,
+                f"API request to the {source} endpoint failed with status code"
+                f" {res.status_code}: {res.text}",
+            )
+        return res.content
+
+
+def _get_retry_after(res: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying, from the `Retry-After` header if it is
+    there, and otherwise from exponential backoff.
+    """
+    value = res.headers.get("Retry-After")
+    seconds = 0.5 * 2**attempt
+    if value is not None:
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds()
+            except (TypeError, ValueError):
+                pass
+    return min(max(seconds, 0), UPSTREAM_MAX_RETRY_AFTER)
+
+
+@asynccontextmanager
+async def _task_group() -> AsyncIterator[asyncio.TaskGroup]:
+    """`asyncio.TaskGroup` that raises the first error on its own instead of in
+    an `ExceptionGroup`, so callers see the same errors as with the blocking
+    fetchers. The other tasks are still cancelled.
+    """
+    try:
+        async with asyncio.TaskGroup() as tg:
+            yield tg
+    except ExceptionGroup as e:
+        error = e
+        while isinstance(error, ExceptionGroup):
+            error = error.exceptions[0]
+        raise error from e
+
+
+@asynccontextmanager
+async def _get_client(client: AsyncUpstreamClient | None) -> AsyncIterator[AsyncUpstreamClient]:
+    """Use the client that was passed in, or make one just for this call."""
+    if client is not None:
+        yield client
+        return
+    async with AsyncUpstreamClient.from_config() as client:
+        yield client
+
+
+async def _get_body(
+    cache: UpstreamCache | None,
+    source: str,
+    key: str,
+    start: datetime,
+    end: datetime,
+    fetch: Callable[[], Awaitable[bytes]],
+) -> Iterable[bytes]:
+    """Async version of `iter_response_body`. The cache is on disk, so it is
+    read and written in a thread to keep the event loop free.
+    """
+    if cache is None or not is_closed_window(end):
+        return [await fetch()]
+
+    cached = await asyncio.to_thread(_read_cached_body, cache, source, key, start, end)
+    if cached is not None:
+        return cached
+
+    body = await fetch()
+    await asyncio.to_thread(_write_cached_body, cache, source, key, start, end, body)
+    return [body]
+
+
+def _read_cached_body(
+    cache: UpstreamCache, source: str, key: str, start: datetime, end: datetime
+) -> list[bytes] | None:
+    cached = cache.read(source, key, start, end)
+    # Read it all here, since the chunks are read from the file lazily.
+    return None if cached is None else list(cached)
+
+
+def _write_cached_body(
+    cache: UpstreamCache, source: str, key: str, start: datetime, end: datetime, body: bytes
+) -> None:
+    with cache.write(source, key, start, end) as write:
+        write(body)
+
+
+async def get_live_hobolink_data_async(
+    start_date: datetime | None = None,
+    end_date: datetime | None = None,
+    days_ago: int = 30,
+    loggers: str | None = None,
+    exclude_sensors: list[str] | None = None,
+    client: AsyncUpstreamClient | None = None,
+) -> pd.DataFrame:
+    """asyncio version of `get_live_hobolink_data`. Windows are picked the same
+    way as in `request_to_hobolink`, and all of them are requested at once.
+    """
+    if current_app.config["USE_MOCK_DATA"]:
+        return get_live_hobolink_data(
+            start_date=start_date, end_date=end_date, days_ago=days_ago, loggers=loggers
+        )
+
+    if end_date is None:
+        end_date = datetime.now(tz=UTC)
+    if start_date is None:
+        start_date = end_date - timedelta(days=days_ago)
+    if loggers is None:
+        loggers = current_app.config["HOBOLINK_LOGGERS"]
+    headers = hobolink._get_request_headers(current_app.config["HOBOLINK_BEARER_TOKEN"])
+    cache = get_upstream_cache()
+
+    window_size = hobolink._choose_window_size(loggers, end_date - start_date)
+    windows = hobolink._get_request_windows(start_date, end_date, pagination_delta=window_size)
+
+    async with _get_client(client) as client, _task_group() as tg:
+        tasks = {
+            window: tg.create_task(
+                _request_hobolink_window_splitting(
+                    client, headers, *window, window_size, loggers, cache
+                )
+            )
+            for window in windows
+        }
+    results = {window: task.result() for window, task in tasks.items()}
+    hobolink._record_readings_per_second(loggers, results, window_size)
+
+    data = HobolinkReadings()
+    for window in windows:
+        data.merge(results[window])
+
+    df = parse_hobolink_data(data, exclude_sensors=exclude_sensors)
+    df = df.loc[df["time"] >= start_date].reset_index(drop=True)
+    return df
+
+
+async def _request_hobolink_window_splitting(
+    client: AsyncUpstreamClient,
+    headers: dict[str, str],
+    start_date: datetime,
+    end_date: datetime,
+    window_size: timedelta,
+    loggers: str,
+    cache: UpstreamCache | None,
+) -> HobolinkReadings:
+    """asyncio version of `hobolink._request_window_splitting`. The halves
+    of a window that was cut off are requested at the same time.
+    """
+    readings = await _request_hobolink_window(client, headers, start_date, end_date, loggers, cache)
+    if len(readings) < hobolink.HOBOLINK_MAX_RESULTS:
+        return readings
+
+    if cache is not None:
+        cache.discard("hobolink", loggers or "", start_date, end_date)
+
+    half = window_size / 2
+    if half < hobolink.HOBOLINK_WINDOW_SIZES[0]:
+        abort(
+            500,
+            f"HOBOlink returned the max of {hobolink.HOBOLINK_MAX_RESULTS} results for"
+            f" {start_date} to {end_date}, and the window is too small to split any further.",
+        )
+
+    windows = hobolink._get_request_windows(start_date, end_date, pagination_delta=half)
+    async with _task_group() as tg:
+        tasks = [
+            tg.create_task(
+                _request_hobolink_window_splitting(client, headers, *window, half, loggers, cache)
+            )
+            for window in windows
+        ]
+    readings = HobolinkReadings()
+    for task in tasks:
+        readings.merge(task.result())
+    return readings
+
+
+@retry(reraise=True, wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(3))
+async def _request_hobolink_window(
+    client: AsyncUpstreamClient,
+    headers: dict[str, str],
+    start_date: datetime,
+    end_date: datetime,
+    loggers: str,
+    cache: UpstreamCache | None,
+) -> HobolinkReadings:
+    body = await _get_body(
+        cache,
+        "hobolink",
+        loggers or "",
+        start_date,
+        end_date,
+        lambda: client.get(
+            "hobolink",
+            urljoin(hobolink.BASE_URL, "/v1/data"),
+            params=hobolink._get_request_params(start_date, end_date, loggers),
+            headers=headers,
+        ),
+    )
+    readings = HobolinkReadings()
+    readings.extend(iter_json_array(body, key="data"))
+    return readings
+
+
+async def get_live_usgs_data_for_sites_async(
+    days_ago: int = USGS_DEFAULT_DAYS_AGO,
+    site_nos: Sequence[str] = tuple(USGS_SITES),
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+    client: AsyncUpstreamClient | None = None,
+) -> dict[str, pd.DataFrame]:
+    """asyncio version of `get_live_usgs_data_for_sites`. When the upstream
+    cache is on, all of the windows are requested at once.
+    """
+    if current_app.config["USE_MOCK_DATA"]:
+        return get_live_usgs_data_for_sites(
+            days_ago=days_ago, site_nos=site_nos, start_time=start_time, end_time=end_time
+        )
+
+    cache = get_upstream_cache()
+    async with _get_client(client) as client:
+        if cache is None:
+            body = await _request_usgs(
+                client, days_ago, site_nos, begin_date=start_time, end_date=end_time
+            )
+            return parse_usgs_data_for_sites(body.decode("utf-8"), site_nos=site_nos)
+
+        if start_time is not None:
+            return await _get_usgs_data_in_range(client, cache, start_time, end_time, site_nos)
+
+        start = datetime.now(UTC) - timedelta(days=days_ago)
+        async with _task_group() as tg:
+            tasks = [
+                tg.create_task(
+                    _get_body(
+                        cache,
+                        "usgs",
+                        ",".join(site_nos),
+                        *usgs._get_window_bounds(begin_date, end_date),
+                        lambda begin_date=begin_date, end_date=end_date: _request_usgs(
+                            client, days_ago, site_nos, begin_date=begin_date, end_date=end_date
+                        ),
+                    )
+                )
+                for begin_date, end_date in usgs._get_request_windows_since(start)
+            ]
+
+    results = [
+        parse_usgs_data_for_sites(b"".join(task.result()).decode("utf-8"), site_nos=site_nos)
+        for task in tasks
+    ]
+    return usgs._combine_windows(results, site_nos=site_nos, start=start)
+
+
+async def _get_usgs_data_in_range(
+    client: AsyncUpstreamClient,
+    cache: UpstreamCache,
+    start: datetime,
+    end: datetime | None,
+    site_nos: Sequence[str],
+) -> dict[str, pd.DataFrame]:
+    """asyncio version of `usgs._get_usgs_data_in_range`."""
+    if end is None:
+        end = datetime.now(UTC)
+    windows, rest_start = usgs._get_closed_windows_in_range(start, end)
+    async with _task_group() as tg:
+        tasks = [
+            tg.create_task(
+                _get_body(
+                    cache,
+                    "usgs",
+                    ",".join(site_nos),
+                    *usgs._get_window_bounds(begin_date, end_date),
+                    lambda begin_date=begin_date, end_date=end_date: _request_usgs(
+                        client,
+                        USGS_DEFAULT_DAYS_AGO,
+                        site_nos,
+                        begin_date=begin_date,
+                        end_date=end_date,
+                    ),
+                )
+            )
+            for begin_date, end_date in windows
+        ]
+        if rest_start < end or not windows:
+            # The rest of the range isn't cached.
+            tasks.append(
+                tg.create_task(
+                    _get_body(
+                        None,
+                        "usgs",
+                        ",".join(site_nos),
+                        rest_start,
+                        end,
+                        lambda: _request_usgs(
+                            client,
+                            USGS_DEFAULT_DAYS_AGO,
+                            site_nos,
+                            begin_date=rest_start,
+                            end_date=end,
+                        ),
+                    )
+                )
+            )
+
+    results = [
+        parse_usgs_data_for_sites(b"".join(task.result()).decode("utf-8"), site_nos=site_nos)
+        for task in tasks
+    ]
+    return usgs._combine_windows(results, site_nos=site_nos, start=start, end=end)
+
+
+@retry(reraise=True, wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(3))
+async def _request_usgs(
+    client: AsyncUpstreamClient, days_ago: int, site_nos: Sequence[str], **kwargs
+) -> bytes:
+    params = usgs._get_request_params(days_ago=days_ago, site_no=site_nos, **kwargs)
+    return await client.get("usgs", usgs.USGS_URL, params=params)
+
+
+async def get_live_usgs_data_async(
+    days_ago: int = USGS_DEFAULT_DAYS_AGO,
+    site_no: str = "01104500",
+    client: AsyncUpstreamClient | None = None,
+) -> pd.DataFrame:
+    """asyncio version of `get_live_usgs_data`."""
+    data = await get_live_usgs_data_for_sites_async(
+        days_ago=days_ago, site_nos=[site_no], client=client
+    )
+    return data[site_no]
+
+
+async def get_live_data_async(
+    days_ago: int = USGS_DEFAULT_DAYS_AGO, client: AsyncUpstreamClient | None = None
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame]:
+    """Get the USGS data for both sites and the HOBOlink data at the same time.
+
+    Returns:
+        Tuple of the USGS data by site number, and the HOBOlink data.
+    """
+    async with _get_client(client) as client, _task_group() as tg:
+        usgs_task = tg.create_task(
+            get_live_usgs_data_for_sites_async(days_ago=days_ago, client=client)
+        )
+        hobolink_task = tg.create_task(
+            get_live_hobolink_data_async(days_ago=days_ago, client=client)
+        )
+    return usgs_task.result(), hobolink_task.result()
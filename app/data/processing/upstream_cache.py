@@ -0,0 +1,261 @@
+"""
+On-disk cache for raw responses from the upstream APIs (HOBOlink and USGS).
+
+Only windows of data that are fully in the past are cached, since those don't
+change anymore. Response bodies are gzipped and stored under the SHA-256 hash of
+their contents, and each (source, key, window) entry points to one of those
+files. When the cache gets bigger than `UPSTREAM_CACHE_MAX_BYTES`, the least
+recently used bodies are deleted first.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from contextlib import AbstractContextManager
+from contextlib import contextmanager
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+from flask import current_app
+
+
+CHUNK_SIZE = 64 * 1024
+
+UPSTREAM_CACHE_SETTLE_DELAY = timedelta(days=1)
+"""How long after the end of a window we wait before treating it as closed.
+Upstream data sometimes shows up late, so we give it some slack.
+"""
+
+
+class UpstreamCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(directory, "objects")
+        self.keys_dir = os.path.join(directory, "keys")
+
+    def _key_path(self, source: str, key: str, start: datetime, end: datetime) -> str:
+        name = f"{source}|{key}|{start.isoformat()}|{end.isoformat()}"
+        return os.path.join(self.keys_dir, hashlib.sha256(name.encode()).hexdigest() + ".json")
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest + ".gz")
+
+    def read(self, source: str, key: str, start: datetime, end: datetime) -> Iterator[bytes] | None:
+        """Returns the cached response body in chunks, or None if there is no
+        cached response for this window.
+        """
+        try:
+            with open(self._key_path(source, key, start, end)) as f:
+                digest = json.load(f)["digest"]
+            path = self._object_path(digest)
+            # Opening the file now means it can still be read if it is evicted
+            # while we are reading it.
+            f = gzip.open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+        # Mark as recently used. Another worker may have evicted it since we
+        # opened it, in which case it is treated as a miss.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            f.close()
+            return None
+
+        def _iter_chunks() -> Iterator[bytes]:
+            with f:
+                while chunk := f.read(CHUNK_SIZE):
+                    yield chunk
+
+        return _iter_chunks()
+
+    @contextmanager
+    def write(
+        self, source: str, key: str, start: datetime, end: datetime
+    ) -> Iterator[Callable[[bytes], None]]:
+        """Context manager that yields a function for writing the response body
+        chunk by chunk. The entry is only saved if the block exits without an
+        error.
+        """
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.keys_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+
+                def _write(chunk: bytes) -> None:
+                    digest.update(chunk)
+                    f.write(chunk)
+
+                yield _write
+
+            os.replace(tmp_path, self._object_path(digest.hexdigest()))
+            _write_json_atomic(
+                self._key_path(source, key, start, end),
+                {
+                    "digest": digest.hexdigest(),
+                    "source": source,
+                    "key": key,
+                    "start": start.isoformat(),
+                    "end": end.isoformat(),
+                },
+            )
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.prune()
+
+    def discard(self, source: str, key: str, start: datetime, end: datetime) -> None:
+        """Forget the cached response for a window. The body itself is left for
+        `prune` to clean up, since other entries may point to it.
+        """
+        try:
+            os.remove(self._key_path(source, key, start, end))
+        except FileNotFoundError:
+            pass
+
+    def entries(self) -> list[dict[str, Any]]:
+        """All cache entries, along with the size of their cached body."""
+        out = []
+        for name in _listdir(self.keys_dir):
+            try:
+                with open(os.path.join(self.keys_dir, name)) as f:
+                    entry = json.load(f)
+                entry["bytes"] = os.path.getsize(self._object_path(entry["digest"]))
+            except (FileNotFoundError, ValueError):
+                continue
+            out.append(entry)
+        return sorted(out, key=lambda i: (i["source"], i["key"], i["start"]))
+
+    def size(self) -> int:
+        return sum(
+            os.path.getsize(os.path.join(self.objects_dir, i))
+            for i in _listdir(self.objects_dir)
+            if i.endswith(".gz")
+        )
+
+    def prune(self, max_bytes: int | None = None) -> int:
+        """Delete the least recently used response bodies until the cache is
+        no larger than `max_bytes`.
+
+        Returns:
+            Number of response bodies that were deleted.
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        objects = []
+        for name in _listdir(self.objects_dir):
+            if name.endswith(".gz"):
+                # Another worker may be pruning at the same time.
+                try:
+                    stat = os.stat(os.path.join(self.objects_dir, name))
+                except FileNotFoundError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, name))
+        objects.sort()
+
+        total = sum(size for _, size, _ in objects)
+        removed = 0
+        for _, size, name in objects:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.objects_dir, name))
+            except FileNotFoundError:
+                pass
+            else:
+                removed += 1
+            total -= size
+
+        if removed:
+            # Drop the entries that point to bodies that no longer exist.
+            for name in _listdir(self.keys_dir):
+                path = os.path.join(self.keys_dir, name)
+                try:
+                    with open(path) as f:
+                        digest = json.load(f)["digest"]
+                except (FileNotFoundError, ValueError):
+                    continue
+                if not os.path.exists(self._object_path(digest)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+        return removed
+
+
+def _listdir(path: str) -> list[str]:
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def _write_json_atomic(path: str, obj: dict[str, Any]) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def get_upstream_cache() -> UpstreamCache | None:
+    """Returns the upstream cache, or None if it is turned off."""
+    directory = current_app.config["UPSTREAM_CACHE_DIR"]
+    if not directory:
+        return None
+    return UpstreamCache(directory, max_bytes=current_app.config["UPSTREAM_CACHE_MAX_BYTES"])
+
+
+def is_closed_window(end: datetime) -> bool:
+    return end < datetime.now(UTC) - UPSTREAM_CACHE_SETTLE_DELAY
+
+
+def iter_response_body(
+    cache: UpstreamCache | None,
+    source: str,
+    key: str,
+    start: datetime,
+    end: datetime,
+    fetch: Callable[[], AbstractContextManager[Iterable[bytes]]],
+) -> Iterator[bytes]:
+    """Yields the body of the response for a window of data, reading it from
+    the cache if possible. Closed windows that aren't cached yet are saved to
+    the cache as they are read.
+
+    The body must be read all the way through for it to be saved.
+
+    Args:
+        cache: The upstream cache, or None if it is turned off.
+        source: (str) Name of the upstream API.
+        key: (str) Which logger or site the data is for.
+        start: (datetime) Start of the window.
+        end: (datetime) End of the window.
+        fetch: Function that makes the request and returns a context manager
+               of the response body in chunks.
+    """
+    if cache is None or not is_closed_window(end):
+        with fetch() as chunks:
+            yield from chunks
+        return
+
+    cached = cache.read(source, key, start, end)
+    if cached is not None:
+        yield from cached
+        return
+
+    with fetch() as chunks, cache.write(source, key, start, end) as write:
+        for chunk in chunks:
+            write(chunk)
+            yield chunk
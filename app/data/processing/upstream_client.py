@@ -0,0 +1,204 @@
+"""
+Shared HTTP client for the upstream APIs (HOBOlink and USGS).
+
+Each source gets one long-lived `requests.Session` with a pool of keep-alive
+connections, so repeated requests don't have to set up a new TCP and TLS
+connection every time. Requests have a per-source timeout, and responses with
+a status code that is worth retrying (429 and 5xx) are retried with backoff,
+waiting for as long as the `Retry-After` header says to if there is one.
+
+Every request also records its latency, size and status code, per source. See
+`get_upstream_metrics`.
+"""
+
+import threading
+import time
+from collections import Counter
+from collections import deque
+from contextlib import contextmanager
+from typing import Any
+from typing import Iterator
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+UPSTREAM_CONNECT_TIMEOUT = 10
+UPSTREAM_MAX_RETRY_AFTER = 120
+"""Longest we'll wait when an API tells us to come back later. Anything
+longer than this would hold up the hourly update too much.
+"""
+UPSTREAM_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+UPSTREAM_LATENCY_SAMPLES = 1000
+
+
+class _Retry(Retry):
+    """urllib3 retry policy that caps how long `Retry-After` can make us wait."""
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, UPSTREAM_MAX_RETRY_AFTER)
+
+
+class UpstreamMetrics:
+    """Request counts, latencies, bytes and status codes for one source."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.status_codes: Counter[int] = Counter()
+        self.latencies: deque[float] = deque(maxlen=UPSTREAM_LATENCY_SAMPLES)
+
+    def record(self, latency: float, nbytes: int, status_code: int | None) -> None:
+        with self._lock:
+            self.requests += 1
+            self.bytes += nbytes
+            self.latencies.append(latency)
+            if status_code is None:
+                self.errors += 1
+            else:
+                self.status_codes[status_code] += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "bytes": self.bytes,
+                "status_codes": dict(self.status_codes),
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p95": _percentile(latencies, 0.95),
+                "latency_max": latencies[-1] if latencies else None,
+            }
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class UpstreamClient:
+    """Pooled keep-alive session for one upstream API.
+
+    Args:
+        source: (str) Name of the upstream API, used for the metrics.
+        timeout: (float) Seconds to wait for the server to send data before
+                 giving up.
+        max_retries: (int) Number of times to retry responses with a status
+                     code in `UPSTREAM_RETRY_STATUS_CODES`.
+        pool_maxsize: (int) Number of connections to keep open to each host.
+    """
+
+    def __init__(self, source: str, timeout: float, max_retries: int, pool_maxsize: int = 10):
+        self.source = source
+        self.timeout = (UPSTREAM_CONNECT_TIMEOUT, timeout)
+        self.metrics = get_source_metrics(source)
+        self.session = requests.Session()
+        retry = _Retry(
+            total=max_retries,
+            # Connection errors are retried by the callers, which also have to
+            # retry errors that happen while the body is being read.
+            connect=0,
+            read=0,
+            status=max_retries,
+            status_forcelist=UPSTREAM_RETRY_STATUS_CODES,
+            allowed_methods=frozenset({"GET"}),
+            backoff_factor=0.5,
+            respect_retry_after_header=True,
+            # Give back the last response instead of raising, so the callers
+            # can report the status code.
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Make a GET request and read the whole response."""
+        with self.stream(url, **kwargs) as res:
+            _ = res.content
+        return res
+
+    @contextmanager
+    def stream(self, url: str, **kwargs) -> Iterator[requests.Response]:
+        """Make a GET request without reading the response body up front.
+        Metrics are recorded once the block exits, so the latency and size
+        cover reading the body too.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        res = None
+        try:
+            with self.session.get(url, stream=True, **kwargs) as res:
+                yield res
+        finally:
+            self.metrics.record(
+                latency=time.perf_counter() - start,
+                nbytes=_response_bytes(res),
+                status_code=getattr(res, "status_code", None),
+            )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def _response_bytes(res: requests.Response | None) -> int:
+    """Bytes received so far for a response."""
+    if res is None:
+        return 0
+    tell = getattr(getattr(res, "raw", None), "tell", None)
+    if callable(tell):
+        return tell()
+    return len(getattr(res, "_content", None) or b"")
+
+
+_clients: dict[str, UpstreamClient] = {}
+_clients_lock = threading.Lock()
+_metrics: dict[str, UpstreamMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def get_source_metrics(source: str) -> UpstreamMetrics:
+    """Returns the metrics for an upstream API. Every client for the same
+    source (including the asyncio one) records into the same metrics.
+    """
+    with _metrics_lock:
+        metrics = _metrics.get(source)
+        if metrics is None:
+            metrics = _metrics[source] = UpstreamMetrics()
+        return metrics
+
+
+def get_upstream_client(source: str) -> UpstreamClient:
+    """Returns the client for an upstream API, creating it the first time.
+
+    The timeout is read from the `{SOURCE}_TIMEOUT_SECONDS` config variable.
+    """
+    with _clients_lock:
+        client = _clients.get(source)
+        if client is None:
+            config = current_app.config
+            client = _clients[source] = UpstreamClient(
+                source,
+                timeout=config[f"{source.upper()}_TIMEOUT_SECONDS"],
+                max_retries=config["UPSTREAM_MAX_RETRIES"],
+                pool_maxsize=max(10, config["HOBOLINK_MAX_CONCURRENT_REQUESTS"]),
+            )
+        return client
+
+
+def get_upstream_metrics() -> dict[str, dict[str, Any]]:
+    """Metrics for every upstream API that has been requested from this
+    process.
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {source: i.to_dict() for source, i in metrics.items()}
@@ -5,12 +5,28 @@ and Muddy River gauge.
 Link to the web interface (not the api)
 Waltham: https://waterdata.usgs.gov/nwis/uv?site_no=01104500
 Muddy River: https://waterdata.usgs.gov/nwis/uv?site_no=01104683
+
+Data is requested from the NWIS Instantaneous Values web service, which can
+return data for several sites at once:
+https://waterservices.usgs.gov/docs/instantaneous-values/
 """
 
+import io
 import os
+from contextlib import contextmanager
+from datetime import UTC
+from datetime import date
+from datetime import datetime
+from datetime import time
+from datetime import timedelta
+from functools import partial
+from typing import Iterable
+from typing import Iterator
+from typing import Sequence
 from typing import Union
 
 import pandas as pd
+import pytz
 import requests
 from flask import abort
 from flask import current_app
@@ -18,72 +34,322 @@ from tenacity import retry
 from tenacity import stop_after_attempt
 from tenacity import wait_fixed
 
+from app.data.processing.pipeline_timing import timed_stage
+from app.data.processing.upstream_cache import UpstreamCache
+from app.data.processing.upstream_cache import get_upstream_cache
+from app.data.processing.upstream_cache import is_closed_window
+from app.data.processing.upstream_cache import iter_response_body
+from app.data.processing.upstream_client import get_upstream_client
 from app.mail import mail_on_fail
 
 
-USGS_URL = "https://waterdata.usgs.gov/nwis/uv"
+USGS_URL = "https://waterservices.usgs.gov/nwis/iv/"
 USGS_STATIC_FILE_NAME = "usgs.pickle"
 USGS_DEFAULT_DAYS_AGO = 30
 USGS_ROWS_PER_HOUR_WALTHAM = 4
 USGS_ROWS_PER_HOUR_MUDDY_RIVER = 6
+USGS_WINDOW_DAYS = 7
+USGS_SITES = ["01104500", "01104683"]
+USGS_INGESTION_OVERLAP = timedelta(hours=2)
+
+USGS_COLUMN_MAP = {
+    "01104500": {
+        "datetime": "time",
+        "66190_00060": "stream_flow",
+        "66191_00065": "gage_height",
+    },
+    "01104683": {"datetime": "time", "66196_00065": "gage_height"},
+}
+
+# Codes that USGS puts in numeric columns when there is no value, e.g. "Ice"
+# when the gauge is iced over or "Eqp" when the equipment is broken.
+USGS_NA_VALUES = [
+    "",
+    "***",
+    "--",
+    "Bkw",
+    "Dis",
+    "Dry",
+    "Eqp",
+    "Fld",
+    "Ice",
+    "Mnt",
+    "Pr",
+    "Rat",
+    "Ssn",
+    "Tst",
+    "Zfl",
+]
+
+USGS_UTC_OFFSETS = {"EST": pd.Timedelta(hours=-5), "EDT": pd.Timedelta(hours=-4)}
 
 
-@retry(reraise=True, wait=wait_fixed(1), stop=stop_after_attempt(3))
-@mail_on_fail
 def get_live_usgs_data(
     days_ago: int = USGS_DEFAULT_DAYS_AGO, site_no: str = "01104500"
 ) -> pd.DataFrame:
     """This function runs through the whole process for retrieving data from
     usgs: first we perform the request, and then we parse the data.
 
+    To get the data for more than one site, use `get_live_usgs_data_for_sites`,
+    which gets all of them in a single request.
+
     Returns:
         Pandas Dataframe containing the usgs data.
     """
+    return get_live_usgs_data_for_sites(days_ago=days_ago, site_nos=[site_no])[site_no]
+
+
+@retry(reraise=True, wait=wait_fixed(1), stop=stop_after_attempt(3))
+@mail_on_fail
+def get_live_usgs_data_for_sites(
+    days_ago: int = USGS_DEFAULT_DAYS_AGO,
+    site_nos: Sequence[str] = tuple(USGS_SITES),
+    start_time: datetime | None = None,
+    end_time: datetime | None = None,
+) -> dict[str, pd.DataFrame]:
+    """Get the USGS data for several sites with one request per window of
+    time, instead of one request per site.
+
+    Args:
+        days_ago: (int) Number of days of data to get.
+        site_nos: (list[str]) Site numbers to get data for.
+        start_time: (datetime) If set, get the data from this time onwards
+                    instead of using `days_ago`. This is for getting just the
+                    newest data, or a range of past data.
+        end_time: (datetime) If `start_time` is set, get the data up to this
+                  time instead of up to now.
+
+    Returns:
+        Dict of site number to a Pandas Dataframe containing the usgs data for
+        that site.
+    """
     if current_app.config["USE_MOCK_DATA"]:
-        fname = {"01104500": "usgs_w.pickle", "01104683": "usgs_b.pickle"}.get(site_no)
-        if not fname:
-            raise ValueError(f"Site no {site_no} not mapped to a mock data file.")
-        fpath = os.path.join(current_app.config["DATA_STORE"], fname)
-        df = pd.read_pickle(fpath)
-        return df
-
-    res = request_to_usgs(days_ago=days_ago, site_no=site_no)
-    df = parse_usgs_data(res, site_no=site_no)
-    return df
+        out = {}
+        for site_no in site_nos:
+            fname = {"01104500": "usgs_w.pickle", "01104683": "usgs_b.pickle"}.get(site_no)
+            if not fname:
+                raise ValueError(f"Site no {site_no} not mapped to a mock data file.")
+            fpath = os.path.join(current_app.config["DATA_STORE"], fname)
+            out[site_no] = pd.read_pickle(fpath)
+        return out
+
+    cache = get_upstream_cache()
+    if start_time is not None:
+        if cache is not None:
+            return _get_usgs_data_in_range(
+                cache=cache, start=start_time, end=end_time, site_nos=site_nos
+            )
+        res = request_to_usgs(site_no=site_nos, begin_date=start_time, end_date=end_time)
+        return _parse_timed(res, site_nos=site_nos)
+
+    if cache is not None:
+        return _get_usgs_data_by_window(cache=cache, days_ago=days_ago, site_nos=site_nos)
+
+    res = request_to_usgs(days_ago=days_ago, site_no=site_nos)
+    return _parse_timed(res, site_nos=site_nos)
+
+
+def _parse_timed(
+    res: Union[str, requests.models.Response], site_nos: Sequence[str]
+) -> dict[str, pd.DataFrame]:
+    with timed_stage("parse_usgs") as timing:
+        out = parse_usgs_data_for_sites(res, site_nos=site_nos)
+        timing.rows = sum(len(df) for df in out.values())
+    return out
+
+
+def _get_usgs_data_by_window(
+    cache: UpstreamCache, days_ago: int, site_nos: Sequence[str]
+) -> dict[str, pd.DataFrame]:
+    """Get the USGS data in windows of `USGS_WINDOW_DAYS` days, so that the
+    windows that are fully in the past can be read from the upstream cache.
+    """
+    start = datetime.now(UTC) - timedelta(days=days_ago)
+    results = [
+        _read_window(cache, site_nos=site_nos, begin_date=begin_date, end_date=end_date)
+        for begin_date, end_date in _get_request_windows_since(start)
+    ]
+    return _combine_windows(results, site_nos=site_nos, start=start)
+
+
+def _get_usgs_data_in_range(
+    cache: UpstreamCache, start: datetime, end: datetime | None, site_nos: Sequence[str]
+) -> dict[str, pd.DataFrame]:
+    """Get the USGS data from `start` to `end`. The windows of
+    `USGS_WINDOW_DAYS` days that are closed and end by `end` are read from the
+    upstream cache, and the rest is requested in one go. So a backfill can get
+    the same past data many times over without downloading it again, while
+    getting just the newest data is still a single small request.
+    """
+    if end is None:
+        end = datetime.now(UTC)
+    windows, rest_start = _get_closed_windows_in_range(start, end)
+    results = [
+        _read_window(cache, site_nos=site_nos, begin_date=begin_date, end_date=end_date)
+        for begin_date, end_date in windows
+    ]
+    if rest_start < end or not results:
+        res = request_to_usgs(site_no=site_nos, begin_date=rest_start, end_date=end)
+        results.append(_parse_timed(res, site_nos=site_nos))
+    return _combine_windows(results, site_nos=site_nos, start=start, end=end)
+
+
+def _get_closed_windows_in_range(
+    start: datetime, end: datetime
+) -> tuple[list[tuple[date, date]], datetime]:
+    """The grid windows from `start` onwards that are closed and end by `end`,
+    and the time the rest of the range starts at.
+    """
+    tz = pytz.timezone("US/Eastern")
+    windows = []
+    rest_start = start
+    for begin_date, end_date in _get_request_windows(
+        start.astimezone(tz).date(), end.astimezone(tz).date()
+    ):
+        window_end = _get_window_bounds(begin_date, end_date)[1]
+        if window_end > end or not is_closed_window(window_end):
+            break
+        windows.append((begin_date, end_date))
+        rest_start = window_end
+    return windows, rest_start
+
+
+def _read_window(
+    cache: UpstreamCache, site_nos: Sequence[str], begin_date: date, end_date: date
+) -> dict[str, pd.DataFrame]:
+    body = iter_response_body(
+        cache,
+        "usgs",
+        ",".join(site_nos),
+        *_get_window_bounds(begin_date, end_date),
+        partial(_fetch_window, site_nos=site_nos, begin_date=begin_date, end_date=end_date),
+    )
+    text = b"".join(body).decode("utf-8")
+    return _parse_timed(text, site_nos=site_nos)
+
+
+def _get_request_windows_since(start: datetime) -> list[tuple[date, date]]:
+    tz = pytz.timezone("US/Eastern")
+    return _get_request_windows(start.astimezone(tz).date(), datetime.now(tz).date())
+
+
+def _get_window_bounds(begin_date: date, end_date: date) -> tuple[datetime, datetime]:
+    """Start and end of a window of dates, as timestamps."""
+    tz = pytz.timezone("US/Eastern")
+    return (
+        tz.localize(datetime.combine(begin_date, time())),
+        tz.localize(datetime.combine(end_date + timedelta(days=1), time())),
+    )
+
+
+def _combine_windows(
+    results: list[dict[str, pd.DataFrame]],
+    site_nos: Sequence[str],
+    start: datetime,
+    end: datetime | None = None,
+) -> dict[str, pd.DataFrame]:
+    out = {}
+    for site_no in site_nos:
+        df = pd.concat([i[site_no] for i in results], ignore_index=True)
+        df = df.drop_duplicates(subset="time").sort_values("time")
+        keep = df["time"] >= start
+        if end is not None:
+            keep &= df["time"] <= end
+        out[site_no] = df.loc[keep].reset_index(drop=True)
+    return out
+
+
+@contextmanager
+def _fetch_window(
+    site_nos: Sequence[str], begin_date: date, end_date: date
+) -> Iterator[Iterable[bytes]]:
+    res = request_to_usgs(site_no=site_nos, begin_date=begin_date, end_date=end_date)
+    yield [res.content]
 
 
-def request_to_usgs(days_ago: int = 14, site_no: str = "01104500") -> requests.models.Response:
+def _get_request_windows(start: date, end: date) -> list[tuple[date, date]]:
+    """Split a date range into windows of `USGS_WINDOW_DAYS` days. Windows are
+    aligned to a fixed grid so the same past windows get requested every time.
+    Both ends of each window are inclusive.
+    """
+    window_start = date.fromordinal(start.toordinal() - start.toordinal() % USGS_WINDOW_DAYS)
+    windows = []
+    while window_start <= end:
+        window_end = window_start + timedelta(days=USGS_WINDOW_DAYS - 1)
+        windows.append((window_start, min(window_end, end)))
+        window_start = window_end + timedelta(days=1)
+    return windows
+
+
+def request_to_usgs(
+    days_ago: int = 14,
+    site_no: Union[str, Sequence[str]] = "01104500",
+    begin_date: date | datetime | None = None,
+    end_date: date | datetime | None = None,
+) -> requests.models.Response:
     """Get a request from the USGS.
 
     Args:
         days_ago: (int) Number of days of data to get.
-        site_no: (str) String of integer site number, either Waltham or Muddy River sites.
+        site_no: (str) String of integer site number, either Waltham or Muddy
+                 River sites. Can also be a list of site numbers, in which
+                 case the data for all of them comes back in one response.
+        begin_date: (date) If set, get data from this date onwards instead of
+                    using `days_ago`. If this is a datetime, get data from
+                    that exact time onwards.
+        end_date: (date) If `begin_date` is set, get data up to and including
+                  this date. If `begin_date` is a datetime and this is not
+                  set, get data up to now.
 
     Returns:
         Request Response containing the data from the request.
     """
-    # if site is waltham, takes both gage height and flow discharge,
-    # otherwise, only takes gage height
-    if site_no == "01104500":
-        additional_feature = "on"
-    else:
-        additional_feature = "off"
+    payload = _get_request_params(
+        days_ago=days_ago, site_no=site_no, begin_date=begin_date, end_date=end_date
+    )
+    res = get_upstream_client("usgs").get(USGS_URL, params=payload)
+    if res.status_code >= 400:
+        error_msg = f"API request to the USGS endpoint failed with status code {res.status_code}."
+        abort(500, error_msg)
+    return res
+
+
+def _get_request_params(
+    days_ago: int,
+    site_no: Union[str, Sequence[str]],
+    begin_date: date | datetime | None = None,
+    end_date: date | datetime | None = None,
+) -> dict[str, str]:
+    """Query string for `request_to_usgs`."""
+    site_nos = [site_no] if isinstance(site_no, str) else list(site_no)
 
+    # Waltham has both gage height and flow discharge, Muddy River only has
+    # gage height. Columns we don't use are ignored by the parser.
     payload = {
-        "cb_00060": additional_feature,
-        "cb_00065": "on",  # always accepts gage height
         "format": "rdb",
-        "site_no": site_no,
-        "period": days_ago,
+        "sites": ",".join(site_nos),
+        "parameterCd": "00060,00065",
+        "siteStatus": "all",
     }
+    if begin_date is None:
+        payload["period"] = f"P{days_ago}D"
+    elif isinstance(begin_date, datetime):
+        payload["startDT"] = _format_usgs_datetime(begin_date)
+        if end_date is not None:
+            payload["endDT"] = _format_usgs_datetime(end_date)
+    else:
+        payload["startDT"] = begin_date.strftime("%Y-%m-%d")
+        payload["endDT"] = (end_date or begin_date).strftime("%Y-%m-%d")
+    return payload
 
-    res = requests.get(USGS_URL, params=payload)
-    if res.status_code >= 400:
-        error_msg = (
-            "API request to the USGS endpoint failed with status " f"code {res.status_code}."
-        )
-        abort(500, error_msg)
-    return res
+
+def _format_usgs_datetime(dt: datetime) -> str:
+    """Format a timestamp the way the USGS API wants it, with a UTC offset
+    since times without one are taken to be local time at the site.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt.astimezone(UTC).strftime("%Y-%m-%dT%H:%M%z")
 
 
 def parse_usgs_data(res: Union[str, requests.models.Response], site_no: str) -> pd.DataFrame:
@@ -97,38 +363,117 @@ def parse_usgs_data(res: Union[str, requests.models.Response], site_no: str) ->
     Returns:
         Pandas DataFrame containing the usgs data.
     """
+    return parse_usgs_data_for_sites(res, site_nos=[site_no])[site_no]
+
+
+def parse_usgs_data_for_sites(
+    res: Union[str, requests.models.Response], site_nos: Sequence[str]
+) -> dict[str, pd.DataFrame]:
+    """
+    Clean a response from the USGS API that can have data for several sites.
+
+    The response is a tab-separated RDB file with one table per site. Each
+    table has a block of comments starting with "#", a row of column names, a
+    row of column types, and then the data. The data is read with pandas' C
+    parser, using the column types to decide which columns are numeric.
+
+    Args:
+        res: response object from USGS
+        site_nos: site numbers of the usgs data being parsed
+
+    Returns:
+        Dict of site number to a Pandas DataFrame containing the usgs data for
+        that site. Sites that aren't in the response get an empty DataFrame.
+    """
     if isinstance(res, requests.models.Response):
         res = res.text
 
-    raw_data = [i.split("\t") for i in res.split("\n") if not i.startswith("#") and i != ""]
+    for site_no in site_nos:
+        if site_no not in USGS_COLUMN_MAP:
+            raise ValueError(f"Unknown site number {site_no}. Cannot map columns.")
 
-    # First row is column headers
-    # Second row is ????
-    # Third row downward is the data
-    df = pd.DataFrame(raw_data[2:], columns=raw_data[0])
+    out = {}
+    for columns, types, body in _iter_rdb_tables(res):
+        # Each site's table has its own time series IDs in the column names.
+        for site_no in site_nos:
+            if site_no not in out and set(USGS_COLUMN_MAP[site_no]).issubset(columns):
+                out[site_no] = _parse_rdb_table(columns, types, body, site_no=site_no)
+                break
+        else:
+            site_no = body.split("\t", 2)[1] if "\t" in body else None
+            if site_no in site_nos:
+                missing = sorted(set(USGS_COLUMN_MAP[site_no]) - set(columns))
+                raise ValueError(f"USGS response for site {site_no} is missing columns {missing}.")
 
-    column_map = {
-        "01104500": {
-            "datetime": "time",
-            "66190_00060": "stream_flow",
-            "66191_00065": "gage_height",
-        },
-        "01104683": {"datetime": "time", "66196_00065": "gage_height"},
-    }
-    if site_no not in column_map:
-        raise ValueError(f"Unknown site number {site_no}. Cannot map columns.")
-    df = df.rename(columns=column_map[site_no])
-
-    df = df[list(column_map[site_no].values())]
-
-    # Convert types
-    df["time"] = pd.to_datetime(df["time"]).dt.tz_localize("US/Eastern").dt.tz_convert("UTC")
-    # Note to self: ran this once in a test and it gave the following error:
-    # >>> ValueError: could not convert string to float: ''
-    # Reran and it went away
-    # The error was here in this line casting `stream_flow` to a float:
-
-    numeric_columns = set(column_map[site_no].values()) - {"time"}  # All columns except "time"
-    for col in numeric_columns:
-        df[col] = df[col].replace("", None).astype(float)
+    # Sites without a table, e.g. because the gauge was offline the whole time.
+    return {site_no: out.get(site_no, _empty_usgs_data(site_no)) for site_no in site_nos}
+
+
+def _empty_usgs_data(site_no: str) -> pd.DataFrame:
+    columns = USGS_COLUMN_MAP[site_no].values()
+    df = pd.DataFrame({col: pd.Series(dtype="float64") for col in columns})
+    df["time"] = pd.Series(dtype="datetime64[ns, UTC]")
+    return df
+
+
+def _parse_rdb_table(columns: list[str], types: list[str], body: str, site_no: str) -> pd.DataFrame:
+    column_map = USGS_COLUMN_MAP[site_no]
+    if not body.strip():
+        return _empty_usgs_data(site_no)
+
+    # Column types look like "20d" or "14n": a width and then "s" for string,
+    # "d" for date, or "n" for number.
+    usecols = [*column_map, "tz_cd"]
+    dtype = {col: "float64" if type_.endswith("n") else str for col, type_ in zip(columns, types)}
+
+    df = pd.read_csv(
+        io.StringIO(body),
+        sep="\t",
+        header=None,
+        names=columns,
+        usecols=usecols,
+        dtype={col: dtype[col] for col in usecols},
+        na_values=USGS_NA_VALUES,
+        keep_default_na=False,
+        engine="c",
+    )
+
+    # Timestamps are in local time, with a column saying whether that's EST or
+    # EDT. Going through that column rather than localizing to US/Eastern means
+    # the repeated hour when daylight saving time ends isn't ambiguous.
+    offsets = df.pop("tz_cd").map(USGS_UTC_OFFSETS)
+    if offsets.isna().any():
+        raise ValueError(f"USGS response for site {site_no} has an unknown time zone code.")
+    local_time = pd.to_datetime(df["datetime"], format="%Y-%m-%d %H:%M")
+    df["datetime"] = (local_time - offsets).dt.tz_localize("UTC")
+
+    df = df.rename(columns=column_map)
+    df = df[list(column_map.values())]
     return df
+
+
+def _iter_rdb_tables(text: str) -> Iterator[tuple[list[str], list[str], str]]:
+    """Split an RDB file into its tables.
+
+    Returns:
+        Iterator of the column names, column types, and data of each table.
+    """
+    pos = 0
+    while True:
+        rows = []
+        while len(rows) < 2:
+            if pos >= len(text):
+                return
+            end = text.find("\n", pos)
+            if end == -1:
+                end = len(text)
+            line = text[pos:end].rstrip("\r")
+            pos = end + 1
+            if line and not line.startswith("#"):
+                rows.append(line.split("\t"))
+
+        # The data goes until the comments for the next table start.
+        end = text.find("\n#", pos - 1)
+        end = len(text) if end == -1 else end + 1
+        yield rows[0], rows[1], text[pos:end]
+        pos = end
@@ -290,9 +290,27 @@ def register_commands(app: Flask):
             res = update_db_task.delay(tweet_status=tweet_status)
             click.echo(f"Started update database task ({res.id!r}).")
         else:
+            from app.data.processing.upstream_client import get_upstream_metrics
+
             click.echo("Updating the database...")
-            update_db_task.run(tweet_status=tweet_status)
-            click.echo("Updated the database successfully.")
+            stats = update_db_task.run(tweet_status=tweet_status)
+            if stats:
+                click.echo("Updated the database successfully.")
+            else:
+                click.echo("The source data hasn't changed since the last update. Skipped it.")
+            for table_name, i in stats.items():
+                click.echo(f"{table_name}: {i['rows']} rows, {i['bytes']:,} bytes written")
+            for source, metrics in get_upstream_metrics().items():
+                # There are no latencies for a source that made no requests,
+                # e.g. because everything came from the cache.
+                p50, p95 = (
+                    "-" if metrics[i] is None else f"{metrics[i]:.2f}s"
+                    for i in ["latency_p50", "latency_p95"]
+                )
+                click.echo(
+                    f"{source}: {metrics['requests']} requests, {metrics['bytes']:,} bytes,"
+                    f" p50 {p50}, p95 {p95}, status codes {metrics['status_codes']}"
+                )
 
     @app.cli.command("gen-mock-data")
     @dev_only
@@ -318,11 +336,11 @@ def register_commands(app: Flask):
         from app.data.processing.hobolink import HOBOLINK_STATIC_FILE_NAME
         from app.data.processing.hobolink import get_live_hobolink_data
         from app.data.processing.usgs import USGS_STATIC_FILE_NAME
-        from app.data.processing.usgs import get_live_usgs_data
+        from app.data.processing.usgs import get_live_usgs_data_for_sites
 
         df_hobolink = get_live_hobolink_data()
-        df_usgs_w = get_live_usgs_data(site_no="01104500")
-        df_usgs_b = get_live_usgs_data(site_no="01104683")
+        df_usgs = get_live_usgs_data_for_sites(site_nos=["01104500", "01104683"])
+        df_usgs_w, df_usgs_b = df_usgs["01104500"], df_usgs["01104683"]
 
         fname_hobolink = _format_path(HOBOLINK_STATIC_FILE_NAME)
         df_hobolink.to_pickle(fname_hobolink)
@@ -404,6 +422,125 @@ def register_commands(app: Flask):
 
         cache.clear()
 
+    @app.cli.command("backfill")
+    @click.option(
+        "--start",
+        type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M"]),
+        required=True,
+        help="Start of the range to backfill, in UTC.",
+    )
+    @click.option(
+        "--end",
+        type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%dT%H:%M"]),
+        required=True,
+        help="End of the range to backfill (exclusive), in UTC.",
+    )
+    @click.option(
+        "--model-version",
+        type=click.Choice(["v1", "v2", "v3", "v4"]),
+        default=None,
+        help="Model version to run. Defaults to the model version the website uses.",
+    )
+    @click.option(
+        "--chunk-days",
+        type=click.IntRange(min=1),
+        default=7,
+        show_default=True,
+        help="Days of predictions each worker computes at once.",
+    )
+    @click.option(
+        "--workers",
+        type=click.IntRange(min=1),
+        default=None,
+        help="Number of worker processes. Defaults to the number of CPUs.",
+    )
+    def backfill_command(
+        start: datetime.datetime,
+        end: datetime.datetime,
+        model_version: str | None = None,
+        chunk_days: int = 7,
+        workers: int | None = None,
+    ):
+        """Compute the predictions over a past range of time and store them in
+        the prediction_backfill table.
+        """
+        from app.data.processing.backfill import BackfillProgress
+        from app.data.processing.backfill import backfill
+        from app.data.processing.predictive_models import DEFAULT_MODEL_VERSION
+        from app.data.processing.predictive_models import ModelVersion
+
+        start = start.replace(tzinfo=datetime.UTC)
+        end = end.replace(tzinfo=datetime.UTC)
+        if start >= end:
+            raise click.BadParameter("--start must be before --end.")
+        model_version = ModelVersion(model_version) if model_version else DEFAULT_MODEL_VERSION
+
+        def _echo_progress(progress: BackfillProgress) -> None:
+            click.echo(
+                f"[{progress.chunks_done}/{progress.chunks_total}]"
+                f" {progress.chunk.start:%Y-%m-%d %H:%M} to {progress.chunk.end:%Y-%m-%d %H:%M}:"
+                f" {progress.rows} predictions ({progress.hours_per_second:,.1f} hours/s)"
+            )
+
+        click.echo(f"Backfilling {model_version.value} from {start} to {end}...")
+        rows = backfill(
+            start=start,
+            end=end,
+            model_version=model_version,
+            chunk_days=chunk_days,
+            max_workers=workers,
+            on_progress=_echo_progress,
+        )
+        click.echo(f"Wrote {rows} predictions to prediction_backfill.")
+
+    @app.cli.group("upstream-cache")
+    def upstream_cache_group():
+        """Inspect and prune the cache of raw HOBOlink and USGS responses."""
+
+    @upstream_cache_group.command("info")
+    @click.option("--verbose", "-v", is_flag=True, default=False, help="List every entry.")
+    def upstream_cache_info(verbose: bool = False):
+        """Show what is in the upstream cache."""
+        from app.data.processing.upstream_cache import get_upstream_cache
+
+        cache = get_upstream_cache()
+        if cache is None:
+            click.echo("The upstream cache is turned off.")
+            return
+
+        entries = cache.entries()
+        click.echo(f"Directory: {cache.directory}")
+        click.echo(f"Size: {cache.size():,} of {cache.max_bytes:,} bytes")
+        click.echo(f"Entries: {len(entries)}")
+        for source in sorted({i["source"] for i in entries}):
+            n = sum(1 for i in entries if i["source"] == source)
+            click.echo(f"  {source}: {n}")
+        if verbose:
+            for i in entries:
+                click.echo(
+                    f"{i['source']}\t{i['key']}\t{i['start']}\t{i['end']}\t{i['bytes']:,} bytes"
+                )
+
+    @upstream_cache_group.command("prune")
+    @click.option(
+        "--max-bytes",
+        type=int,
+        default=None,
+        help="Prune down to this many bytes. Defaults to UPSTREAM_CACHE_MAX_BYTES.",
+    )
+    @click.option("--all", "all_", is_flag=True, default=False, help="Delete everything.")
+    def upstream_cache_prune(max_bytes: int | None = None, all_: bool = False):
+        """Delete the least recently used responses from the upstream cache."""
+        from app.data.processing.upstream_cache import get_upstream_cache
+
+        cache = get_upstream_cache()
+        if cache is None:
+            click.echo("The upstream cache is turned off.")
+            return
+
+        removed = cache.prune(max_bytes=0 if all_ else max_bytes)
+        click.echo(f"Removed {removed} cached responses. Size is now {cache.size():,} bytes.")
+
     from celery.bin.celery import celery as celery_cmd
 
     app.cli.add_command(celery_cmd)
@@ -0,0 +1,87 @@
+"""
+Benchmark for parsing HOBOlink payloads.
+
+Compares `parse_hobolink_data` against the previous implementation, which
+built a DataFrame out of the list of readings and then pivoted it.
+
+Run it from the repo root with:
+
+    python -m benchmarks.hobolink_parser
+"""
+
+import random
+import timeit
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+
+import pandas as pd
+
+from app.data.processing.hobolink import parse_hobolink_data
+
+
+SENSORS = {
+    "21114835-1": "Temperature",
+    "21114835-2": "RH",
+    "21114835-3": "Dew Point",
+    "21125541-1": "Pressure",
+    "21118237-1": "PAR",
+    "21107892-1": "Rain",
+    "21114108-1": "Wind Speed",
+    "21114108-2": "Gust Speed",
+    "21114108-3": "Wind Direction",
+    "21092695-1": "Battery",
+}
+EXCLUDE_SENSORS = ["21092695-1"]
+
+
+def make_payload(days: int) -> list[dict[str, Any]]:
+    """Fake HOBOlink payload with a reading from every sensor every 5 mins."""
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1, tzinfo=UTC)
+    data = []
+    for i in range(days * 24 * 12):
+        timestamp = (start + timedelta(minutes=5 * i)).strftime("%Y-%m-%d %H:%M:%SZ")
+        for sensor_sn, measurement_type in SENSORS.items():
+            data.append(
+                {
+                    "timestamp": timestamp,
+                    "sensor_sn": sensor_sn,
+                    "sensor_measurement_type": measurement_type,
+                    "value": rng.random() * 100,
+                    "unit": "",
+                }
+            )
+    return data
+
+
+def parse_hobolink_data_previous(
+    data: list[dict[str, Any]], exclude_sensors: list[str]
+) -> pd.DataFrame:
+    df = pd.DataFrame(data)
+    df = df.loc[~df["sensor_sn"].isin(exclude_sensors), :]
+    df["time"] = pd.to_datetime(df["timestamp"])
+    df["sensor_measurement_type"] = df["sensor_measurement_type"].str.lower().str.replace(" ", "_")
+    df = df.pivot(index="time", columns="sensor_measurement_type", values="value")
+    df = df.reset_index()
+    return df
+
+
+def main():
+    for label, days in [("90 days", 90), ("1 year", 365)]:
+        data = make_payload(days)
+        pd.testing.assert_frame_equal(
+            parse_hobolink_data(data, exclude_sensors=EXCLUDE_SENSORS),
+            parse_hobolink_data_previous(data, exclude_sensors=EXCLUDE_SENSORS),
+        )
+        for name, func in [
+            ("previous", parse_hobolink_data_previous),
+            ("columnar", parse_hobolink_data),
+        ]:
+            t = min(timeit.repeat(lambda: func(data, EXCLUDE_SENSORS), number=1, repeat=3))
+            print(f"{label:>8} ({len(data):>9,} readings) {name:>9}: {t:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark for the rolling windows of the model features.
+
+Compares `RollingSums`, which takes every window of a column from one
+cumulative sum, against calling pandas `rolling()` once per window. The windows
+are the ones the model versions take together: the rain sums of v1, v2 and v4,
+the stream flow means of v2 and v4, and v4's 72 hour means.
+
+Run it from the repo root with:
+
+    python -m benchmarks.rolling_windows
+"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from app.data.processing.predictive_models.rolling import RollingSums
+
+
+WINDOWS = {
+    "rain": ("sum", [12, 24, 48, 96, 168]),
+    "log_stream_flow": ("mean", [1, 12, 24]),
+    "log_gage_height": ("mean", [12, 24]),
+    "log_rh": ("mean", [72]),
+    "log_pressure": ("mean", [72]),
+    "log_par": ("mean", [72]),
+}
+
+
+def make_hourly_data(hours: int) -> pd.DataFrame:
+    """Fake hourly data, with some readings missing."""
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame(
+        {
+            "rain": np.where(rng.random(hours) < 0.05, rng.random(hours) * 0.3, 0.0),
+            "log_stream_flow": np.log(rng.random(hours) * 500 + 1),
+            "log_gage_height": np.log(rng.random(hours) * 5 + 1),
+            "log_rh": np.log(rng.random(hours) * 100 + 1),
+            "log_pressure": np.log(rng.random(hours) * 10 + 1010),
+            "log_par": np.log(rng.random(hours) * 2000 + 1),
+        }
+    )
+    for col in df.columns:
+        df.loc[rng.random(hours) < 0.01, col] = np.nan
+    return df
+
+
+def rolling_pandas(df: pd.DataFrame) -> dict[tuple[str, int], np.ndarray]:
+    return {
+        (col, window): getattr(df[col].rolling(window), stat)().to_numpy()
+        for col, (stat, windows) in WINDOWS.items()
+        for window in windows
+    }
+
+
+def rolling_prefix_sums(df: pd.DataFrame) -> dict[tuple[str, int], np.ndarray]:
+    out = {}
+    for col, (stat, windows) in WINDOWS.items():
+        sums = RollingSums(df[col], max(windows))
+        for window in windows:
+            out[col, window] = getattr(sums, stat)(window)
+    return out
+
+
+def main():
+    for label, years in [("1 year", 1), ("3 years", 3), ("10 years", 10)]:
+        df = make_hourly_data(years * 365 * 24)
+        expected = rolling_pandas(df)
+        for key, values in rolling_prefix_sums(df).items():
+            np.testing.assert_allclose(values, expected[key], rtol=1e-9, atol=1e-9)
+        for name, func in [("pandas", rolling_pandas), ("prefix sums", rolling_prefix_sums)]:
+            t = min(timeit.repeat(lambda: func(df), number=10, repeat=5)) / 10
+            print(f"{label:>8} ({len(df):>7,} hours) {name:>11}: {t * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for parsing USGS RDB responses.
+
+Compares `parse_usgs_data` against the previous implementation, which split
+the text up in Python and cast each column of strings to floats afterwards.
+The previous implementation raises on the repeated hour when daylight saving
+time ends and on codes like "Ice" in numeric columns, so here it is given
+`ambiguous="infer"` and `errors="coerce"` to get it through a multi-year
+response at all.
+
+Run it from the repo root with:
+
+    python -m benchmarks.usgs_parser
+"""
+
+import random
+import timeit
+from datetime import UTC
+from datetime import datetime
+from datetime import timedelta
+
+import pandas as pd
+import pytz
+
+from app.data.processing.usgs import USGS_COLUMN_MAP
+from app.data.processing.usgs import parse_usgs_data
+
+
+SITE_NO = "01104500"
+
+
+def make_response(days: int) -> str:
+    """Fake RDB response for the Waltham gauge with a reading every 15 mins."""
+    rng = random.Random(42)
+    tz = pytz.timezone("US/Eastern")
+    start = datetime(2020, 1, 1, 5, tzinfo=UTC)
+    lines = [
+        "# Fake data for site 01104500",
+        "#",
+        "agency_cd\tsite_no\tdatetime\ttz_cd\t66190_00060\t66190_00060_cd"
+        "\t66191_00065\t66191_00065_cd",
+        "5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s",
+    ]
+    for i in range(days * 24 * 4):
+        local = (start + timedelta(minutes=15 * i)).astimezone(tz)
+        flow = "Ice" if rng.random() < 0.01 else f"{rng.random() * 500:.0f}"
+        height = "" if rng.random() < 0.01 else f"{rng.random() * 5:.2f}"
+        lines.append(
+            f"USGS\t{SITE_NO}\t{local:%Y-%m-%d %H:%M}\t{local.tzname()}\t{flow}\tA\t{height}\tA"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def parse_usgs_data_previous(res: str, site_no: str) -> pd.DataFrame:
+    raw_data = [i.split("\t") for i in res.split("\n") if not i.startswith("#") and i != ""]
+    df = pd.DataFrame(raw_data[2:], columns=raw_data[0])
+    column_map = USGS_COLUMN_MAP[site_no]
+    df = df.rename(columns=column_map)
+    df = df[list(column_map.values())]
+    df["time"] = (
+        pd.to_datetime(df["time"])
+        .dt.tz_localize("US/Eastern", ambiguous="infer")
+        .dt.tz_convert("UTC")
+    )
+    numeric_columns = set(column_map.values()) - {"time"}
+    for col in numeric_columns:
+        df[col] = pd.to_numeric(df[col].replace("", None), errors="coerce")
+    return df
+
+
+def main():
+    for label, days in [("1 year", 365), ("3 years", 3 * 365), ("5 years", 5 * 365)]:
+        res = make_response(days)
+        pd.testing.assert_frame_equal(
+            parse_usgs_data(res, site_no=SITE_NO),
+            parse_usgs_data_previous(res, site_no=SITE_NO),
+        )
+        for name, func in [
+            ("previous", parse_usgs_data_previous),
+            ("c parser", parse_usgs_data),
+        ]:
+            t = min(timeit.repeat(lambda: func(res, SITE_NO), number=1, repeat=3))
+            print(f"{label:>8} ({len(res):>11,} bytes) {name:>9}: {t:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from flask.testing import FlaskClient
 from pytest_postgresql.janitor import DatabaseJanitor
 
 from app.data.globals import cache as _cache
+from app.data.processing import core
 from app.data.processing.core import update_db
 from app.main import create_app
 from app.twitter import tweepy_api
@@ -15,6 +16,9 @@ from app.twitter import tweepy_api
 def app():
     app = create_app()
     app.testing = True
+    # The mock data never changes, so every update after the first would be
+    # skipped. Tests of the skip turn this back on.
+    app.config["SKIP_UNCHANGED_UPDATES"] = False
 
     janitor = DatabaseJanitor(
         user=app.config["POSTGRES_USER"],
@@ -46,6 +50,15 @@ def live_app(app):
     app.config["USE_MOCK_DATA"] = old
 
 
+@pytest.fixture(autouse=True)
+def upstream_cache_dir(app, tmp_path):
+    """Every test gets its own empty upstream cache."""
+    new = str(tmp_path / "upstream_cache")
+    app.config["UPSTREAM_CACHE_DIR"], old = new, app.config["UPSTREAM_CACHE_DIR"]
+    yield new
+    app.config["UPSTREAM_CACHE_DIR"] = old
+
+
 @pytest.fixture(scope="function")
 def client(app) -> FlaskClient:
     """A test client for the app. You can think of the test like a web browser;
@@ -56,9 +69,12 @@ def client(app) -> FlaskClient:
 
 @pytest.fixture(scope="function", autouse=True)
 def cache():
-    """After every test, we want to clear the cache."""
+    """After every test, we want to clear the cache (including the source data
+    snapshots memoized in this process).
+    """
     yield _cache
     _cache.clear()
+    core._snapshots.clear()
 
 
 @pytest.fixture(scope="session")
@@ -4,8 +4,10 @@ in the YAML files, and they in turn define how the API is supposed to work.
 
 import pytest
 import schemathesis
+from sqlalchemy import text
 
 from app.data.models.boathouse import Boathouse
+from app.data.processing.core import update_db
 
 
 @pytest.fixture
@@ -57,3 +59,33 @@ def test_manual_override(client, db_session, cache):
     # Now make sure the API is showing that it's overridden.
     yacht_club = _get_yacht_club()
     assert yacht_club["overridden"]
+
+
+def test_model_version_parameter(client, db_session, app, monkeypatch):
+    """Shadow model versions can be requested from the API, but the default
+    model version is what is returned when no version is given.
+    """
+    monkeypatch.setitem(app.config, "SHADOW_MODEL_VERSIONS", ["v3"])
+    update_db()
+
+    res = client.get("/api/v1/model?reach=2&hours=3").json
+    assert res["model_version"] == "v4"
+
+    res = client.get("/api/v1/model?reach=2&hours=3&model_version=v3").json
+    assert res["model_version"] == "v3"
+    assert len(res["model_outputs"][0]["predictions"]) == 3
+    assert all(0 <= p["prediction"] <= 1 for p in res["model_outputs"][0]["predictions"])
+
+    res = client.get("/api/v1/model?model_version=v9")
+    assert res.status_code == 400
+
+
+def test_model_input_data_keeps_index(client, db_session, cache):
+    """The processed data used to be stored with its position as an `index`
+    column, and the API still returns it.
+    """
+    update_db()
+    cache.clear()
+    records = client.get("/api/v1/model_input_data?hours=3").json["model_input_data"]
+    rows = db_session.execute(text("SELECT COUNT(*) FROM processed_data;")).scalar()
+    assert [i["index"] for i in records] == [rows - 3, rows - 2, rows - 1]
@@ -11,6 +11,7 @@ import requests
 from app.data.models.boathouse import Boathouse
 from app.data.models.website_options import WebsiteOptions
 from app.data.processing import core
+from app.data.processing import upstream_client
 from app.mail import mail
 from app.twitter import compose_tweet
 
@@ -20,7 +21,7 @@ C = TypeVar("C", bound=Callable[..., Any])
 
 @pytest.fixture
 def mock_update_db():
-    with patch.object(core, "update_db") as mocked_func:
+    with patch.object(core, "update_db", return_value={}) as mocked_func:
         yield mocked_func
 
 
@@ -32,7 +33,7 @@ def mail_send():
 
 def test_mail_when_error_raised(mail_send, app, cli_runner, monkeypatch, db_session):
     # This should not cause an email to be sent:
-    monkeypatch.setattr(core, "update_db", lambda: None)
+    monkeypatch.setattr(core, "update_db", lambda: {})
     cli_runner.invoke(app.cli, ["update-db"])
     assert mail_send.call_count == 0
 
@@ -67,6 +68,30 @@ def test_no_tweet_off_season(app, db_session, cli_runner, mock_update_db, mock_s
     assert mock_send_tweet.call_count == 1
 
 
+def test_update_db_metrics_without_requests(app, db_session, cli_runner, monkeypatch):
+    # A source that made no requests, e.g. because the cache served everything.
+    monkeypatch.setattr(core, "update_db", lambda: {})
+    with patch.dict(upstream_client._metrics, clear=True):
+        upstream_client.get_source_metrics("hobolink")
+        res = cli_runner.invoke(app.cli, ["update-db"])
+    assert res.exit_code == 0, res.output
+    assert "hobolink: 0 requests, 0 bytes, p50 -, p95 -" in res.output
+
+
+def test_backfill_reports_progress(app, db_session, cli_runner):
+    res = cli_runner.invoke(
+        app.cli,
+        ["backfill", "--start", "2025-04-10", "--end", "2025-04-12", "--chunk-days", "1"],
+    )
+    assert res.exit_code == 0, res.output
+    assert "[1/2] 2025-04-10 00:00 to 2025-04-11 00:00: 96 predictions" in res.output
+    assert "[2/2] 2025-04-11 00:00 to 2025-04-12 00:00: 96 predictions" in res.output
+    assert "Wrote 192 predictions to prediction_backfill." in res.output
+
+    res = cli_runner.invoke(app.cli, ["backfill", "--start", "2025-04-12", "--end", "2025-04-10"])
+    assert res.exit_code != 0
+
+
 def test_shell_runs(app):
     available = {k: v for i in app.shell_context_processors for k, v in i().items()}
     assert "app" in available
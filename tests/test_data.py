@@ -1,14 +1,58 @@
+import asyncio
+import json
 import os
+import threading
 from datetime import UTC
 from datetime import datetime
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from unittest.mock import patch
 
+import httpx
+import numpy as np
 import pandas as pd
 import pytest
+import requests
+from sqlalchemy import inspect
 from sqlalchemy import text
 
+from app.data.database import db
+from app.data.database import execute_sql
 from app.data.models.boathouse import Boathouse
+from app.data.models.ingestion_state import IngestionState
+from app.data.models.pipeline_run import PipelineRun
+from app.data.models.reach import Reach
+from app.data.processing import core
+from app.data.processing import hobolink
+from app.data.processing import upstream_async
+from app.data.processing import upstream_cache
+from app.data.processing.backfill import BACKFILL_OVERLAP
+from app.data.processing.backfill import backfill
+from app.data.processing.backfill import get_backfill_chunks
+from app.data.processing.core import update_db
 from app.data.processing.hobolink import get_live_hobolink_data
+from app.data.processing.hobolink import iter_json_array
+from app.data.processing.hobolink import parse_hobolink_data
+from app.data.processing.hobolink import request_to_hobolink
+from app.data.processing.pipeline_timing import get_stage_timings
+from app.data.processing.pipeline_timing import record_pipeline_run
+from app.data.processing.pipeline_timing import summarize_stage_timings
+from app.data.processing.predictive_models import ModelVersion
+from app.data.processing.predictive_models import features
+from app.data.processing.predictive_models import reaches
+from app.data.processing.predictive_models import v3
+from app.data.processing.predictive_models import v4
+from app.data.processing.predictive_models.rolling import RollingSums
+from app.data.processing.upstream_async import AsyncUpstreamClient
+from app.data.processing.upstream_async import get_live_hobolink_data_async
+from app.data.processing.upstream_async import get_live_usgs_data_for_sites_async
+from app.data.processing.upstream_cache import get_upstream_cache
+from app.data.processing.upstream_client import UpstreamClient
 from app.data.processing.usgs import get_live_usgs_data
+from app.data.processing.usgs import get_live_usgs_data_for_sites
+from app.data.processing.usgs import parse_usgs_data
+from app.mail import mail
 
 
 STATIC_RESOURCES = os.path.join(os.path.dirname(__file__), "resources")
@@ -23,6 +67,380 @@ def test_hobolink_data_is_recent(live_app):
         assert time_difference < pd.Timedelta(hours=2)
 
 
+@pytest.fixture(autouse=True)
+def hobolink_window_size():
+    """Forget the HOBOlink window size learned by other tests."""
+    with patch.dict(hobolink._readings_per_second, clear=True):
+        yield
+
+
+class _FakeHobolinkResponse:
+    """Response with one reading, timestamped at the start of the window.
+
+    If `every` is set, there is instead one reading every `every` from the
+    start to the end of the window.
+    """
+
+    status_code = 200
+
+    def __init__(self, params, every=None):
+        self.params = params
+        self.every = every
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        timestamps = [self.params["start_date_time"]]
+        if self.every is not None:
+            timestamps = pd.date_range(
+                self.params["start_date_time"], self.params["end_date_time"], freq=self.every
+            ).strftime("%Y-%m-%d %H:%M:%SZ")
+        readings = [
+            {
+                "timestamp": timestamp,
+                "sensor_sn": "1-1",
+                "sensor_measurement_type": "Rain",
+                "value": 0,
+            }
+            for timestamp in timestamps
+        ]
+        body = json.dumps({"data": readings}).encode()
+        # Send it in a few pieces to make sure the streaming decode works.
+        return (body[i : i + 10] for i in range(0, len(body), 10))
+
+
+def test_hobolink_windows_are_reassembled_in_order(app):
+    start_date = datetime(2025, 1, 1, tzinfo=UTC)
+    end_date = start_date + timedelta(days=25)
+
+    def fake_get(self, url, params=None, **kwargs):
+        return _FakeHobolinkResponse(params)
+
+    with patch.object(requests.Session, "get", fake_get):
+        data = request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+
+    # Windows are aligned to a grid of 10 days since the Unix epoch.
+    assert list(data.timestamps) == [
+        "2024-12-23 00:00:00",
+        "2025-01-02 00:00:00",
+        "2025-01-12 00:00:00",
+        "2025-01-22 00:00:00",
+    ]
+    df = parse_hobolink_data(data, exclude_sensors=["0-0"])
+    assert df["rain"].tolist() == [0, 0, 0, 0]
+
+
+def test_iter_json_array_across_chunks():
+    body = json.dumps({"message": "", "data": [{"x": i, "y": "]}"} for i in range(50)]}).encode()
+    chunks = [body[i : i + 3] for i in range(0, len(body), 3)]
+    assert list(iter_json_array(chunks, key="data")) == json.loads(body)["data"]
+
+
+def test_hobolink_retries_only_the_failed_window(app):
+    start_date = datetime(2025, 1, 1, tzinfo=UTC)
+    end_date = start_date + timedelta(days=30)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        window_start = params["start_date_time"]
+        requested.append(window_start)
+        # The second window fails the first time it is requested.
+        if window_start == "2025-01-02 00:00:00" and requested.count(window_start) == 1:
+            raise requests.ConnectionError
+        return _FakeHobolinkResponse(params)
+
+    with patch.object(requests.Session, "get", fake_get):
+        data = request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+
+    assert len(data) == 4
+    assert sorted(requested) == [
+        "2024-12-23 00:00:00",
+        "2025-01-02 00:00:00",
+        "2025-01-02 00:00:00",
+        "2025-01-12 00:00:00",
+        "2025-01-22 00:00:00",
+    ]
+
+
+def test_hobolink_resumes_from_the_windows_that_came_back(app, monkeypatch):
+    monkeypatch.setitem(app.config, "USE_MOCK_DATA", False)
+    start_date = datetime(2025, 1, 2, tzinfo=UTC)
+    end_date = start_date + timedelta(days=20) - timedelta(seconds=1)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        window_start = params["start_date_time"]
+        requested.append(window_start)
+        # The second window fails more times than it is retried on its own.
+        if window_start == "2025-01-12 00:00:00" and requested.count(window_start) <= 3:
+            raise requests.ConnectionError
+        return _FakeHobolinkResponse(params, every="10D")
+
+    with patch.object(requests.Session, "get", fake_get):
+        df = get_live_hobolink_data(start_date=start_date, end_date=end_date)
+
+    assert len(df) == 2
+    assert sorted(requested) == ["2025-01-02 00:00:00"] + ["2025-01-12 00:00:00"] * 4
+
+
+def test_hobolink_empty_response(app, monkeypatch):
+    monkeypatch.setitem(app.config, "USE_MOCK_DATA", False)
+
+    class _EmptyResponse(_FakeHobolinkResponse):
+        def iter_content(self, chunk_size=1):
+            return iter([b'{"data": []}'])
+
+    with patch.object(requests.Session, "get", lambda self, url, **kwargs: _EmptyResponse(None)):
+        df = get_live_hobolink_data(days_ago=1)
+
+    assert df.empty
+    assert str(df["time"].dtype) == "datetime64[ns, UTC]"
+
+
+def test_hobolink_past_windows_are_cached(app):
+    start_date = datetime(2025, 1, 1, tzinfo=UTC)
+    end_date = start_date + timedelta(days=25)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append(params["start_date_time"])
+        return _FakeHobolinkResponse(params)
+
+    with (
+        patch.object(hobolink, "HOBOLINK_WINDOW_SIZES", [timedelta(days=10)]),
+        patch.object(requests.Session, "get", fake_get),
+    ):
+        first = request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+        second = request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+
+    # Every window is in the past, so the second call is served from the cache.
+    assert len(requested) == 4
+    assert list(first.timestamps) == list(second.timestamps)
+
+    cache = get_upstream_cache()
+    assert len(cache.entries()) == 4
+    assert cache.prune(max_bytes=0) == 4
+    assert cache.entries() == []
+
+
+def test_upstream_cache_tolerates_concurrent_eviction(app):
+    cache = get_upstream_cache()
+    start = datetime(2025, 1, 1, tzinfo=UTC)
+    end = start + timedelta(days=1)
+    with cache.write("hobolink", "abc", start, end) as write:
+        write(b"body")
+
+    # Another worker evicts the body between opening it and marking it used.
+    with patch.object(upstream_cache.os, "utime", side_effect=FileNotFoundError):
+        assert cache.read("hobolink", "abc", start, end) is None
+    assert b"".join(cache.read("hobolink", "abc", start, end)) == b"body"
+
+    # Another worker deletes a body between listing and pruning it.
+    listdir = upstream_cache._listdir
+    with patch.object(
+        upstream_cache, "_listdir", lambda path: listdir(path) + ["gone.gz", "gone.json"]
+    ):
+        assert cache.prune(max_bytes=0) == 1
+    assert cache.entries() == []
+
+
+def test_hobolink_open_window_starts_at_start_date(app):
+    end_date = datetime.now(UTC).replace(microsecond=0)
+    start_date = end_date - timedelta(hours=2)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append((params["start_date_time"], params["end_date_time"]))
+        return _FakeHobolinkResponse(params)
+
+    with patch.object(requests.Session, "get", fake_get):
+        request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+
+    # The window isn't closed yet, so it isn't cached and there is no point in
+    # requesting it from the start of the grid.
+    fmt = "%Y-%m-%d %H:%M:%S"
+    assert requested == [(start_date.strftime(fmt), end_date.strftime(fmt))]
+    assert get_upstream_cache().entries() == []
+
+
+def test_hobolink_windows_that_hit_the_limit_are_split(app):
+    start_date = datetime(2025, 1, 2, tzinfo=UTC)
+    end_date = start_date + timedelta(days=20) - timedelta(seconds=1)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append((params["start_date_time"], params["end_date_time"]))
+        return _FakeHobolinkResponse(params, every="1D")
+
+    # One reading a day, so 10-day windows hit the limit but 5-day windows don't.
+    with (
+        patch.object(hobolink, "HOBOLINK_MAX_RESULTS", 8),
+        patch.object(requests.Session, "get", fake_get),
+    ):
+        data = request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+        assert len(data) == 20
+        assert len(set(data.timestamps)) == 20
+        assert sorted(requested) == [
+            ("2025-01-02 00:00:00", "2025-01-06 23:59:59"),
+            ("2025-01-02 00:00:00", "2025-01-11 23:59:59"),
+            ("2025-01-07 00:00:00", "2025-01-11 23:59:59"),
+            ("2025-01-12 00:00:00", "2025-01-16 23:59:59"),
+            ("2025-01-12 00:00:00", "2025-01-21 23:59:59"),
+            ("2025-01-17 00:00:00", "2025-01-21 23:59:59"),
+        ]
+        # The cut off responses are not kept in the cache.
+        assert len(get_upstream_cache().entries()) == 4
+
+        # Next time, the windows are small enough from the start.
+        requested.clear()
+        data = request_to_hobolink(
+            start_date=datetime(2025, 2, 1, tzinfo=UTC),
+            end_date=datetime(2025, 2, 5, 23, 59, 59, tzinfo=UTC),
+            token="abc",
+        )
+        assert sorted(requested) == [
+            ("2025-02-01 00:00:00", "2025-02-03 11:59:59"),
+            ("2025-02-03 12:00:00", "2025-02-05 23:59:59"),
+        ]
+
+
+def test_hobolink_window_size_is_capped_at_the_date_range(app):
+    start_date = datetime(2025, 1, 30, tzinfo=UTC)
+    end_date = datetime(2025, 2, 2, 23, 59, 59, tzinfo=UTC)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append((params["start_date_time"], params["end_date_time"]))
+        return _FakeHobolinkResponse(params)
+
+    # So few readings that even the largest windows would fit.
+    hobolink._readings_per_second[app.config["HOBOLINK_LOGGERS"]] = 1e-6
+    with patch.object(requests.Session, "get", fake_get):
+        request_to_hobolink(start_date=start_date, end_date=end_date, token="abc")
+
+    # 2.5 day windows, rather than an 80 day window that starts in December.
+    assert sorted(requested) == [
+        ("2025-01-29 12:00:00", "2025-01-31 23:59:59"),
+        ("2025-02-01 00:00:00", "2025-02-02 23:59:59"),
+    ]
+
+
+def test_parse_hobolink_data_matches_pivot():
+    data = [
+        {
+            "timestamp": f"2025-01-01 00:{minute:02d}:00Z",
+            "sensor_sn": sensor_sn,
+            "sensor_measurement_type": measurement_type,
+            "value": minute + i,
+        }
+        # Readings don't come back sorted by time or by sensor.
+        for minute in [10, 0, 5]
+        for i, (sensor_sn, measurement_type) in enumerate(
+            [("2-1", "Wind Speed"), ("1-1", "Rain"), ("3-1", "Battery"), ("1-2", "RH")]
+        )
+        if not (minute == 5 and measurement_type == "RH")
+    ]
+
+    df_expected = pd.DataFrame(data)
+    df_expected = df_expected.loc[df_expected["sensor_sn"] != "3-1"]
+    df_expected["time"] = pd.to_datetime(df_expected["timestamp"])
+    df_expected["sensor_measurement_type"] = (
+        df_expected["sensor_measurement_type"].str.lower().str.replace(" ", "_")
+    )
+    df_expected = df_expected.pivot(
+        index="time", columns="sensor_measurement_type", values="value"
+    ).reset_index()
+
+    df = parse_hobolink_data(data, exclude_sensors=["3-1"])
+    pd.testing.assert_frame_equal(df, df_expected, check_dtype=False)
+
+
+def test_parse_usgs_data():
+    res = "\n".join(
+        [
+            "# Data provided for site 01104500",
+            "agency_cd\tsite_no\tdatetime\ttz_cd\t66190_00060\t66190_00060_cd"
+            "\t66191_00065\t66191_00065_cd",
+            "5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s",
+            # The hour from 1 AM to 2 AM happens twice when daylight saving time ends.
+            "USGS\t01104500\t2024-11-03 01:45\tEDT\t123\tP\t4.50\tP",
+            "USGS\t01104500\t2024-11-03 01:00\tEST\tIce\tP\t\tP",
+            "USGS\t01104500\t2024-11-03 01:15\tEST\t125\tP\t4.70\tP",
+            "",
+        ]
+    )
+    df = parse_usgs_data(res, site_no="01104500")
+
+    df_expected = pd.DataFrame(
+        {
+            "time": pd.to_datetime(
+                ["2024-11-03 05:45", "2024-11-03 06:00", "2024-11-03 06:15"], utc=True
+            ),
+            "stream_flow": [123.0, None, 125.0],
+            "gage_height": [4.5, None, 4.7],
+        }
+    )
+    pd.testing.assert_frame_equal(df, df_expected)
+
+
+def test_parse_usgs_data_without_a_table():
+    df = parse_usgs_data("# No sites found matching all criteria\n", site_no="01104683")
+    assert df.empty
+    assert list(df.columns) == ["time", "gage_height"]
+
+
+USGS_TWO_SITE_RESPONSE = "\n".join(
+    [
+        "# Data provided for site 01104500",
+        "agency_cd\tsite_no\tdatetime\ttz_cd\t66190_00060\t66190_00060_cd"
+        "\t66191_00065\t66191_00065_cd",
+        "5s\t15s\t20d\t6s\t14n\t10s\t14n\t10s",
+        "USGS\t01104500\t2025-01-01 00:00\tEST\t123\tP\t4.50\tP",
+        "USGS\t01104500\t2025-01-01 00:15\tEST\t125\tP\t4.70\tP",
+        "#",
+        "# Data provided for site 01104683",
+        "agency_cd\tsite_no\tdatetime\ttz_cd\t66196_00065\t66196_00065_cd",
+        "5s\t15s\t20d\t6s\t14n\t10s",
+        "USGS\t01104683\t2025-01-01 00:00\tEST\t2.10\tP",
+        "",
+    ]
+)
+
+
+def test_parse_usgs_data_for_two_sites():
+    df_w = parse_usgs_data(USGS_TWO_SITE_RESPONSE, site_no="01104500")
+    df_b = parse_usgs_data(USGS_TWO_SITE_RESPONSE, site_no="01104683")
+
+    assert df_w["stream_flow"].tolist() == [123.0, 125.0]
+    assert df_w["gage_height"].tolist() == [4.5, 4.7]
+    assert df_b["time"].tolist() == [pd.Timestamp("2025-01-01 05:00", tz="UTC")]
+    assert df_b["gage_height"].tolist() == [2.1]
+
+
+def test_usgs_sites_are_fetched_in_one_request(live_app):
+    live_app.config["UPSTREAM_CACHE_DIR"] = ""
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append(params["sites"])
+        res = requests.models.Response()
+        res.status_code = 200
+        res._content = USGS_TWO_SITE_RESPONSE.encode()
+        res.encoding = "utf-8"
+        return res
+
+    with patch.object(requests.Session, "get", fake_get):
+        data = get_live_usgs_data_for_sites(site_nos=["01104500", "01104683"])
+
+    assert requested == ["01104500,01104683"]
+    assert len(data["01104500"]) == 2
+    assert len(data["01104683"]) == 1
+
+
 def test_usgs_w_data_is_recent(live_app):
     with live_app.app_context():
         df = get_live_usgs_data(site_no="01104500")
@@ -55,3 +473,889 @@ def test_boathouse_trigger(db_session):
     after = db_session.execute(text("""SELECT * FROM override_history;"""))
 
     assert number_of_rows(after) == number_of_rows(before) + 1
+
+
+@pytest.mark.parametrize(
+    ("table_name", "source", "key"),
+    [
+        ("hobolink", "hobolink", None),
+        ("usgs_w", "usgs", "01104500"),
+        ("usgs_b", "usgs", "01104683"),
+    ],
+)
+def test_update_db_only_appends_new_data(app, db_session, table_name, source, key):
+    key = key or app.config["HOBOLINK_LOGGERS"]
+    update_db()
+    df_before = execute_sql(f"SELECT * FROM {table_name} ORDER BY time;")
+    last_timestamp = IngestionState.get_last_timestamp(source, key)
+    assert last_timestamp == df_before["time"].max()
+
+    update_db()
+
+    df_after = execute_sql(f"SELECT * FROM {table_name} ORDER BY time;")
+    pd.testing.assert_frame_equal(df_before, df_after)
+
+
+def test_write_to_db_upserts_on_natural_key(app, db_session):
+    df = pd.DataFrame(
+        {
+            "time": pd.date_range("2025-01-01", periods=4, freq="h", tz="UTC"),
+            "stream_flow": [1.0, 2.0, 3.0, 4.0],
+            "gage_height": [0.5, None, 0.5, 0.5],
+            "ignored": ["a", "b", "c", "d"],
+        }
+    )
+    core._write_to_db(df.iloc[:3], "usgs_w")
+
+    df.loc[2, "stream_flow"] = 30.0
+    stats = core._write_to_db(df.iloc[1:], "usgs_w", since=df.loc[2, "time"])
+    assert stats.rows == 2
+    assert stats.bytes > 0
+
+    df_stored = core._read_from_db("usgs_w")
+    pd.testing.assert_frame_equal(df_stored, df.iloc[1:, :3].reset_index(drop=True))
+
+
+def test_update_db_keeps_prediction_primary_key(app, db_session):
+    update_db()
+    pk = inspect(db_session.connection()).get_pk_constraint("prediction")
+    assert pk["constrained_columns"] == ["model_version", "reach_id", "time"]
+
+
+def test_update_db_writes_all_tables_or_none(app, db_session):
+    update_db()
+    tables = ["usgs_w", "hobolink", "processed_data", "prediction", "ingestion_state"]
+    before = {i: execute_sql(f"SELECT * FROM {i};") for i in tables}
+
+    copy_upsert = core.copy_upsert
+
+    def fail_on_prediction(conn, df, table):
+        if table.name == "prediction":
+            raise RuntimeError("Lost the connection.")
+        # Make sure there's something new to roll back.
+        df = df.assign(time=df["time"] + timedelta(hours=1))
+        return copy_upsert(conn, df, table)
+
+    # The test database connection is already in a transaction, so the session
+    # only rolls back what it wrote if it is working inside a savepoint.
+    db.engine.begin_nested()
+    with (
+        patch.object(core, "copy_upsert", fail_on_prediction),
+        patch.object(mail, "send"),
+        pytest.raises(RuntimeError),
+    ):
+        update_db()
+
+    for i in tables:
+        pd.testing.assert_frame_equal(execute_sql(f"SELECT * FROM {i};"), before[i])
+
+
+def test_feature_specs_computed_in_one_pass(app):
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = core._get_source_data()
+    mods = [i.get_module() for i in ModelVersion]
+
+    dfs = features.process_data(
+        [mod.FEATURES for mod in mods],
+        df_hobolink=df_hobolink,
+        df_usgs_w=df_usgs_w,
+        df_usgs_b=df_usgs_b,
+    )
+
+    assert len(dfs) == len(mods)
+    for mod, df in zip(mods, dfs):
+        pd.testing.assert_frame_equal(
+            df,
+            mod.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b),
+            check_exact=True,
+        )
+
+
+def test_feature_spec_matches_pandas():
+    times = pd.date_range("2025-04-01", periods=6 * 30, freq="10min", tz="UTC")
+    df_hobolink = pd.DataFrame(
+        {"time": times, "rain": [0.05 if i % 40 < 3 else 0.0 for i in range(len(times))]}
+    )
+    df_usgs_w = pd.DataFrame(
+        {"time": times[::2], "stream_flow": [0.5 + i for i in range(len(times[::2]))]}
+    )
+    spec = features.FeatureSpec(
+        hourly=(
+            features.Hourly("rain", "hobolink", "rain", agg="sum"),
+            features.Hourly("log_flow", "usgs_w", "stream_flow", transform="log"),
+        ),
+        features=(
+            features.Window("rain_3h", "rain", 3, "sum"),
+            features.WindowSum("rain_3h_to_6h", "rain", 3, 6),
+            features.Window("flow_4h", "log_flow", 4, "exp_mean"),
+            features.DaysSince(
+                "days_since_rain", "rain_3h", threshold=0.1, last="last_rain", flag="rained"
+            ),
+        ),
+        required=("rain", "log_flow"),
+    )
+
+    (df,) = features.process_data(
+        [spec], df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=pd.DataFrame()
+    )
+
+    hourly_rain = df_hobolink.groupby(df_hobolink["time"].dt.floor("h"))["rain"].sum()
+    log_flow = pd.Series(np.log(np.maximum(df_usgs_w["stream_flow"], 1)))
+    hourly_flow = log_flow.groupby(df_usgs_w["time"].dt.floor("h")).mean()
+    assert df["time"].tolist() == hourly_rain.index.tolist()
+    assert df["rain"].tolist() == hourly_rain.tolist()
+    assert df["log_flow"].tolist() == hourly_flow.tolist()
+    pd.testing.assert_series_equal(
+        df["rain_3h_to_6h"],
+        df["rain"].rolling(6).sum() - df["rain"].rolling(3).sum(),
+        check_names=False,
+    )
+    pd.testing.assert_series_equal(
+        df["flow_4h"], np.exp(df["log_flow"].rolling(4).mean()), check_names=False
+    )
+    pd.testing.assert_series_equal(df["rain_3h"], df["rain"].rolling(3).sum(), check_names=False)
+    rained = df["rain_3h"] >= 0.1
+    assert df["rained"].tolist() == rained.tolist()
+    last_rain = df["time"].where(rained).ffill().fillna(df["time"].min())
+    assert df["last_rain"].tolist() == last_rain.tolist()
+    assert (
+        df["days_since_rain"].tolist()
+        == ((df["time"] - last_rain).dt.total_seconds() / 60 / 60 / 24).tolist()
+    )
+    assert spec.window_hours == 6
+
+
+@pytest.mark.parametrize("min_periods", [None, 0, 1, 5])
+def test_rolling_sums_match_pandas(min_periods):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=500)
+    values[rng.random(500) < 0.3] = 0.0
+    values[rng.random(500) < 0.05] = np.nan
+    values[rng.random(500) < 0.02] = np.inf
+    rolling_sums = RollingSums(values, max_window=48)
+
+    for window in [5, 12, 24, 48]:
+        expected = pd.Series(values).rolling(window, min_periods=min_periods)
+        np.testing.assert_allclose(
+            rolling_sums.sum(window, min_periods=min_periods), expected.sum(), atol=1e-12
+        )
+        np.testing.assert_allclose(
+            rolling_sums.mean(window, min_periods=min_periods), expected.mean(), atol=1e-12
+        )
+
+    with pytest.raises(ValueError):
+        rolling_sums.sum(49)
+
+
+def test_rolling_sums_of_zeros_are_exact():
+    # Years of rain followed by a dry spell, which should sum to exactly 0.
+    values = np.r_[np.full(24 * 365 * 3, 0.01), np.zeros(200)]
+
+    sums = RollingSums(values, max_window=168).sum(24)
+
+    assert (sums[-176:] == 0).all()
+
+
+@pytest.mark.parametrize("model_version", list(ModelVersion))
+@pytest.mark.parametrize("rows", [None, 24])
+def test_reach_models_match_each_reach(app, model_version, rows):
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = core._get_source_data()
+    mod = model_version.get_module()
+    df = mod.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    reach_models = mod.REACH_MODELS
+
+    # Score each reach on its own, like the models used to.
+    expected = []
+    for reach in reach_models.reaches:
+        df_reach = df.copy() if rows is None else df.tail(n=rows).copy()
+        z = reach.intercept
+        for feature, coefficient in reach.coefficients.items():
+            z = z + coefficient * df_reach[feature]
+        if reach.link == "logistic":
+            df_reach["probability"] = 1 / (1 + np.exp(-z))
+            df_reach["safe"] = df_reach["probability"] <= reach.threshold
+        else:
+            df_reach["predicted_ecoli_cfu_100ml"] = np.exp(z)
+            df_reach["safe"] = df_reach["predicted_ecoli_cfu_100ml"] < reach.threshold
+        df_reach["reach_id"] = reach.reach_id
+        expected.append(df_reach[["reach_id", "time", reach_models.output, "safe"]])
+    df_expected = pd.concat(expected).sort_values(["reach_id", "time"])
+    df_expected = df_expected.loc[df_expected[reach_models.output].notna(), :]
+
+    pd.testing.assert_frame_equal(mod.all_models(df, rows=rows), df_expected, rtol=1e-12)
+
+
+def test_reach_models_missing_feature():
+    reach_models = reaches.ReachModels(
+        reaches.Reach(reach_id=2, intercept=1.0, coefficients={"a": 1.0}, link="exp", threshold=5),
+        reaches.Reach(reach_id=3, intercept=0.0, coefficients={"b": 2.0}, link="exp", threshold=5),
+    )
+    df = pd.DataFrame(
+        {
+            "time": pd.date_range("2025-04-01", periods=3, freq="h", tz="UTC"),
+            "a": [0.0, np.nan, 1.0],
+            "b": [1.0, 1.0, 0.5],
+        }
+    )
+
+    df_predictions = reach_models.predict(df)
+
+    # Only the reach that uses the missing feature is missing that hour.
+    assert df_predictions["reach_id"].tolist() == [2, 2, 3, 3, 3]
+    assert df_predictions.index.tolist() == [0, 2, 0, 1, 2]
+    np.testing.assert_allclose(
+        df_predictions["predicted_ecoli_cfu_100ml"], np.exp([1.0, 2.0, 2.0, 2.0, 1.0])
+    )
+    assert df_predictions["safe"].tolist() == [True, False, False, False, True]
+
+    with pytest.raises(ValueError):
+        reaches.ReachModels(
+            reaches.Reach(2, intercept=0.0, coefficients={"a": 1.0}, link="exp", threshold=5),
+            reaches.Reach(3, intercept=0.0, coefficients={"a": 1.0}, link="logistic", threshold=5),
+        )
+
+
+@pytest.mark.parametrize("new_hours", [1, 5, 71, 72, 300])
+def test_incremental_features_match_full_recompute(app, new_hours):
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = core._get_source_data()
+    df_full = v4.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    df_full = df_full.drop(columns="index")
+    since = df_full["time"].iloc[-new_hours]
+
+    df = v4.process_data_incremental(
+        df_hobolink=df_hobolink,
+        df_usgs_w=df_usgs_w,
+        df_usgs_b=df_usgs_b,
+        df_processed=df_full.loc[df_full["time"] < since],
+        since=since,
+    )
+
+    pd.testing.assert_frame_equal(
+        df.reset_index(drop=True),
+        df_full.loc[df_full["time"] >= since].reset_index(drop=True),
+        check_exact=False,
+    )
+
+
+def test_incremental_features_with_no_rain_in_window(app):
+    # The days since the last rain are counted from the start of the data when
+    # it hasn't rained at all, even if it rained before the data starts.
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = core._get_source_data()
+    start = df_hobolink["time"].min() + timedelta(days=5)
+    df_hobolink = df_hobolink.copy()
+    df_hobolink.loc[df_hobolink["time"] >= start - timedelta(days=2), "rain"] = 0.0
+    df_old = v4.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+
+    df_hobolink = df_hobolink.loc[df_hobolink["time"] >= start]
+    df_usgs_w = df_usgs_w.loc[df_usgs_w["time"] >= start]
+    df_usgs_b = df_usgs_b.loc[df_usgs_b["time"] >= start]
+    df_full = v4.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    since = df_full["time"].iloc[-24]
+
+    df = v4.process_data_incremental(
+        df_hobolink=df_hobolink,
+        df_usgs_w=df_usgs_w,
+        df_usgs_b=df_usgs_b,
+        df_processed=df_old.loc[df_old["time"] < since],
+        since=since,
+    )
+
+    pd.testing.assert_series_equal(
+        df["days_since_last_rain"].reset_index(drop=True),
+        df_full.loc[df_full["time"] >= since, "days_since_last_rain"].reset_index(drop=True),
+    )
+
+
+def test_update_db_processes_data_incrementally(app, db_session):
+    update_db()
+    with patch.object(v4, "process_data", wraps=v4.process_data) as mocked:
+        update_db()
+    mocked.assert_not_called()
+
+    # The raw data tables only keep the last `STORAGE_HOURS`, but the processed
+    # data still matches processing all of the source data.
+    df_stored = core._read_from_db("processed_data")
+    df_usgs_w, df_usgs_b, df_hobolink, *_ = core._get_source_data()
+    df_full = v4.process_data(df_hobolink=df_hobolink, df_usgs_w=df_usgs_w, df_usgs_b=df_usgs_b)
+    pd.testing.assert_frame_equal(
+        df_stored, df_full[df_stored.columns].reset_index(drop=True), check_exact=False
+    )
+
+
+def test_update_db_keeps_storage_hours_of_raw_data(app, db_session):
+    update_db()
+    update_db()
+
+    hours = timedelta(hours=app.config["STORAGE_HOURS"])
+    for table_name in ["hobolink", "usgs_w", "usgs_b"]:
+        df = core._read_from_db(table_name)
+        assert df["time"].min() >= df["time"].max() - hours
+
+    # The processed data still goes back the whole lookback period.
+    df_processed = core._read_from_db("processed_data")
+    assert df_processed["time"].min() < df_processed["time"].max() - timedelta(days=20)
+
+
+def test_update_db_only_scores_new_hours(app, db_session):
+    update_db()
+    stats = update_db()
+
+    # Only the last few hours are refetched, for each of the 4 reaches.
+    assert 0 < stats["prediction"].rows <= 4 * 4
+
+    df_stored = execute_sql(
+        "SELECT reach_id, time, predicted_ecoli_cfu_100ml, safe"
+        " FROM prediction"
+        " ORDER BY reach_id, time;"
+    )
+    df_full = v4.all_models(core._read_from_db("processed_data"))
+    pd.testing.assert_frame_equal(
+        df_stored.astype({"predicted_ecoli_cfu_100ml": float}),
+        df_full.reset_index(drop=True),
+        check_exact=False,
+        check_dtype=False,
+    )
+
+
+def test_update_db_stores_shadow_model_versions(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "SHADOW_MODEL_VERSIONS", ["v2", "v3"])
+    update_db()
+    update_db()
+
+    df_stored = execute_sql(
+        "SELECT reach_id, time, probability, safe"
+        " FROM prediction"
+        " WHERE model_version = 'v3'"
+        " ORDER BY reach_id, time;"
+    )
+    # The second update is incremental, but v3's features still get the whole
+    # lookback period rather than just the stored raw data.
+    source_data = core._get_source_data()
+    df_full = v3.all_models(
+        v3.process_data(
+            df_hobolink=source_data.df_hobolink,
+            df_usgs_w=source_data.df_usgs_w,
+            df_usgs_b=source_data.df_usgs_b,
+        )
+    )
+    df_full = df_full.loc[df_full["time"] >= df_stored["time"].min()]
+    pd.testing.assert_frame_equal(
+        df_stored.astype({"probability": float}),
+        df_full.sort_values(["reach_id", "time"]).reset_index(drop=True),
+        check_exact=False,
+        check_dtype=False,
+    )
+
+    # The website only shows the default model version.
+    reach = db_session.query(Reach).filter(Reach.id == 2).one()
+    assert {p.model_version for p in reach.predictions} == {"v4"}
+    # v2 predicts E. coli counts rather than probabilities.
+    assert len(reach.predictions_last_x_hours(x=24, model_version="v2")) == 24
+    v3_predictions = reach.predictions_last_x_hours(x=24, model_version="v3")
+    assert len(v3_predictions) == 24
+    assert all(p.probability is not None for p in v3_predictions)
+
+
+def test_update_db_records_pipeline_run(app, db_session):
+    stats = update_db()
+
+    run = PipelineRun.get_recent(limit=1)[0]
+    assert run.succeeded
+    stages = {i["stage"]: i for i in run.stages}
+    for stage in [
+        "read_stored",
+        "fetch_usgs",
+        "fetch_hobolink",
+        "process_data",
+        "all_models",
+        "write:processed_data",
+        "write:prediction",
+        "commit",
+        "cache_clear",
+    ]:
+        assert stages[stage]["seconds"] >= 0
+    assert stages["write:prediction"]["rows"] == stats["prediction"].rows
+    assert stages["write:prediction"]["bytes"] == stats["prediction"].bytes
+    assert sum(i["seconds"] for i in run.stages) <= run.seconds * 1.01
+
+
+def test_failed_update_db_records_pipeline_run(app, db_session):
+    with (
+        patch.object(core, "copy_upsert", side_effect=RuntimeError("Lost the connection.")),
+        patch.object(mail, "send"),
+        pytest.raises(RuntimeError),
+    ):
+        update_db()
+
+    run = PipelineRun.get_recent(limit=1)[0]
+    assert not run.succeeded
+    assert "cache_clear" in {i["stage"] for i in run.stages}
+
+
+def test_pipeline_run_history_is_pruned(app, db_session, monkeypatch):
+    monkeypatch.setitem(app.config, "PIPELINE_RUN_HISTORY", 2)
+    for _ in range(3):
+        with record_pipeline_run():
+            pass
+    assert db_session.query(PipelineRun).count() == 2
+
+
+def test_update_db_skips_unchanged_inputs(app, db_session, monkeypatch):
+    update_db()
+    monkeypatch.setitem(app.config, "SKIP_UNCHANGED_UPDATES", True)
+    with (
+        patch.object(core, "copy_upsert") as mocked_copy_upsert,
+        patch.object(core.cache, "clear") as mocked_clear,
+        patch.object(v4, "all_models") as mocked_all_models,
+    ):
+        stats = update_db()
+
+    assert stats == {}
+    mocked_copy_upsert.assert_not_called()
+    mocked_clear.assert_not_called()
+    mocked_all_models.assert_not_called()
+
+    skipped, last = PipelineRun.get_recent(limit=2)
+    assert skipped.succeeded
+    assert skipped.skipped
+    assert skipped.input_hash == last.input_hash
+    assert not last.skipped
+
+
+def test_update_db_does_not_skip_changed_inputs(app, db_session, monkeypatch):
+    update_db()
+    monkeypatch.setitem(app.config, "SKIP_UNCHANGED_UPDATES", True)
+
+    def get_new_hobolink_data(*args, **kwargs):
+        df = get_live_hobolink_data(*args, **kwargs)
+        df.loc[df.index[-1], "rain"] += 0.1
+        return df
+
+    with patch.object(core, "get_live_hobolink_data", get_new_hobolink_data):
+        stats = update_db()
+    assert stats["prediction"].rows > 0
+    assert not PipelineRun.get_recent(limit=1)[0].skipped
+
+    # Running a new model version on the same data isn't skipped either.
+    monkeypatch.setitem(app.config, "SHADOW_MODEL_VERSIONS", ["v3"])
+    with patch.object(core, "get_live_hobolink_data", get_new_hobolink_data):
+        stats = update_db()
+    assert stats["prediction"].rows > 0
+
+
+def test_backfill_chunks_cover_the_range():
+    start = datetime(2025, 4, 1, tzinfo=UTC)
+    chunks = get_backfill_chunks(start, start + timedelta(days=10), chunk_days=4)
+    assert [(i.start.day, i.end.day) for i in chunks] == [(1, 5), (5, 9), (9, 11)]
+    assert chunks[1].fetch_start == chunks[1].start - BACKFILL_OVERLAP
+
+
+def test_backfill_matches_predictions_over_the_whole_range(app, db_session):
+    start = datetime(2025, 4, 1, tzinfo=UTC)
+    end = datetime(2025, 4, 18, tzinfo=UTC)
+    progress = []
+    rows = backfill(
+        start, end, ModelVersion.v4, chunk_days=3, max_workers=2, on_progress=progress.append
+    )
+
+    assert [i.chunks_done for i in progress] == [1, 2, 3, 4, 5, 6]
+    assert sum(i.rows for i in progress) == rows == 17 * 24 * 4
+
+    df_stored = execute_sql(
+        "SELECT reach_id, time, predicted_ecoli_cfu_100ml, safe"
+        " FROM prediction_backfill"
+        " WHERE model_version = 'v4'"
+        " ORDER BY reach_id, time;"
+    )
+    df_hobolink = core.get_live_hobolink_data()
+    usgs = core.get_live_usgs_data_for_sites(site_nos=["01104500", "01104683"])
+    df_full = v4.all_models(
+        v4.process_data(
+            df_hobolink=df_hobolink, df_usgs_w=usgs["01104500"], df_usgs_b=usgs["01104683"]
+        )
+    )
+    df_full = df_full.loc[(df_full["time"] >= start) & (df_full["time"] < end)]
+    pd.testing.assert_frame_equal(
+        df_stored.astype({"predicted_ecoli_cfu_100ml": float}),
+        df_full.sort_values(["reach_id", "time"]).reset_index(drop=True),
+        check_exact=False,
+        check_dtype=False,
+    )
+
+    # Backfilling the same range again replaces the first backfill.
+    backfill(start, start + timedelta(days=1), ModelVersion.v4, max_workers=1)
+    assert len(execute_sql("SELECT * FROM prediction_backfill;")) == rows
+
+
+def test_backfill_days_since_last_rain_across_chunks(app, db_session):
+    # No rain after the 25th, so by the end of the range the last rain is far
+    # longer ago than the rolling windows of the features.
+    df_hobolink = core.get_live_hobolink_data()
+    dry = df_hobolink["time"] >= datetime(2025, 3, 25, tzinfo=UTC)
+    df_hobolink.loc[dry, "rain"] = 0.0
+    usgs = core.get_live_usgs_data_for_sites(site_nos=["01104500", "01104683"])
+
+    start = datetime(2025, 4, 1, tzinfo=UTC)
+    end = datetime(2025, 4, 18, tzinfo=UTC)
+    with patch("app.data.processing.backfill.get_live_hobolink_data", return_value=df_hobolink):
+        backfill(start, end, ModelVersion.v4, chunk_days=3, max_workers=2)
+
+    df_stored = execute_sql(
+        "SELECT reach_id, time, predicted_ecoli_cfu_100ml, safe"
+        " FROM prediction_backfill"
+        " WHERE model_version = 'v4'"
+        " ORDER BY reach_id, time;"
+    )
+    df_processed = v4.process_data(
+        df_hobolink=df_hobolink, df_usgs_w=usgs["01104500"], df_usgs_b=usgs["01104683"]
+    )
+    df_processed = df_processed.loc[df_processed["time"] >= start]
+    assert df_processed["days_since_last_rain"].max() > 20
+    df_full = v4.all_models(df_processed)
+    df_full = df_full.loc[df_full["time"] < end]
+    pd.testing.assert_frame_equal(
+        df_stored.astype({"predicted_ecoli_cfu_100ml": float}),
+        df_full.sort_values(["reach_id", "time"]).reset_index(drop=True),
+        check_exact=False,
+        check_dtype=False,
+    )
+
+
+def test_summarize_stage_timings_flags_regressions():
+    start = datetime(2026, 6, 1, tzinfo=UTC)
+    runs = [
+        PipelineRun(
+            id=i,
+            started_at=start + timedelta(hours=i),
+            seconds=10,
+            succeeded=True,
+            stages=[
+                {
+                    "stage": "fetch_usgs",
+                    "seconds": 4.0 if i >= 15 else 1.0,
+                    "rows": 4,
+                    "bytes": None,
+                },
+                {"stage": "all_models", "seconds": 2.0, "rows": 4, "bytes": None},
+            ],
+        )
+        for i in range(20)
+    ]
+    # A failed run stops partway through, so its timings are left out.
+    runs.append(
+        PipelineRun(
+            id=20,
+            started_at=start + timedelta(hours=20),
+            seconds=1,
+            succeeded=False,
+            stages=[{"stage": "fetch_usgs", "seconds": 0.1, "rows": None, "bytes": None}],
+        )
+    )
+
+    df = summarize_stage_timings(get_stage_timings(runs)).set_index("stage")
+    assert df.loc["fetch_usgs", "runs"] == 20
+    assert df.loc["fetch_usgs", "latest_seconds"] == 4.0
+    assert df.loc["fetch_usgs", "p50_seconds"] == 1.0
+    assert df.loc["fetch_usgs", "regressed"]
+    assert not df.loc["all_models", "regressed"]
+
+
+def test_usgs_start_time_is_sent_in_utc(live_app, monkeypatch):
+    monkeypatch.setitem(live_app.config, "UPSTREAM_CACHE_DIR", "")
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append(params)
+        res = requests.models.Response()
+        res.status_code = 200
+        res._content = USGS_TWO_SITE_RESPONSE.encode()
+        res.encoding = "utf-8"
+        return res
+
+    start_time = datetime(2025, 1, 1, 0, 15, tzinfo=UTC)
+    with patch.object(requests.Session, "get", fake_get):
+        get_live_usgs_data_for_sites(start_time=start_time)
+
+    assert requested[0]["startDT"] == "2025-01-01T00:15+0000"
+    assert "endDT" not in requested[0]
+    assert "period" not in requested[0]
+
+
+def test_usgs_past_ranges_are_cached(live_app):
+    start_time = datetime(2025, 4, 1, 12, tzinfo=UTC)
+    end_time = datetime(2025, 4, 8, tzinfo=UTC)
+    requested = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        requested.append((params["startDT"], params["endDT"]))
+        res = requests.models.Response()
+        res.status_code = 200
+        res._content = USGS_TWO_SITE_RESPONSE.encode()
+        res.encoding = "utf-8"
+        return res
+
+    def handler(request):
+        requested.append((request.url.params["startDT"], request.url.params["endDT"]))
+        return httpx.Response(200, content=USGS_TWO_SITE_RESPONSE.encode())
+
+    with patch.object(requests.Session, "get", fake_get):
+        first = get_live_usgs_data_for_sites(start_time=start_time, end_time=end_time)
+        # The grid window that ends before `end_time` is cached, and only the
+        # rest of the range is requested again.
+        second = get_live_usgs_data_for_sites(start_time=start_time, end_time=end_time)
+    third = _run_with_async_client(
+        handler, get_live_usgs_data_for_sites_async, start_time=start_time, end_time=end_time
+    )
+
+    rest = ("2025-04-06T04:00+0000", "2025-04-08T00:00+0000")
+    assert requested == [("2025-03-30", "2025-04-05"), rest, rest, rest]
+    assert len(get_upstream_cache().entries()) == 1
+    for site_no in first:
+        pd.testing.assert_frame_equal(first[site_no], second[site_no])
+        pd.testing.assert_frame_equal(first[site_no], third[site_no])
+
+
+def test_sources_are_fetched_concurrently(app):
+    # Each fetch waits for the other one to start, so this only finishes if
+    # they run at the same time.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fake_usgs(**kwargs):
+        barrier.wait()
+        return {"01104500": "w", "01104683": "b"}
+
+    def fake_hobolink(**kwargs):
+        barrier.wait()
+        return "hobolink"
+
+    with (
+        patch.object(core, "get_live_usgs_data_for_sites", fake_usgs),
+        patch.object(core, "get_live_hobolink_data", fake_hobolink),
+    ):
+        data = core._get_source_data()
+
+    assert (data.df_usgs_w, data.df_usgs_b, data.df_hobolink) == ("w", "b", "hobolink")
+
+
+def test_source_fetch_timeout(app, monkeypatch):
+    monkeypatch.setitem(app.config, "SOURCE_FETCH_TIMEOUT_SECONDS", 0.1)
+    release = threading.Event()
+
+    def fake_hobolink(**kwargs):
+        release.wait(5)
+
+    try:
+        with (
+            patch.object(core, "get_live_usgs_data_for_sites", lambda **kwargs: {}),
+            patch.object(core, "get_live_hobolink_data", fake_hobolink),
+            pytest.raises(TimeoutError, match="hobolink"),
+        ):
+            core._get_source_data()
+    finally:
+        release.set()
+
+
+def test_source_snapshot_is_shared_by_every_model_version(app, cache):
+    # The database fixture already ran `update_db`, which stores a snapshot.
+    cache.clear()
+    core._snapshots.clear()
+    with patch.object(core, "_get_source_data", wraps=core._get_source_data) as mocked:
+        for model_version in core.ModelVersion:
+            core._combine_job(model_version=model_version)
+            core._predict_job(model_version=model_version)
+        assert mocked.call_count == 1
+
+        # Another process would only have the snapshot in the cache.
+        core._snapshots.clear()
+        core._predict_job()
+        assert mocked.call_count == 1
+
+        # The next time bucket gets a fresh snapshot.
+        now = core.time.time() + app.config["SOURCE_SNAPSHOT_TTL_SECONDS"]
+        with patch.object(core.time, "time", return_value=now):
+            core._predict_job()
+        assert mocked.call_count == 2
+
+
+def test_update_db_replaces_source_snapshot(app, db_session):
+    core.get_source_snapshot()
+    update_db()
+    with patch.object(core, "_get_source_data") as mocked:
+        core._predict_job()
+    mocked.assert_not_called()
+
+
+def test_upstream_client_honors_retry_after():
+    statuses = [503, 200]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = statuses.pop(0)
+            body = b"ok" if status == 200 else b""
+            self.send_response(status)
+            if status == 503:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = UpstreamClient("test", timeout=5, max_retries=2)
+        res = client.get(f"http://127.0.0.1:{server.server_port}/")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert res.status_code == 200
+    assert res.text == "ok"
+    assert statuses == []
+
+    metrics = client.metrics.to_dict()
+    assert metrics["requests"] == 1
+    assert metrics["status_codes"] == {200: 1}
+    assert metrics["bytes"] == 2
+
+
+def _run_with_async_client(handler, coro_func, **kwargs):
+    async def _main():
+        async with AsyncUpstreamClient(
+            max_connections=4,
+            timeouts={"hobolink": 5, "usgs": 5},
+            max_retries=0,
+            transport=httpx.MockTransport(handler),
+        ) as client:
+            return await coro_func(client=client, **kwargs)
+
+    return asyncio.run(_main())
+
+
+def test_async_hobolink_matches_blocking(live_app, monkeypatch):
+    monkeypatch.setitem(live_app.config, "UPSTREAM_CACHE_DIR", "")
+    start_date = datetime(2025, 1, 1, tzinfo=UTC)
+    end_date = start_date + timedelta(days=25)
+
+    def fake_get(self, url, params=None, **kwargs):
+        return _FakeHobolinkResponse(params, every="1h")
+
+    def handler(request):
+        res = _FakeHobolinkResponse(dict(request.url.params), every="1h")
+        return httpx.Response(200, content=b"".join(res.iter_content()))
+
+    with patch.object(requests.Session, "get", fake_get):
+        df_expected = get_live_hobolink_data(start_date=start_date, end_date=end_date)
+    df = _run_with_async_client(
+        handler, get_live_hobolink_data_async, start_date=start_date, end_date=end_date
+    )
+
+    assert len(df) == 25 * 24 + 1
+    pd.testing.assert_frame_equal(df, df_expected)
+
+
+def test_async_usgs_matches_blocking(live_app, monkeypatch):
+    monkeypatch.setitem(live_app.config, "UPSTREAM_CACHE_DIR", "")
+
+    def fake_get(self, url, params=None, **kwargs):
+        res = requests.models.Response()
+        res.status_code = 200
+        res._content = USGS_TWO_SITE_RESPONSE.encode()
+        res.encoding = "utf-8"
+        return res
+
+    def handler(request):
+        assert request.url.params["sites"] == "01104500,01104683"
+        return httpx.Response(200, content=USGS_TWO_SITE_RESPONSE.encode())
+
+    with patch.object(requests.Session, "get", fake_get):
+        expected = get_live_usgs_data_for_sites()
+    data = _run_with_async_client(handler, get_live_usgs_data_for_sites_async)
+
+    assert data.keys() == expected.keys()
+    for site_no in expected:
+        pd.testing.assert_frame_equal(data[site_no], expected[site_no])
+
+
+def test_async_usgs_with_end_time_matches_blocking(live_app, monkeypatch):
+    monkeypatch.setitem(live_app.config, "UPSTREAM_CACHE_DIR", "")
+    start_time = datetime(2025, 4, 1, 12, tzinfo=UTC)
+    end_time = datetime(2025, 4, 8, tzinfo=UTC)
+    params = []
+    expected_params = []
+
+    def fake_get(self, url, params=None, **kwargs):
+        expected_params.append(params)
+        res = requests.models.Response()
+        res.status_code = 200
+        res._content = USGS_TWO_SITE_RESPONSE.encode()
+        res.encoding = "utf-8"
+        return res
+
+    def handler(request):
+        params.append(dict(request.url.params))
+        return httpx.Response(200, content=USGS_TWO_SITE_RESPONSE.encode())
+
+    with patch.object(requests.Session, "get", fake_get):
+        expected = get_live_usgs_data_for_sites(start_time=start_time, end_time=end_time)
+    data = _run_with_async_client(
+        handler, get_live_usgs_data_for_sites_async, start_time=start_time, end_time=end_time
+    )
+
+    assert params == expected_params
+    assert params[0]["endDT"] == "2025-04-08T00:00+0000"
+    for site_no in expected:
+        pd.testing.assert_frame_equal(data[site_no], expected[site_no])
+
+
+def test_async_cache_is_read_off_the_event_loop(app):
+    cache = get_upstream_cache()
+    start = datetime(2025, 1, 1, tzinfo=UTC)
+    end = start + timedelta(days=1)
+    threads = []
+    read = cache.read
+
+    def fake_read(*args):
+        threads.append(threading.current_thread())
+        return read(*args)
+
+    async def fetch():
+        return b"body"
+
+    async def _main():
+        first = await upstream_async._get_body(cache, "test", "key", start, end, fetch)
+        second = await upstream_async._get_body(cache, "test", "key", start, end, fetch)
+        return first, second
+
+    with patch.object(cache, "read", fake_read):
+        first, second = asyncio.run(_main())
+
+    assert first == second == [b"body"]
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_async_retries_honor_retry_after(live_app, monkeypatch):
+    monkeypatch.setitem(live_app.config, "UPSTREAM_CACHE_DIR", "")
+    statuses = [429, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status == 429:
+            return httpx.Response(429, headers={"Retry-After": "0"})
+        return httpx.Response(200, content=USGS_TWO_SITE_RESPONSE.encode())
+
+    async def _main():
+        async with AsyncUpstreamClient(
+            max_connections=1,
+            timeouts={"usgs": 5},
+            max_retries=1,
+            transport=httpx.MockTransport(handler),
+        ) as client:
+            return await get_live_usgs_data_for_sites_async(client=client)
+
+    data = asyncio.run(_main())
+    assert statuses == []
+    assert len(data["01104500"]) == 2
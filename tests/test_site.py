@@ -59,6 +59,7 @@ def test_pages(client, page, expected_status_code):
         ("/admin/boathouses/", "admin:password", 200),
         ("/admin/db/update/", "admin:password", 200),
         ("/admin/db/download/", "admin:password", 200),
+        ("/admin/db/pipeline-runs/", "admin:password", 200),
     ],
 )
 def test_admin_pages(client, page, auth, expected_status_code):
@@ -76,6 +77,7 @@ def test_admin_pages(client, page, auth, expected_status_code):
         ("/admin/db/download/csv/src/usgs_b", "admin:password", 200),
         ("/admin/db/download/csv/src/processed_data", "admin:password", 200),
         ("/admin/db/download/csv/src/prediction", "admin:password", 200),
+        ("/admin/db/download/csv/src/prediction_backfill", "admin:password", 200),
         ("/admin/db/download/csv/src/boathouse", "admin:password", 200),
         ("/admin/db/download/csv/src/override_history", "admin:password", 200),
         ("/admin/db/download/csv/src_sync/processed_data_v1_source", "admin:password", 200),  # noqa